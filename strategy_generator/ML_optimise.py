@@ -4,12 +4,14 @@ import optuna.visualization as vis
 import numpy as np
 from back_tester import backtest_strategy
 from combined_strategy import combined_strategy
+from stage_profiler import profiled_objective, print_stage_profile, export_stage_profile
 from indicator_filter import *
 from indicator_setup import *
 from indicator_trigger import *
 from strategy_generator.indicator_param_dict_intra import *
 
 
+@profiled_objective
 def objective(trial):
 
     # Select a filter function
@@ -120,6 +122,8 @@ if __name__ == "__main__":
     
     # Optimize the objective function
     study.optimize(objective, n_trials=NUMBER_OF_TRIALS)
+    print_stage_profile()
+    export_stage_profile('ML_optimise')
 
     if MULTI_OBJECTIVE:
         # Handle multi-objective case
@@ -6,12 +6,18 @@ import pandas as pd
 from tabulate import tabulate
 from back_tester import backtest_strategy, backtest_strategy_returning_metrics
 from combined_strategy import combined_strategy
+from parallel_optimise import run_parallel_study
+from indicator_cache import print_indicator_cache_stats
+from feature_store import precompute_sweep_features, print_feature_store_stats
+from bar_cache import print_bar_cache_stats
+from stage_profiler import profiled_objective, print_stage_profile, export_stage_profile
 from indicator_filter import *
 from indicator_setup import *
 from indicator_trigger import *
 from indicator_param_dictionary import *
 
 
+@profiled_objective
 def objective(trial):
 
     # Select a filter function
@@ -55,7 +61,7 @@ def objective(trial):
 
     # Create strategy instance with selected functions and suggested parameters
     strategy_df = combined_strategy(
-        df.copy(),
+        df,
         filter_func,
         setup_func,
         trigger_func,
@@ -131,6 +137,7 @@ def run_validation_on_pareto_front(study):
         unseen_data_set.append(unseen_data_4)
         # unseen_data_5 = fetch_data('Unseen 5')
         # unseen_data_set.append(unseen_data_5)
+        print_bar_cache_stats()
 
         # Lists to store results for each trial
         results_profit = []  # Results for Normalized Profit
@@ -162,7 +169,7 @@ def run_validation_on_pareto_front(study):
             signaled_data_set = []
             for unseen_data in unseen_data_set:
                 unseen_strategy_df = combined_strategy(
-                    unseen_data.copy(), 
+                    unseen_data, 
                     best_filter_func, 
                     best_setup_func, 
                     best_trigger_func, 
@@ -228,14 +235,26 @@ if __name__ == "__main__":
 
     df = fetch_data('Training')
 
-    # Create a study object depending on the optimization type
-    if MULTI_OBJECTIVE:
-        study = optuna.create_study(directions=['maximize', 'maximize'], pruner=optuna.pruners.MedianPruner())
+    if PARALLEL_OPTIMISATION:
+        # Spread the trials across worker processes
+        study = run_parallel_study('ML_optimise_swing', df, NUMBER_OF_TRIALS)
+
     else:
-        study = optuna.create_study(direction='maximize')
-    
-    # Optimize the objective function
-    study.optimize(objective, n_trials=NUMBER_OF_TRIALS)
+        # Create a study object depending on the optimization type
+        if MULTI_OBJECTIVE:
+            study = optuna.create_study(directions=['maximize', 'maximize'], pruner=optuna.pruners.MedianPruner())
+        else:
+            study = optuna.create_study(direction='maximize')
+
+        precompute_sweep_features(df, functions_info)
+
+        # Optimize the objective function
+        study.optimize(objective, n_trials=NUMBER_OF_TRIALS)
+        print_indicator_cache_stats()
+        print_feature_store_stats()
+        print_bar_cache_stats()
+        print_stage_profile()
+        export_stage_profile('ML_optimise_swing')
 
     if MULTI_OBJECTIVE:
         # Handle multi-objective case
@@ -6,6 +6,12 @@ import pandas as pd
 from tabulate import tabulate
 from back_tester import backtest_strategy, backtest_strategy_returning_metrics
 from combined_strategy import combined_strategy
+from parallel_optimise import run_parallel_study
+from batch_back_tester import suggest_candidate, run_batched_study
+from indicator_cache import print_indicator_cache_stats
+from feature_store import precompute_sweep_features, print_feature_store_stats
+from bar_cache import print_bar_cache_stats
+from stage_profiler import profiled_objective, print_stage_profile, export_stage_profile
 from indicator_filter import *
 from indicator_setup import *
 from indicator_trigger import *
@@ -13,65 +19,24 @@ from indicator_param_dict_intra import *
 from indicator_param_dict_swing import *
 
 
-def objective(trial):
-
+def get_functions_info():
     # Define functions info depending on whether approach is intraday or swing trading
     if SWING_TRADING:
-        functions_info = intra_functions_info
+        return intra_functions_info
     elif INTRADAY_TRADING:
-        functions_info = swing_functions_info
+        return swing_functions_info
     else:
         raise ValueError("Unknown condition, cannot determine the function info")
 
-    # Select a filter function
-    filter_func_name = trial.suggest_categorical('filter_func', list(functions_info['filter_functions'].keys()))
-    filter_func_info = functions_info['filter_functions'][filter_func_name]
-    filter_func = filter_func_info['function']
-    
-    # Select a setup function
-    setup_func_name = trial.suggest_categorical('setup_func', list(functions_info['setup_functions'].keys()))
-    setup_func_info = functions_info['setup_functions'][setup_func_name]
-    setup_func = setup_func_info['function']
-    
-    # Select a trigger function
-    trigger_func_name = trial.suggest_categorical('trigger_func', list(functions_info['trigger_functions'].keys()))
-    trigger_func_info = functions_info['trigger_functions'][trigger_func_name]
-    trigger_func = trigger_func_info['function']
-
-    # Dynamically suggest parameters for each selected function
-    filter_params = {}
-    setup_params = {}
-    trigger_params = {}
-
-    for param_name, (param_type, start, end) in filter_func_info['params'].items():
-        if param_type == 'int':
-            filter_params[param_name] = trial.suggest_int(f'filter_{filter_func_name}_{param_name}', start, end)
-        elif param_type == 'float':
-            filter_params[param_name] = trial.suggest_float(f'filter_{filter_func_name}_{param_name}', start, end, step=FLOAT_PRECISION)
-
-    for param_name, (param_type, start, end) in setup_func_info['params'].items():
-        if param_type == 'int':
-            setup_params[param_name] = trial.suggest_int(f'setup_{setup_func_name}_{param_name}', start, end)
-        elif param_type == 'float':
-            setup_params[param_name] = trial.suggest_float(f'setup_{setup_func_name}_{param_name}', start, end, step=FLOAT_PRECISION)
-
-    for param_name, (param_type, start, end) in trigger_func_info['params'].items():
-        if param_type == 'int':
-            trigger_params[param_name] = trial.suggest_int(f'trigger_{trigger_func_name}_{param_name}', start, end)
-        elif param_type == 'float':
-            trigger_params[param_name] = trial.suggest_float(f'trigger_{trigger_func_name}_{param_name}', start, end, step=FLOAT_PRECISION)
 
+@profiled_objective
+def objective(trial):
+
+    # Select the filter, setup and trigger functions and suggest their parameters
+    candidate = suggest_candidate(trial, get_functions_info())
 
     # Create strategy instance with selected functions and suggested parameters
-    strategy_df = combined_strategy(
-        df.copy(),
-        filter_func,
-        setup_func,
-        trigger_func,
-        filter_params=filter_params,
-        setup_params=setup_params,
-        trigger_params=trigger_params
-    )
+    strategy_df = combined_strategy(df, **candidate)
 
     # Backtest strategy
     if MULTI_OBJECTIVE:
@@ -140,6 +105,7 @@ def run_validation_on_pareto_front(study):
         unseen_data_set.append(unseen_data_4)
         # unseen_data_5 = fetch_data('Unseen 5')
         # unseen_data_set.append(unseen_data_5)
+        print_bar_cache_stats()
 
         # Lists to store results for each trial
         results_profit = []  # Results for Normalized Profit
@@ -171,7 +137,7 @@ def run_validation_on_pareto_front(study):
             signaled_data_set = []
             for unseen_data in unseen_data_set:
                 unseen_strategy_df = combined_strategy(
-                    unseen_data.copy(), 
+                    unseen_data, 
                     best_filter_func, 
                     best_setup_func, 
                     best_trigger_func, 
@@ -237,14 +203,30 @@ if __name__ == "__main__":
 
     df = fetch_data('Training')
 
-    # Create a study object depending on the optimization type
-    if MULTI_OBJECTIVE:
-        study = optuna.create_study(directions=['maximize', 'maximize'], pruner=optuna.pruners.MedianPruner())
+    if PARALLEL_OPTIMISATION:
+        # Spread the trials across worker processes
+        study = run_parallel_study('ML_optimise_v3', df, NUMBER_OF_TRIALS)
+
     else:
-        study = optuna.create_study(direction='maximize')
-    
-    # Optimize the objective function
-    study.optimize(objective, n_trials=NUMBER_OF_TRIALS)
+        # Create a study object depending on the optimization type
+        if MULTI_OBJECTIVE:
+            study = optuna.create_study(directions=['maximize', 'maximize'], pruner=optuna.pruners.MedianPruner())
+        else:
+            study = optuna.create_study(direction='maximize')
+
+        precompute_sweep_features(df, get_functions_info())
+
+        # Optimize the objective function
+        if OPTIMISATION_BATCH_SIZE:
+            run_batched_study(study, get_functions_info(), df, NUMBER_OF_TRIALS, OPTIMISATION_BATCH_SIZE)
+        else:
+            study.optimize(objective, n_trials=NUMBER_OF_TRIALS)
+
+        print_indicator_cache_stats()
+        print_feature_store_stats()
+        print_bar_cache_stats()
+        print_stage_profile()
+        export_stage_profile('ML_optimise_v3')
 
     if MULTI_OBJECTIVE:
         # Handle multi-objective case
@@ -7,6 +7,9 @@ from alpaca.common.exceptions import APIError
 from dotenv import load_dotenv
 from trading_session import *
 from back_tester import open_trade
+from latency_monitor import mark_latency
+from trade_updates import get_order_state, order_is_final, start_trade_updates_stream, symbol_key
+import asyncio
 import time
 import logging
 
@@ -20,12 +23,21 @@ elif(STOCK):
     time_in_force = TimeInForce.DAY
     TICKER = TICKER
 
+# Symbols traded live
+SYMBOLS = LIVE_SYMBOLS or [TICKER]
+
 # Alpaca API credentials
 API_KEY = os.getenv('ALPACA_PERSONAL_API_KEY_ID')
 SECRET_KEY = os.getenv('ALPACA_PERSONAL_API_SECRET_KEY')
 
 trading_client = TradingClient(API_KEY, SECRET_KEY, paper=True)
 
+# Fill polling tasks of open orders by order id, so closing a trade can wait for its open price
+pending_fills = {}
+
+# References to the tasks running in the background, which asyncio only holds weakly
+background_tasks = set()
+
 
 # Setting up logging configuration (optional)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -81,13 +93,13 @@ def log_close_position_info(order_response):
 
 # ********* OPENING TRADES ********** #
 
-def prepare_and_submit_bracket_order(take_profit_price, stop_loss_price):
+def prepare_and_submit_bracket_order(take_profit_price, stop_loss_price, symbol=TICKER):
     take_profit = TakeProfitRequest(limit_price=take_profit_price)
     stop_loss = StopLossRequest(stop_price=stop_loss_price)
     try:
         # Submit a bracket order (market buy + attached take-profit and stop-loss)
         market_order = MarketOrderRequest(
-            symbol=TICKER,
+            symbol=symbol,
             qty=QUANTITY,
             side=OrderSide.BUY,
             time_in_force=TimeInForce.DAY,
@@ -96,6 +108,7 @@ def prepare_and_submit_bracket_order(take_profit_price, stop_loss_price):
             stop_loss=stop_loss
         )
         order_response = trading_client.submit_order(order_data=market_order)
+        mark_latency('order_acked')
 
     except APIError as api_err:
         print(f"Alpaca API error: {api_err}")
@@ -107,14 +120,15 @@ def prepare_and_submit_bracket_order(take_profit_price, stop_loss_price):
     return order_response
 
 
-def prepare_and_submit_open_long_order():
+def prepare_and_submit_open_long_order(symbol=TICKER):
     try:
         market_order = MarketOrderRequest(
-                            symbol=TICKER,
+                            symbol=symbol,
                             qty=QUANTITY,
                             side=OrderSide.BUY,
                             time_in_force=time_in_force)
         order_response = trading_client.submit_order(order_data=market_order)
+        mark_latency('order_acked')
     
     except APIError as api_err:
         print(f"Alpaca API error: {api_err}")
@@ -126,85 +140,203 @@ def prepare_and_submit_open_long_order():
     return order_response
 
 
-def open_trade_alpaca(trade):
+async def run_blocking(func, *args):
+    """
+    Runs a blocking trading client call on the event loop's thread pool, so bars keep being processed meanwhile.
+    The call sees the calling task's context, e.g. the receipt time of the bar being processed.
+    """
+    return await asyncio.to_thread(func, *args)
+
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def wait_for_fill(order_id, initial_delay=ORDER_POLL_INITIAL_DELAY, max_delay=ORDER_POLL_MAX_DELAY, timeout=ORDER_FILL_TIMEOUT):
+    """
+    Waits for the order to fill or reach a status it can no longer fill from. The trade updates stream reports
+    this when running, otherwise (or if the stream never reports the order) the order is polled, doubling
+    the delay between polls up to max_delay.
+
+    Returns:
+        Order: The latest order details, which may be unfilled if it was cancelled, rejected or timed out, or None
+            if they could not be fetched.
     """
-    Returns True if successful, False if not
+    if USE_TRADE_UPDATES_STREAM:
+        order = await get_order_state().wait_for_order(order_id, timeout)
+        if order is not None:
+            return order
+
+    deadline = asyncio.get_running_loop().time() + timeout
+    delay = initial_delay
+    while True:
+        order = await run_blocking(get_order_details_by_id, order_id)
+        if order is not None and order_is_final(order):
+            return order
+
+        if asyncio.get_running_loop().time() + delay > deadline:
+            logging.warning(f"Order {order_id} has not filled after {timeout}s")
+            return order
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+async def update_trade_when_opened(trade, order_id, take_profit_price, stop_loss_price):
+    filled_order = await wait_for_fill(order_id)
+    if filled_order is None or not filled_order.filled_avg_price:
+        logging.error(f"Open order {order_id} did not fill, the trade keeps the bar close as its open price")
+        return filled_order
+
+    log_open_position_info(take_profit_price, stop_loss_price, filled_order)
+    trade.open_price_of_trade = round(float(filled_order.filled_avg_price), 2)
+    trade.value_of_trade = trade.calculate_value_of_trade()
+    return filled_order
+
+
+async def wait_for_open_fill(trade):
+    """
+    Waits for the order opening the trade, so a position that has not opened yet isn't taken as already closed.
+
+    Returns:
+        bool: False if the open order could still fill, in which case its fill keeps being waited for in the background.
+    """
+    open_fill = pending_fills.get(trade.alpaca_order_id)
+    if open_fill is None:
+        return True
+
+    opened_order = await open_fill
+    if opened_order is not None and not order_is_final(opened_order):
+        pending_fills[trade.alpaca_order_id] = run_in_background(
+            update_trade_when_opened(trade, trade.alpaca_order_id, trade.take_profit_price, trade.stop_loss_price))
+        return False
+    return True
+
+
+async def open_trade_alpaca(trade, symbol=TICKER):
+    """
+    Submits the order opening the trade, then updates the trade with the fill price in the background.
+
+    Returns True if the order was submitted, False if not
     """
     if CLOSE_POSITION_WITH_SLTP:
         print("\n\nOpening a long position, with stop loss / take profit\n")
-        order_response = prepare_and_submit_bracket_order(trade.take_profit_price, trade.stop_loss_price)
-        time.sleep(5)
-        if order_response:
-            filled_order = get_order_details_by_id(str(order_response.id))
-            log_open_position_info(trade.take_profit_price, trade.stop_loss_price, filled_order)
-            trade.alpaca_order_id = str(filled_order.id)
-            trade.open_price_of_trade = round(float(filled_order.filled_avg_price), 2)
-            trade.calculate_value_of_trade() # TODO its a bit messy these three are all being calculated twice, should reorder when we open system trade or the values we pass it. However requires a big rework as we calc the atr of the growing df from alpaca - might be fine to leace it
-            trade.calculate_ATR_stop_loss_price()
-            trade.calculate_ATR_take_profit_price()
-        else:
-            logging.error(f"Failed to submit order for {TICKER}")
-            logging.error(f"A buy signal has been missed")
-            return False
-
+        order_response = await run_blocking(prepare_and_submit_bracket_order, trade.take_profit_price, trade.stop_loss_price, symbol)
+        take_profit_price, stop_loss_price = trade.take_profit_price, trade.stop_loss_price
     else:
         print("\n\nOpening a long position\n")
-        order_response = prepare_and_submit_open_long_order()
-        time.sleep(5)
-        if order_response:
-            filled_order = get_order_details_by_id(str(order_response.id))
-            log_open_position_info(0.0, 0.0, filled_order)
-            trade.alpaca_order_id = str(filled_order.id)
-            trade.open_price_of_trade = round(float(filled_order.filled_avg_price), 2)
-            trade.calculate_value_of_trade()
-        else:
-            logging.error(f"Failed to submit order for {TICKER}")
-            logging.error(f"A buy signal has been missed")
-            return False
+        order_response = await run_blocking(prepare_and_submit_open_long_order, symbol)
+        take_profit_price, stop_loss_price = 0.0, 0.0
+
+    if not order_response:
+        logging.error(f"Failed to submit order for {symbol}")
+        logging.error(f"A buy signal has been missed")
+        return False
 
+    trade.alpaca_order_id = str(order_response.id)
+    pending_fills[trade.alpaca_order_id] = run_in_background(
+        update_trade_when_opened(trade, trade.alpaca_order_id, take_profit_price, stop_loss_price))
     return True
 
 
 # ********* CLOSING TRADES ********** #
 
-def close_alpaca_trade(trade):
+async def close_alpaca_trade(trading_session, trade, latest_bar, close_reason, symbol=TICKER):
     """
     First checks if order already closed. If not then attempts to close by order id, if this fails it attempts to close all open positions.
+    The trade is added to the trading session once the close price is known, which for a closed position is
+    once its order fills, in the background.
+
+    The position is looked up in the trade updates stream's state when it is running, and fetched from the
+    REST API otherwise or when the stream has it as closed, as the stream doesn't replay the updates it missed
+    while disconnected and never reports an open fill it missed. Closing every position is only attempted when
+    a single symbol is traded, as it would otherwise close the positions of the other symbols too.
+
+    The order opening the trade is waited for first, and the trade is kept open while that order could still fill.
     """
-    positions = get_open_positions()
-    if len(positions) == 0:
-        print("\nAlpaca order is already closed (Should be due to stop loss / take profit)") # TODO this scenario will have an slightly innacurate trade card as we are not updating from Alpaca
+    if not await wait_for_open_fill(trade):
+        logging.warning(f"Open order {trade.alpaca_order_id} has not filled yet, the trade is closed on a later bar")
+        return False
+
+    position = get_order_state().position(symbol) if USE_TRADE_UPDATES_STREAM else None
+    if position is None or position[0] == 0:
+        open_position = await run_blocking(get_open_position, symbol)
+        position_quantity, asset_id = (float(open_position.qty), open_position.asset_id) if open_position else (0.0, None)
+    else:
+        position_quantity, asset_id = position
+
+    if position_quantity == 0:
+        print("\nAlpaca order is already closed (Should be due to stop loss / take profit)")
+        update_trade_with_bracket_fill(trade, symbol)
+        await record_closed_trade(trading_session, trade, latest_bar, close_reason)
         return True
-    
-    close_trade_successful = close_open_position(positions[0], trade)
-    if close_trade_successful:
-        # print(f"\nClosing position with asset id: {positions[0].asset_id}\n") # TODO add proper logging for this
+
+    close_order = await run_blocking(close_open_position, asset_id or symbol)
+    if close_order is not None:
+        # print(f"\nClosing position with asset id: {asset_id}\n") # TODO add proper logging for this
+        run_in_background(update_trade_when_closed(trading_session, trade, close_order, latest_bar, close_reason))
         return True
     else:
-        close_all_success = close_all_trades_alpaca()
+        close_all_success = len(SYMBOLS) == 1 and await run_blocking(close_all_trades_alpaca)
         if not close_all_success:
             print("\nURGENT: Bot has failed to close the trade, please make a manual intervention as the trade is still open!")
             return False
+    await record_closed_trade(trading_session, trade, latest_bar, close_reason)
     return True
 
 
-def close_open_position(position, trade):
+def update_trade_with_bracket_fill(trade, symbol=TICKER):
+    """
+    Sets the close price of a trade whose stop loss or take profit order filled on Alpaca, as reported by the
+    trade updates stream. Without the stream the trade is closed at the latest bar's close.
+    """
+    if not USE_TRADE_UPDATES_STREAM:
+        return
+
+    fill = get_order_state().last_fill(symbol, OrderSide.SELL)
+    if fill is not None and fill.filled_at is not None and fill.filled_at >= pd.Timestamp(trade.open_time):
+        update_system_trade_with_alpaca_trade_details(fill, trade)
+
+
+def close_open_position(symbol_or_asset_id):
+    """
+    Returns the order closing the position, None if it could not be closed
+    """
     try:
-        close_order = trading_client.close_position(position.asset_id)
-        time.sleep(5) # TODO may be a better way to do this
-        closed_order = get_order_details_by_id(close_order.id)
-        update_system_trade_with_alpaca_trade_details(closed_order, trade)
-        log_close_position_info(close_order)
-        return True
+        close_order = trading_client.close_position(symbol_or_asset_id)
+        mark_latency('order_acked')
+        return close_order
     except Exception as e:
         logging.error(f"Error closing position by order ID: {e}")
-        return False
+        return None
+
+
+async def update_trade_when_closed(trading_session, trade, close_order, latest_bar, close_reason):
+    closed_order = await wait_for_fill(str(close_order.id))
+    if closed_order is not None and closed_order.filled_avg_price:
+        update_system_trade_with_alpaca_trade_details(closed_order, trade)
+    log_close_position_info(close_order)
+    await record_closed_trade(trading_session, trade, latest_bar, close_reason)
+
+
+async def record_closed_trade(trading_session, trade, latest_bar, close_reason):
+    # The trade's open price has to be known before it is recorded
+    open_fill = pending_fills.pop(trade.alpaca_order_id, None)
+    if open_fill is not None:
+        await open_fill
+
+    trading_session.add_trade(trade.close_trade(latest_bar['Datetime'], latest_bar['Close'], close_reason))
+    print(trade)
 
 
 def close_all_trades_alpaca():
     try:
         print("Attempting to close all trades")
         trading_client.close_all_positions()
+        mark_latency('order_acked')
         print("Closed all trades")
         return True
 
@@ -245,14 +377,14 @@ def get_order_details_by_id(order_id):
         logging.error(f"Error retrieving order details: {e}")
         return None
 
-def get_position_for_ticker():
-    open_position = trading_client.get_open_position(TICKER)
+def get_position_for_ticker(symbol=TICKER):
+    open_position = trading_client.get_open_position(symbol)
     return open_position
 
-def get_open_position():
-    positions = trading_client.list_positions()
+def get_open_position(symbol=TICKER):
+    positions = trading_client.get_all_positions()
     for position in positions:
-        if position.symbol == TICKER:
+        if symbol_key(position.symbol) == symbol_key(symbol):
             return position
     return None
 
@@ -261,6 +393,19 @@ def update_system_trade_with_alpaca_trade_details(order, trade):
         trade.close_price_of_trade = round(float(order.filled_avg_price), 2)
 
 
+def start_trade_updates():
+    """
+    Starts keeping the order and position state from the trade updates stream when USE_TRADE_UPDATES_STREAM is set,
+    seeded with the positions already open.
+    """
+    if not USE_TRADE_UPDATES_STREAM:
+        return None
+
+    stream = start_trade_updates_stream(API_KEY, SECRET_KEY, get_order_state(), url=TRADE_UPDATES_URL)
+    get_order_state().seed_positions(get_open_positions())
+    return stream
+
+
 def get_current_buying_power():
     account = trading_client.get_account()
     buying_power = float(account.buying_power)
@@ -271,50 +416,158 @@ def get_current_buying_power():
 
 # ********* LOGIC TO READ AND EXECUTE USING SIGNALS ********** #
 
-def analyse_latest_alpaca_bar(trading_session, trade, latest_bar):
+async def analyse_latest_alpaca_bar(trading_session, trade, latest_bar, symbol=TICKER):
+    """
+    Opens or closes the trade in symbol on its latest bar. Orders are submitted without blocking the event loop
+    and their fills are waited for in the background, so the next bar is processed straight away.
+    """
 
     if trade is None:
         if latest_bar['Combined_Signal'] == 1: # Open Long with buy signal
+            mark_latency('decision')
             trade = open_trade(latest_bar['Datetime'], latest_bar['Close'], latest_bar['ATR'])
-            open_trade_successful = open_trade_alpaca(trade)
+            open_trade_successful = await open_trade_alpaca(trade, symbol)
             if not open_trade_successful:
                 trade = None    
 
     elif trade is not None:
         if latest_bar['Combined_Signal'] == -1: # Close Long with sell signal
-            close_success = close_alpaca_trade(trade)
+            mark_latency('decision')
+            close_success = await close_alpaca_trade(trading_session, trade, latest_bar, "Reached sell signal", symbol)
             if close_success:
-                trading_session.add_trade(trade.close_trade(latest_bar['Datetime'], latest_bar['Close'], "Reached sell signal"))
-                print(trade)
                 trade = None
         elif CLOSE_POSITION_WITH_SLTP:
             if latest_bar['High'] >= trade.take_profit_price: # Close Long with take profit
-                close_success = close_alpaca_trade(trade)
+                mark_latency('decision')
+                close_success = await close_alpaca_trade(trading_session, trade, latest_bar, "Reached take profit", symbol)
                 if close_success:
-                    trading_session.add_trade(trade.close_trade(latest_bar['Datetime'], latest_bar['Close'], "Reached take profit"))
-                    print(trade)
                     trade = None
             elif latest_bar['Low'] <= trade.stop_loss_price: # Close Long with stop loss
-                close_success = close_alpaca_trade(trade)
+                mark_latency('decision')
+                close_success = await close_alpaca_trade(trading_session, trade, latest_bar, "Reached stop loss", symbol)
                 if close_success:
-                    trading_session.add_trade(trade.close_trade(latest_bar['Datetime'], latest_bar['Close'], "Reached stop loss"))
-                    print(trade)
                     trade = None
 
     return trade, trading_session
 
 
+def test_close_before_open_fill(fill_delay=0.5):
+    """
+    Closes a trade on the bar after it opened while its open order is still filling, checking the position is
+    closed once the open order fills rather than the trade being taken as already closed by its stop loss / take profit.
+    """
+    global trading_client, USE_TRADE_UPDATES_STREAM
+    from types import SimpleNamespace
+    from alpaca.trading.enums import OrderStatus
+
+    class Delayed_fill_client:
+        # Fills the open order fill_delay seconds after it is submitted, and the order closing the position straight away
+        def __init__(self):
+            self.submitted_at = None
+            self.position_closed = False
+
+        def open_filled(self):
+            return self.submitted_at is not None and time.monotonic() - self.submitted_at >= fill_delay
+
+        def order(self, order_id, filled_avg_price):
+            status = OrderStatus.FILLED if filled_avg_price else OrderStatus.NEW
+            return SimpleNamespace(id=order_id, asset_id='asset', symbol=TICKER, qty=QUANTITY, status=status, filled_avg_price=filled_avg_price)
+
+        def submit_order(self, order_data):
+            self.submitted_at = time.monotonic()
+            return self.order('open', None)
+
+        def get_order_by_id(self, order_id):
+            if order_id == 'open':
+                return self.order(order_id, '101.0' if self.open_filled() else None)
+            return self.order(order_id, '103.0')
+
+        def get_all_positions(self):
+            if self.open_filled() and not self.position_closed:
+                return [SimpleNamespace(asset_id='asset', qty=str(QUANTITY), symbol=TICKER)]
+            return []
+
+        def close_position(self, symbol_or_asset_id):
+            assert self.open_filled(), "The position was closed before it opened"
+            self.position_closed = True
+            return self.order('close', None)
+
+    async def run_test():
+        trading_session = Trading_session(STARTING_BALANCE)
+        opening_bar = {'Combined_Signal': 1, 'Datetime': pd.Timestamp.now(tz='UTC'), 'Close': 100.0, 'High': 100.0, 'Low': 100.0, 'ATR': 1.0}
+        closing_bar = dict(opening_bar, Combined_Signal=-1, Close=102.0)
+
+        trade, trading_session = await analyse_latest_alpaca_bar(trading_session, None, opening_bar)
+        trade, trading_session = await analyse_latest_alpaca_bar(trading_session, trade, closing_bar)
+        await asyncio.gather(*background_tasks)
+        return trade, trading_session
+
+    client, stream = trading_client, USE_TRADE_UPDATES_STREAM
+    trading_client, USE_TRADE_UPDATES_STREAM = Delayed_fill_client(), False
+    try:
+        trade, trading_session = asyncio.run(run_test())
+        assert trade is None and trading_client.position_closed
+    finally:
+        trading_client, USE_TRADE_UPDATES_STREAM = client, stream
+
+    closed_trade = trading_session.trades[0]
+    assert (closed_trade.open_price_of_trade, closed_trade.close_price_of_trade) == (101.0, 103.0), closed_trade
+    print("Close before open fill test passed")
+
+
+def test_close_after_missed_stream_fill():
+    """
+    Closes a trade whose open fill the trade updates stream missed, e.g. while reconnecting, checking the
+    position the stream has as closed is confirmed over REST and closed rather than left open on Alpaca.
+    """
+    global trading_client, USE_TRADE_UPDATES_STREAM
+    import trade_updates
+    from types import SimpleNamespace
+    from alpaca.trading.enums import OrderStatus
+    from trade_updates import Order_state_cache
+
+    def order(order_id, status, filled_avg_price=None):
+        return SimpleNamespace(id=order_id, asset_id='asset', symbol=TICKER, qty=QUANTITY, side=OrderSide.SELL,
+                               status=status, filled_avg_price=filled_avg_price)
+
+    class Open_position_client:
+        # Alpaca still holds the position the stream never reported
+        def __init__(self):
+            self.position_closed = False
+
+        def get_all_positions(self):
+            return [] if self.position_closed else [SimpleNamespace(asset_id='asset', qty=str(QUANTITY), symbol=TICKER)]
+
+        def close_position(self, symbol_or_asset_id):
+            self.position_closed = True
+            return order('close', OrderStatus.NEW)
+
+    async def run_test(order_state):
+        trading_session = Trading_session(STARTING_BALANCE)
+        closing_bar = {'Combined_Signal': -1, 'Datetime': pd.Timestamp.now(tz='UTC'), 'Close': 102.0, 'High': 102.0, 'Low': 102.0, 'ATR': 1.0}
+        trade = open_trade(closing_bar['Datetime'], 100.0, 1.0)
+        trade.alpaca_order_id = 'open'
+
+        trade, trading_session = await analyse_latest_alpaca_bar(trading_session, trade, closing_bar)
+        # The stream reports the order closing the position
+        await order_state.on_trade_update(SimpleNamespace(order=order('close', OrderStatus.FILLED, '103.0'), position_qty='0'))
+        await asyncio.gather(*background_tasks)
+        return trade, trading_session
+
+    client, stream, state = trading_client, USE_TRADE_UPDATES_STREAM, trade_updates.order_state
+    trading_client, USE_TRADE_UPDATES_STREAM = Open_position_client(), True
+    trade_updates.order_state = Order_state_cache()
+    trade_updates.order_state.seed_positions([])  # Seeded before the open, whose fill the stream then missed
+    try:
+        trade, trading_session = asyncio.run(run_test(trade_updates.order_state))
+        assert trade is None and trading_client.position_closed
+    finally:
+        trading_client, USE_TRADE_UPDATES_STREAM, trade_updates.order_state = client, stream, state
+
+    assert trading_session.trades[0].close_price_of_trade == 103.0, trading_session.trades[0]
+    print("Close after missed stream fill test passed")
+
+
 if __name__ == "__main__":
-    # market_order = MarketOrderRequest(
-    #                     symbol=TICKER,
-    #                     qty=QUANTITY,
-    #                     side=OrderSide.BUY,
-    #                     time_in_force=time_in_force)
-    # order_response = trading_client.submit_order(order_data=market_order)
-    close_order = trading_client.close_position("5344140c-ca01-4435-8a4a-217d4496bd35")
-    print(close_order)
-    # a = get_open_positions()[0]
-    # b = trading_client.close_position(get_open_positions()[0].asset_id)
-    # time.sleep(5)
-    # print(b)
-    # print(get_order_details_by_id(b.id))
+    test_close_before_open_fill()
+    test_close_after_missed_stream_fill()
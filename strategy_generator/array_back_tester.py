@@ -0,0 +1,239 @@
+from globals import *
+from trading_session import *
+from numba_compat import njit, NUMBA_AVAILABLE
+from compact_bars import restore_prices
+import numpy as np
+import pandas as pd
+
+
+# Close reasons recorded against each simulated trade, indexed by the reason codes below
+CLOSE_REASONS = ["Reached sell signal", "Reached take profit", "Reached stop loss", "End of day, closing"]
+SELL_SIGNAL, TAKE_PROFIT, STOP_LOSS, END_OF_DAY = range(len(CLOSE_REASONS))
+
+
+def extract_backtest_arrays(df):
+    """
+    Pulls the columns the backtest needs out of the strategy DataFrame as NumPy arrays.
+
+    Args:
+        df (pd.DataFrame): DataFrame with 'Combined_Signal', 'High', 'Low', 'Close' and 'ATR' columns.
+
+    Returns:
+        dict: Column name to NumPy array, with prices as float64, float32 prices rounded back to the prices
+            they were stored from.
+    """
+    return {
+        'Combined_Signal': df['Combined_Signal'].to_numpy(),
+        'High': restore_prices(df['High']),
+        'Low': restore_prices(df['Low']),
+        'Close': restore_prices(df['Close']),
+        'ATR': df['ATR'].to_numpy(dtype=np.float64),
+    }
+
+
+def round_like_python(values, decimals=2):
+    """
+    Rounds every element exactly as Python's built-in round() would, which is what Trade uses for its prices.
+
+    np.round scales by 10**decimals before rounding, so it can land on the other side of a tie to round().
+    Only elements sitting close to a tie can disagree, and those are re-rounded in Python.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie):
+        rounded[i] = round(float(values[i]), decimals)
+    return rounded
+
+
+def calculate_trade_levels(close, atr):
+    """
+    Calculates the take profit and stop loss price a trade opened on each bar would have.
+
+    Mirrors the rounded open price and Trade.calculate_ATR_take_profit_price / calculate_ATR_stop_loss_price
+    for every bar at once.
+    """
+    open_price = round_like_python(close)
+    ATR_stop_loss_distance = atr * ATR_MULTIPLIER
+    ATR_take_profit_distance = ATR_stop_loss_distance * RISK_REWARD_RATIO
+    take_profit = round_like_python(open_price + ATR_take_profit_distance)
+    stop_loss = round_like_python(open_price - ATR_stop_loss_distance)
+    return open_price, take_profit, stop_loss
+
+
+def intraday_trade_state_machine(signal, high, low, close, open_price, take_profit, stop_loss, close_with_sltp):
+    """
+    The analyse_row state machine over bar arrays: open on a buy signal, then close on a sell signal,
+    on the high reaching the take profit or on the low reaching the stop loss, checked in that order.
+
+    Written so the same source runs as a numba kernel over arrays or as plain Python over lists.
+
+    Returns:
+        tuple: Entry indices, exit indices, entry prices, exit prices and close reason codes of every completed trade.
+    """
+    n = len(signal)
+    entries = np.empty(n // 2 + 1, dtype=np.int64)
+    exits = np.empty(n // 2 + 1, dtype=np.int64)
+    reasons = np.empty(n // 2 + 1, dtype=np.int64)
+    number_of_trades = 0
+
+    entry = -1
+    trade_take_profit = 0.0
+    trade_stop_loss = 0.0
+    for i in range(n):
+        if entry < 0:
+            if signal[i] == 1:
+                entry = i
+                trade_take_profit = take_profit[i]
+                trade_stop_loss = stop_loss[i]
+            continue
+
+        if signal[i] == -1:
+            reason = SELL_SIGNAL
+        elif close_with_sltp and high[i] >= trade_take_profit:
+            reason = TAKE_PROFIT
+        elif close_with_sltp and low[i] <= trade_stop_loss:
+            reason = STOP_LOSS
+        else:
+            continue
+
+        entries[number_of_trades] = entry
+        exits[number_of_trades] = i
+        reasons[number_of_trades] = reason
+        number_of_trades += 1
+        entry = -1
+
+    entries = entries[:number_of_trades]
+    exits = exits[:number_of_trades]
+    entry_prices = np.empty(number_of_trades, dtype=np.float64)
+    exit_prices = np.empty(number_of_trades, dtype=np.float64)
+    for t in range(number_of_trades):
+        entry_prices[t] = open_price[entries[t]]
+        exit_prices[t] = close[exits[t]]
+
+    return entries, exits, entry_prices, exit_prices, reasons[:number_of_trades]
+
+
+intraday_trade_kernel = njit(cache=True)(intraday_trade_state_machine)
+
+
+def simulate_intraday_trades(signal, high, low, close, open_price, take_profit, stop_loss):
+    """
+    Runs the intraday state machine, JIT-compiled when numba is available.
+
+    Returns:
+        tuple: Entry indices, exit indices, entry prices, exit prices and close reason codes of every completed trade.
+    """
+    if NUMBA_AVAILABLE and USE_NUMBA:
+        return intraday_trade_kernel(np.ascontiguousarray(signal), high, low, close, open_price,
+                                     take_profit, stop_loss, CLOSE_POSITION_WITH_SLTP)
+
+    # Plain lists index much faster than NumPy arrays from a Python loop
+    return intraday_trade_state_machine(signal.tolist(), high.tolist(), low.tolist(), close, open_price,
+                                        take_profit.tolist(), stop_loss.tolist(), CLOSE_POSITION_WITH_SLTP)
+
+
+def simulate_swing_trades(signal, high, low, close, open_price, take_profit, stop_loss):
+    """
+    Vectorised equivalent of running analyse_row_swing over the bar arrays.
+
+    A trade opened on a buy bar is always closed on the next bar, whose own signal is ignored,
+    so within a run of consecutive buy bars only every other bar opens a trade.
+
+    Returns:
+        tuple: Entry indices, exit indices, entry prices, exit prices and close reason codes of every completed trade.
+    """
+    n = len(signal)
+    buy = signal == 1
+    index = np.arange(n)
+
+    run_start = buy.copy()
+    run_start[1:] &= ~buy[:-1]
+    run_start_index = np.maximum.accumulate(np.where(run_start, index, 0))
+
+    # A trade opened on the final bar is never closed
+    entries = np.flatnonzero(buy & ((index - run_start_index) % 2 == 0) & (index < n - 1))
+    exits = entries + 1
+
+    reasons = np.full(len(entries), END_OF_DAY, dtype=np.int64)
+    if CLOSE_POSITION_WITH_SLTP:
+        hit_stop_loss = low[exits] <= stop_loss[entries]
+        hit_take_profit = high[exits] >= take_profit[entries]
+        reasons[hit_stop_loss] = STOP_LOSS
+        reasons[hit_take_profit] = TAKE_PROFIT
+
+    return entries, exits, open_price[entries], close[exits], reasons
+
+
+def backtest_arrays(trading_session, df, intraday):
+    """
+    Array engine for the backtest, producing the same trades as looping analyse_row / analyse_row_swing over df.iterrows().
+
+    Args:
+        trading_session (Trading_session): Session the completed trades are added to.
+        df (pd.DataFrame): Strategy DataFrame returned by combined_strategy.
+        intraday (bool): Use the intraday rules (sell signal / sl / tp) rather than the swing rules.
+
+    Returns:
+        Trading_session: The session with every completed trade added.
+    """
+    arrays = extract_backtest_arrays(df)
+    open_price, take_profit, stop_loss = calculate_trade_levels(arrays['Close'], arrays['ATR'])
+
+    simulate = simulate_intraday_trades if intraday else simulate_swing_trades
+    simulated_trades = simulate(
+        arrays['Combined_Signal'], arrays['High'], arrays['Low'], arrays['Close'], open_price, take_profit, stop_loss)
+
+    return add_simulated_trades(trading_session, df['Datetime'], arrays['ATR'], *simulated_trades)
+
+
+def add_simulated_trades(trading_session, datetimes, atr, entries, exits, entry_prices, exit_prices, reasons):
+    """
+    Records the output of the simulate_* functions as closed trades in the trading session's ledger.
+
+    The trades go straight into the ledger's columns with the same prices, levels and profits Trade would
+    calculate, without creating a Python object per trade.
+    """
+    times = pd.DatetimeIndex(datetimes)
+    nanoseconds = times.as_unit('ns').asi8
+    open_ATR = np.asarray(atr, dtype=np.float64)[entries]
+    open_price, take_profit, stop_loss = calculate_trade_levels(entry_prices, open_ATR)
+
+    trading_session.add_trades(nanoseconds[entries], nanoseconds[exits], open_price, exit_prices, open_ATR,
+                               stop_loss, take_profit, reasons, CLOSE_REASONS, quantity=QUANTITY, tz=times.tz)
+    return trading_session
+
+
+def test_engine_equivalence(n_bars=5000, seed=0):
+    """
+    Checks both engines record the same trades on seeded synthetic bars, so it runs offline.
+    """
+    from back_tester import simulate_trading_session
+    from combined_strategy import combined_strategy
+    from indicator_filter import noop_filter
+    from indicator_setup import generate_Stochastic_setup_signal
+    from indicator_trigger import generate_MACD_trigger_signal
+    from replay_data_source import generate_synthetic_bars
+
+    df = combined_strategy(generate_synthetic_bars(n_bars, seed=seed),
+                           filter_func=noop_filter,
+                           setup_func=generate_Stochastic_setup_signal,
+                           trigger_func=generate_MACD_trigger_signal,
+                           setup_params={'k_period': 6, 'd_period': 3, 'stochastic_overbought': 67, 'stochastic_oversold': 30},
+                           trigger_params={'fast_period': 3, 'slow_period': 6, 'signal_period': 3})
+
+    for intraday in (True, False):
+        loop_session = simulate_trading_session(df, intraday, array_engine=False)
+        array_session = simulate_trading_session(df, intraday, array_engine=True)
+
+        assert len(loop_session.trades) == len(array_session.trades)
+        for loop_trade, array_trade in zip(loop_session.trades, array_session.trades):
+            assert loop_trade.to_dict() == array_trade.to_dict()
+        assert loop_session.current_balance == array_session.current_balance
+
+        print(f"{'Intraday' if intraday else 'Swing'} engines match on {len(array_session.trades)} trades")
+
+
+if __name__ == "__main__":
+    test_engine_equivalence()
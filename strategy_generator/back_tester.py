@@ -1,5 +1,8 @@
 from alpaca.data.timeframe import TimeFrame
 from trading_session import *
+from array_back_tester import backtest_arrays
+from compact_bars import restore_prices
+from stage_profiler import profile_stage
 from data_visualisation import *
 from combined_strategy import *
 from indicator_filter import *
@@ -18,8 +21,7 @@ def open_trade(open_time, open_price, atr):
 
 
 def calculate_buy_and_hold(df):
-    open_price_of_window = df["Open"].iloc[0]
-    closing_price_of_window = df["Close"].iloc[-1]
+    open_price_of_window, closing_price_of_window = restore_prices([df["Open"].iloc[0], df["Close"].iloc[-1]])
     buy_and_hold = ((closing_price_of_window - open_price_of_window) / open_price_of_window) * 100
     return buy_and_hold
 
@@ -68,24 +70,50 @@ def analyse_row(trading_session, trade, latest_bar):
     return trade, trading_session
 
 
-def backtest_strategy(display_trades, display_trading_session, df):
+def simulate_trading_session(df, intraday, array_engine=ARRAY_BACKTEST_ENGINE):
+    """
+    Runs the trading rules over every bar of the strategy DataFrame.
 
-    buy_and_hold = calculate_buy_and_hold(df)
+    Args:
+        df (pd.DataFrame): Strategy DataFrame returned by combined_strategy.
+        intraday (bool): Use analyse_row rather than analyse_row_swing.
+        array_engine (bool): Use the NumPy array engine instead of looping over df.iterrows().
 
+    Returns:
+        Trading_session: The session holding every completed trade.
+    """
     trading_session = Trading_session(STARTING_BALANCE, df["Datetime"].iloc[0], df["Datetime"].iloc[-1])
-    trade = None
 
+    if array_engine:
+        return backtest_arrays(trading_session, df, intraday)
+
+    trade = None
     for index, row in df.iterrows():
-        if INTRADAY_TRADING:
+        if intraday:
             trade, trading_session = analyse_row(trading_session, trade, row)
-        elif SWING_TRADING:
+        else:
             trade, trading_session = analyse_row_swing(trading_session, trade, row)
 
-    trading_session.calculate_percentage_change_of_strategy()
-    trading_session.calculate_average_duration()
-    trading_session.calculate_number_of_winning_trades()
-    trading_session.calculate_normalized_profit()
-    trading_session.calculate_sharpe_ratio_v2()
+    return trading_session
+
+
+def calculate_trading_session_metrics(trading_session, metrics=None):
+    """
+    Calculates the trading session's metrics, all of them unless metrics names the ones needed.
+    """
+    return trading_session.calculate_metrics(metrics)
+
+
+def backtest_strategy(display_trades, display_trading_session, df):
+
+    buy_and_hold = calculate_buy_and_hold(df)
+
+    with profile_stage('backtest'):
+        trading_session = simulate_trading_session(df, intraday=INTRADAY_TRADING)
+
+    # Only the objectives are needed to score a trial, every metric when the session is displayed
+    with profile_stage('metrics'):
+        calculate_trading_session_metrics(trading_session, None if display_trading_session else objective_metrics())
     
     if display_trades:
         trading_session.display_trades()
@@ -101,17 +129,9 @@ def backtest_strategy_returning_metrics(df):
 
     buy_and_hold = calculate_buy_and_hold(df)
 
-    trading_session = Trading_session(STARTING_BALANCE, df["Datetime"].iloc[0], df["Datetime"].iloc[-1])
-    trade = None
-
-    for index, row in df.iterrows():
-        trade, trading_session = analyse_row(trading_session, trade, row)
+    trading_session = simulate_trading_session(df, intraday=True)
 
-    trading_session.calculate_percentage_change_of_strategy()
-    trading_session.calculate_average_duration()
-    trading_session.calculate_number_of_winning_trades()
-    trading_session.calculate_normalized_profit()
-    trading_session.calculate_sharpe_ratio_v2()
+    calculate_trading_session_metrics(trading_session, ['normalized_profit'])
     
     return round(buy_and_hold, 2), round(trading_session.normalized_profit, 2)
 
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+from globals import *
+import numpy as np
+import pandas as pd
+
+
+DAY_NS = 24 * 60 * 60 * 10**9
+
+
+class Bar_cache:
+    """
+    Persistent on-disk cache of historic bars, stored as Parquet files partitioned by source/symbol/interval/day.
+
+    For each (source, symbol, interval) the cache remembers which time ranges have already been fetched,
+    so a request only fetches the gaps it is missing and serves everything else from disk. Once the
+    files grow past max_bytes the least recently used day partitions are evicted.
+
+    Times are handled as int64 nanosecond keys produced by the caller's row_key function, so each data
+    source decides what a range means (e.g. UTC for Alpaca, exchange wall time for yfinance).
+    """
+
+    def __init__(self, directory=BAR_CACHE_DIRECTORY, max_bytes=BAR_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {'coverage': {}, 'columns': {}, 'partitions': {}}
+        self.stats = {
+            'hits': 0,
+            'partial_hits': 0,
+            'misses': 0,
+            'bars_from_disk': 0,
+            'bars_fetched': 0,
+            'evicted_partitions': 0,
+        }
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+
+    def get_bars(self, source, symbol, interval, start_key, end_key, fetch, row_key, settled_key=None):
+        """
+        Returns the bars with keys in [start_key, end_key], fetching only the parts not already cached.
+
+        A fetched range is only marked as covered up to its last bar, and never past settled_key, so ranges
+        reaching past now, days still in progress and bars the provider has yet to publish are fetched again.
+
+        Args:
+            source (str): Name of the data source, e.g. 'alpaca'.
+            symbol (str): The ticker.
+            interval (str): The bar interval, e.g. '1Day' or '5m'.
+            start_key, end_key (int): Inclusive range of row keys to return.
+            fetch (callable): fetch(gap_start_key, gap_end_key) downloads the bars of one missing range.
+            row_key (callable): row_key(df) gives the int64 key of every row of a fetched DataFrame.
+            settled_key (int): Key up to which the source's bars are final, defaults to BAR_CACHE_SETTLE_DELAY before now.
+
+        Returns:
+            pd.DataFrame: The bars in the requested range.
+        """
+        series_key = f"{source}/{symbol.replace('/', '-')}/{interval}"
+        coverage = self.index['coverage'].setdefault(series_key, [])
+        gaps = find_gaps(coverage, start_key, end_key)
+        if settled_key is None:
+            settled_key = (pd.Timestamp.now(tz='UTC') - pd.Timedelta(BAR_CACHE_SETTLE_DELAY)).value
+
+        if not gaps:
+            self.stats['hits'] += 1
+        elif gaps == [[start_key, end_key]]:
+            self.stats['misses'] += 1
+        else:
+            self.stats['partial_hits'] += 1
+
+        bars_fetched = 0
+        for gap_start, gap_end in gaps:
+            fetched = fetch(gap_start, gap_end)
+            bars_fetched += len(fetched)
+            covered_end = min(gap_end, settled_key)
+            if len(fetched):
+                keys = row_key(fetched)
+                self.index['columns'][series_key] = list(fetched.columns)
+                self.store(series_key, fetched, keys)
+                covered_end = min(covered_end, int(keys.max()))
+            if covered_end >= gap_start:
+                add_range(coverage, gap_start, covered_end)
+
+        bars = self.load(series_key, start_key, end_key, row_key)
+        self.stats['bars_fetched'] += bars_fetched
+        self.stats['bars_from_disk'] += max(len(bars) - bars_fetched, 0)
+
+        self.evict()
+        self.save_index()
+        return bars
+
+
+    def partition_path(self, series_key, day):
+        day_string = pd.Timestamp(day * DAY_NS).strftime('%Y-%m-%d')
+        return os.path.join(series_key, f"{day_string}.parquet")
+
+
+    def store(self, series_key, df, keys):
+        days = keys // DAY_NS
+        for day in np.unique(days):
+            relative_path = self.partition_path(series_key, day)
+            path = os.path.join(self.directory, relative_path)
+            day_bars = df[days == day]
+
+            if os.path.exists(path):
+                day_bars = pd.concat([pd.read_parquet(path), day_bars], ignore_index=True)
+                day_bars = day_bars.drop_duplicates(subset='Datetime', keep='last').sort_values('Datetime')
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            day_bars.to_parquet(path, index=False)
+            self.index['partitions'][relative_path] = {'bytes': os.path.getsize(path), 'last_access': time.time()}
+
+
+    def load(self, series_key, start_key, end_key, row_key):
+        day_frames = []
+        for day in range(start_key // DAY_NS, end_key // DAY_NS + 1):
+            relative_path = self.partition_path(series_key, day)
+            if relative_path in self.index['partitions']:
+                day_frames.append(pd.read_parquet(os.path.join(self.directory, relative_path)))
+                self.index['partitions'][relative_path]['last_access'] = time.time()
+
+        if not day_frames:
+            return pd.DataFrame(columns=self.index['columns'].get(series_key, []))
+
+        bars = pd.concat(day_frames, ignore_index=True)
+        keys = row_key(bars)
+        return bars[(keys >= start_key) & (keys <= end_key)].reset_index(drop=True)
+
+
+    def evict(self):
+        """
+        Deletes the least recently used day partitions until the cache is within max_bytes,
+        forgetting that their days were covered so they are fetched again if needed.
+        """
+        partitions = self.index['partitions']
+        total_bytes = sum(partition['bytes'] for partition in partitions.values())
+
+        for relative_path in sorted(partitions, key=lambda path: partitions[path]['last_access']):
+            if total_bytes <= self.max_bytes:
+                break
+
+            total_bytes -= partitions.pop(relative_path)['bytes']
+            path = os.path.join(self.directory, relative_path)
+            if os.path.exists(path):
+                os.remove(path)
+
+            series_key, file_name = os.path.split(relative_path)
+            day = pd.Timestamp(file_name.replace('.parquet', '')).value // DAY_NS
+            remove_range(self.index['coverage'].get(series_key, []), day * DAY_NS, (day + 1) * DAY_NS - 1)
+            self.stats['evicted_partitions'] += 1
+
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self.index_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temporary_path, self.index_path)
+
+
+    def size_in_bytes(self):
+        return sum(partition['bytes'] for partition in self.index['partitions'].values())
+
+
+    def __str__(self) -> str:
+        requests = self.stats['hits'] + self.stats['partial_hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / requests * 100 if requests else 0.0
+        return (f"\nBar cache: {self.directory}\n"
+                f"Requests: {requests} (hits: {self.stats['hits']}, partial hits: {self.stats['partial_hits']}, misses: {self.stats['misses']})\n"
+                f"Hit rate: {hit_rate:.2f}%\n"
+                f"Bars served from disk: {self.stats['bars_from_disk']}\n"
+                f"Bars fetched: {self.stats['bars_fetched']}\n"
+                f"Evicted partitions: {self.stats['evicted_partitions']}\n"
+                f"Size: {self.size_in_bytes() / 1024**2:.2f} MB of {self.max_bytes / 1024**2:.2f} MB\n")
+
+
+def find_gaps(coverage, start_key, end_key):
+    """
+    Returns the inclusive [start, end] ranges within [start_key, end_key] not covered by the sorted coverage ranges.
+    """
+    gaps = []
+    if start_key > end_key:
+        return gaps
+
+    position = start_key
+    for covered_start, covered_end in coverage:
+        if covered_end < position:
+            continue
+        if covered_start > end_key:
+            break
+        if covered_start > position:
+            gaps.append([position, covered_start - 1])
+        position = covered_end + 1
+        if position > end_key:
+            return gaps
+
+    gaps.append([position, end_key])
+    return gaps
+
+
+def add_range(coverage, start_key, end_key):
+    """
+    Adds an inclusive range to the sorted coverage list in place, merging touching or overlapping ranges.
+    """
+    coverage.append([start_key, end_key])
+    coverage.sort()
+
+    merged = [coverage[0]]
+    for covered_start, covered_end in coverage[1:]:
+        if covered_start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], covered_end)
+        else:
+            merged.append([covered_start, covered_end])
+    coverage[:] = merged
+
+
+def remove_range(coverage, start_key, end_key):
+    """
+    Removes an inclusive range from the sorted coverage list in place.
+    """
+    remaining = []
+    for covered_start, covered_end in coverage:
+        if covered_end < start_key or covered_start > end_key:
+            remaining.append([covered_start, covered_end])
+            continue
+        if covered_start < start_key:
+            remaining.append([covered_start, start_key - 1])
+        if covered_end > end_key:
+            remaining.append([end_key + 1, covered_end])
+    coverage[:] = remaining
+
+
+def test_bar_cache_coverage():
+    import tempfile
+
+    day = pd.Timedelta('1D').value
+    start_key = pd.Timestamp('2024-01-01', tz='UTC').value
+    calls = []
+
+    def fetch(gap_start, gap_end):
+        # The provider only has the first three days of bars
+        calls.append((gap_start, gap_end))
+        keys = [key for key in range(gap_start - gap_start % day, gap_end + 1, day) if gap_start <= key < start_key + 3 * day]
+        return pd.DataFrame({'Datetime': pd.to_datetime(keys, utc=True), 'Close': 1.0})
+
+    def row_key(df):
+        return pd.DatetimeIndex(df['Datetime']).as_unit('ns').asi8
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = Bar_cache(directory)
+        end_key = start_key + 5 * day
+
+        # Settled: the days after the last bar are only covered once a fetch confirms they are empty
+        cache.get_bars('test', 'AAA', '1Day', start_key, end_key, fetch, row_key, settled_key=end_key)
+        assert calls[-1] == (start_key, end_key) and cache.index['coverage']['test/AAA/1Day'] == [[start_key, start_key + 2 * day]]
+        cache.get_bars('test', 'AAA', '1Day', start_key, end_key, fetch, row_key, settled_key=end_key)
+        assert calls[-1] == (start_key + 2 * day + 1, end_key) and cache.index['coverage']['test/AAA/1Day'] == [[start_key, end_key]]
+
+        # Not yet settled: an empty fetch of a recent range is not covered, so it is fetched again
+        cache.get_bars('test', 'BBB', '1Day', start_key + 4 * day, end_key, fetch, row_key, settled_key=start_key)
+        cache.get_bars('test', 'BBB', '1Day', start_key + 4 * day, end_key, fetch, row_key, settled_key=start_key)
+        assert len(calls) == 4 and cache.index['coverage']['test/BBB/1Day'] == []
+
+    print("Bar cache coverage test passed")
+
+
+bar_cache = None
+
+
+def get_bar_cache():
+    global bar_cache
+    if bar_cache is None:
+        bar_cache = Bar_cache()
+    return bar_cache
+
+
+def print_bar_cache_stats():
+    if USE_BAR_CACHE:
+        print(get_bar_cache())
+
+
+if __name__ == "__main__":
+    test_bar_cache_coverage()
@@ -0,0 +1,147 @@
+import os
+from globals import *
+import numpy as np
+import pandas as pd
+
+
+# Column name to the dtype it is stored as
+BAR_STORE_COLUMNS = {
+    'Datetime': np.int64,
+    'Open': np.float64,
+    'High': np.float64,
+    'Low': np.float64,
+    'Close': np.float64,
+    'Volume': np.float64,
+    'Trade_Count': np.float64,
+    'VWAP': np.float64,
+    'ATR': np.float64,
+    'Filter_Signal': np.int8,
+    'Setup_Signal': np.int8,
+    'Trigger_Signal': np.int8,
+    'Combined_Signal': np.int8,
+}
+
+
+class Bar_store:
+    """
+    Fixed capacity ring buffer of the latest bars of a live session, preallocated as one NumPy array per column.
+
+    Every bar is written twice, at its slot and at its slot plus capacity, so the latest bars are always
+    one contiguous slice and view() can hand them out without copying. Once full, each new bar evicts the
+    oldest, which can be appended to a spill file so the whole session is still available for plotting.
+    """
+
+    def __init__(self, capacity, symbol=None, spill_path=None):
+        self.capacity = capacity
+        self.symbol = symbol
+        self.spill_path = spill_path
+        self.columns = {column: np.zeros(2 * capacity, dtype=dtype) for column, dtype in BAR_STORE_COLUMNS.items()}
+        self.record_dtype = np.dtype(list(BAR_STORE_COLUMNS.items()))
+        self.next_slot = 0
+        self.length = 0
+        self.spilled = 0
+
+        if spill_path is not None:
+            os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+            open(spill_path, 'wb').close()
+
+    def append(self, row):
+        """
+        Adds one bar, e.g. a row from Streaming_strategy.update. Columns missing from the row are stored as NaN, or 0 for signals.
+        """
+        slot = self.next_slot
+        if self.length == self.capacity:
+            self.spill(slot)
+        else:
+            self.length += 1
+
+        if self.symbol is None and 'Symbol' in row:
+            self.symbol = row['Symbol']
+
+        for column, values in self.columns.items():
+            if column == 'Datetime':
+                value = pd.Timestamp(row['Datetime']).as_unit('ns').value
+            else:
+                value = row.get(column, 0 if values.dtype == np.int8 else np.nan)
+            values[slot] = value
+            values[slot + self.capacity] = value
+
+        self.next_slot = (slot + 1) % self.capacity
+
+    def spill(self, slot):
+        if self.spill_path is None:
+            return
+        record = np.empty(1, dtype=self.record_dtype)
+        for column, values in self.columns.items():
+            record[column] = values[slot]
+        with open(self.spill_path, 'ab') as f:
+            record.tofile(f)
+        self.spilled += 1
+
+    def view(self, column, n=None):
+        """
+        Returns a read-only zero-copy view of the latest n values of a column (every stored value if n is None), oldest first.
+        """
+        n = self.length if n is None else min(n, self.length)
+        end = self.next_slot + self.capacity if self.length == self.capacity else self.next_slot
+        view = self.columns[column][end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def latest(self):
+        """
+        Returns the most recent bar as a dict.
+        """
+        return {column: self.view(column, 1)[0] for column in self.columns}
+
+    def to_frame(self, n=None, include_spilled=False):
+        """
+        Builds a DataFrame of the latest n bars in the same layout as the strategy DataFrames, so it can be
+        passed to the indicator functions or plot_strategy.
+
+        Args:
+            n (int): Number of latest bars, every stored bar if None.
+            include_spilled (bool): Also read back every bar spilled to disk, giving the whole session.
+
+        Returns:
+            pd.DataFrame: The bars, oldest first.
+        """
+        columns = {column: self.view(column, n) for column in self.columns}
+        if include_spilled and self.spilled:
+            spilled = np.fromfile(self.spill_path, dtype=self.record_dtype)
+            columns = {column: np.concatenate([spilled[column], values]) for column, values in columns.items()}
+
+        df = pd.DataFrame(columns)
+        df['Datetime'] = pd.to_datetime(df['Datetime'], utc=True)
+        df.insert(0, 'Symbol', self.symbol)
+        return df
+
+    def __len__(self):
+        return self.length
+
+
+def test_bar_store():
+    capacity = 5
+    spill_path = os.path.join('live_bars', 'test_bar_store.bin')
+    store = Bar_store(capacity, 'TEST', spill_path)
+
+    rows = [{'Datetime': pd.Timestamp('2024-01-01', tz='UTC') + pd.Timedelta(minutes=i), 'Close': float(i), 'Combined_Signal': i % 3 - 1}
+            for i in range(12)]
+    for i, row in enumerate(rows):
+        store.append(row)
+        closes = store.view('Close')
+        assert np.array_equal(closes, np.arange(max(0, i + 1 - capacity), i + 1))
+        assert np.shares_memory(closes, store.columns['Close'])
+
+    df = store.to_frame(include_spilled=True)
+    assert np.array_equal(df['Close'], np.arange(12))
+    assert np.array_equal(df['Combined_Signal'], [row['Combined_Signal'] for row in rows])
+    assert (df['Datetime'] == [row['Datetime'] for row in rows]).all()
+    assert len(store.to_frame()) == capacity
+
+    os.remove(spill_path)
+    print("Bar store test passed")
+
+
+if __name__ == "__main__":
+    test_bar_store()
@@ -0,0 +1,153 @@
+from globals import *
+import numpy as np
+from trading_session import *
+from array_back_tester import calculate_trade_levels, simulate_intraday_trades, simulate_swing_trades, add_simulated_trades
+from back_tester import calculate_trading_session_metrics
+from combined_strategy import combine_signals
+from indicator_cache import indicator_signals
+from feature_store import get_feature_store
+from compact_bars import SIGNAL_DTYPE, restore_prices
+from stage_profiler import profile_stage, profile_trials
+
+
+STAGE_SIGNAL_COLUMNS = {
+    'filter': 'Filter_Signal',
+    'setup': 'Setup_Signal',
+    'trigger': 'Trigger_Signal',
+}
+
+
+def suggest_candidate(trial, functions_info):
+    """
+    Suggests a filter, setup and trigger function and their parameters from an Optuna trial.
+
+    Args:
+        trial (optuna.trial.Trial): The trial to suggest values from.
+        functions_info (dict): One of the parameter dictionaries from indicator_param_dict_intra / _swing.
+
+    Returns:
+        dict: Keyword arguments for combined_strategy (filter_func, setup_func, trigger_func and their params).
+    """
+    candidate = {}
+
+    # Select the functions first, then suggest their parameters
+    func_infos = {}
+    for stage in STAGE_SIGNAL_COLUMNS:
+        func_name = trial.suggest_categorical(f'{stage}_func', list(functions_info[f'{stage}_functions'].keys()))
+        func_infos[stage] = (func_name, functions_info[f'{stage}_functions'][func_name])
+
+    for stage, (func_name, func_info) in func_infos.items():
+        params = {}
+        for param_name, (param_type, start, end) in func_info['params'].items():
+            if param_type == 'int':
+                params[param_name] = trial.suggest_int(f'{stage}_{func_name}_{param_name}', start, end)
+            elif param_type == 'float':
+                params[param_name] = trial.suggest_float(f'{stage}_{func_name}_{param_name}', start, end, step=FLOAT_PRECISION)
+
+        candidate[f'{stage}_func'] = func_info['function']
+        candidate[f'{stage}_params'] = params
+
+    return candidate
+
+
+def build_signal_matrices(df, candidates):
+    """
+    Computes the Combined_Signal of every candidate as one 2-D matrix.
+
+    Signals are read straight from the bar columns of df without copying or modifying it, and each distinct
+    (function, params) stage is only computed once per batch.
+
+    Returns:
+        tuple: The (candidates x bars) Combined_Signal matrix, a list of distinct ATR arrays and the index into
+            that list of the ATR each candidate trades with.
+    """
+    base_atr = get_feature_store().rolling_mean(df, 'TR', ATR_PERIOD, min_periods=1)
+
+    # ADX exports its own ATR, which combined_strategy then trades with, so track which ATR each candidate ends up with
+    atr_variants = [base_atr]
+    stage_results = {}
+
+    stage_signals = {stage: np.empty((len(candidates), len(df)), dtype=SIGNAL_DTYPE) for stage in STAGE_SIGNAL_COLUMNS}
+    atr_variant_index = np.zeros(len(candidates), dtype=np.int64)
+
+    for c, candidate in enumerate(candidates):
+        for stage, signal_column in STAGE_SIGNAL_COLUMNS.items():
+            func = candidate[f'{stage}_func']
+            params = candidate.get(f'{stage}_params', {})
+            key = (func, tuple(sorted(params.items())))
+
+            if key not in stage_results:
+                with profile_stage(f'indicator:{func.__name__}'):
+                    outputs = indicator_signals(func, df, params)
+                stage_results[key] = (outputs[signal_column], find_atr_variant(atr_variants, outputs.get('ATR', base_atr)))
+
+            signal, atr_variant = stage_results[key]
+            stage_signals[stage][c] = signal
+            if atr_variant != 0:
+                atr_variant_index[c] = atr_variant
+
+    combined = combine_signals(stage_signals['filter'], stage_signals['setup'], stage_signals['trigger'])
+    return combined, atr_variants, atr_variant_index
+
+
+def find_atr_variant(atr_variants, atr):
+    for i, variant in enumerate(atr_variants):
+        if np.array_equal(variant, atr, equal_nan=True):
+            return i
+    atr_variants.append(atr.copy())
+    return len(atr_variants) - 1
+
+
+def batch_backtest(df, candidates):
+    """
+    Backtests many strategies against one price series in a single pass.
+
+    Args:
+        df (pd.DataFrame): OHLCV DataFrame as returned by fetch_data.
+        candidates (list): Dicts of combined_strategy keyword arguments (filter_func, setup_func, trigger_func,
+            filter_params, setup_params, trigger_params), e.g. as returned by suggest_candidate.
+
+    Returns:
+        np.ndarray: (candidates x objectives) matrix holding Trading_session.get_objectives() for each candidate.
+    """
+    with profile_stage('build_signal_matrices'):
+        combined, atr_variants, atr_variant_index = build_signal_matrices(df, candidates)
+
+    with profile_stage('batch_kernel'):
+        high = restore_prices(df['High'])
+        low = restore_prices(df['Low'])
+        close = restore_prices(df['Close'])
+        datetimes = df['Datetime']
+
+        levels = [calculate_trade_levels(close, atr) for atr in atr_variants]
+        simulate = simulate_intraday_trades if INTRADAY_TRADING else simulate_swing_trades
+
+        objectives = []
+        for c in range(len(candidates)):
+            open_price, take_profit, stop_loss = levels[atr_variant_index[c]]
+            simulated_trades = simulate(combined[c], high, low, close, open_price, take_profit, stop_loss)
+
+            trading_session = Trading_session(STARTING_BALANCE, datetimes.iloc[0], datetimes.iloc[-1])
+            add_simulated_trades(trading_session, datetimes, atr_variants[atr_variant_index[c]], *simulated_trades)
+            objectives.append(calculate_trading_session_metrics(trading_session, objective_metrics()).get_objectives())
+
+    return np.array(objectives, dtype=np.float64)
+
+
+def run_batched_study(study, functions_info, df, n_trials, batch_size=50):
+    """
+    Runs an Optuna study with the ask-and-tell interface, scoring batch_size trials per batch_backtest call.
+    Objectives are weighted the same way as ML_optimise_v3.objective.
+    """
+    weights = np.array([WEIGHT_OBJECTIVE_1, WEIGHT_OBJECTIVE_2]) if MULTI_OBJECTIVE else 1.0
+
+    for batch_start in range(0, n_trials, batch_size):
+        trials = [study.ask() for _ in range(min(batch_size, n_trials - batch_start))]
+        with profile_trials([trial.number for trial in trials]):
+            candidates = [suggest_candidate(trial, functions_info) for trial in trials]
+            values = batch_backtest(df, candidates) * weights
+
+        for trial, trial_values in zip(trials, values):
+            study.tell(trial, trial_values.tolist())
+
+    return study
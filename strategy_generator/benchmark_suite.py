@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import asyncio
+import platform
+import subprocess
+from datetime import datetime
+from types import SimpleNamespace
+from globals import *
+import numpy as np
+import pandas as pd
+import optuna
+from tabulate import tabulate
+import indicator_cache
+import feature_store
+from back_tester import analyse_row, backtest_strategy
+from combined_strategy import combined_strategy
+from compact_bars import compact_bars
+from indicator_param_dict_intra import intra_functions_info
+from indicator_param_dict_swing import swing_functions_info
+from live_engine import Live_engine, Order_router
+from replay_data_source import generate_synthetic_bars
+from streaming_indicators import Streaming_strategy
+
+
+# Strategy timed by the combined_strategy, backtest_strategy and live benchmarks, which trades on the synthetic bars
+BENCHMARK_STRATEGY = {
+    'filter_func': 'generate_SMA_filter_signal',
+    'setup_func': 'generate_RSI_setup_signal',
+    'trigger_func': 'generate_MACD_trigger_signal',
+}
+
+
+def reset_caches():
+    # Drop the indicator cache and feature store so every repeat calculates from scratch
+    indicator_cache.indicator_cache = None
+    feature_store.feature_store = None
+
+
+def middle_params(func_info):
+    """
+    The middle of each parameter's search range, as the optimiser would suggest it.
+    """
+    params = {}
+    for param_name, (param_type, start, end) in func_info['params'].items():
+        if param_type == 'int':
+            params[param_name] = (start + end) // 2
+        else:
+            params[param_name] = round((start + end) / 2, 2)
+    return params
+
+
+def indicator_functions():
+    """
+    Every filter, setup and trigger function in the intraday and swing parameter dictionaries, with middle parameters.
+    """
+    functions = {}
+    for functions_info in (intra_functions_info, swing_functions_info):
+        for stage in ('filter', 'setup', 'trigger'):
+            for func_name, func_info in functions_info[f'{stage}_functions'].items():
+                functions.setdefault(func_name, (stage, func_info['function'], middle_params(func_info)))
+    return functions
+
+
+def benchmark_strategy_kwargs():
+    functions = indicator_functions()
+    kwargs = {}
+    for stage in ('filter', 'setup', 'trigger'):
+        _, func, params = functions[BENCHMARK_STRATEGY[f'{stage}_func']]
+        kwargs[f'{stage}_func'] = func
+        kwargs[f'{stage}_params'] = params
+    return kwargs
+
+
+def time_repeats(run, repeats, setup=reset_caches):
+    """
+    Times run() repeats times, calling setup() untimed before each call.
+
+    Returns:
+        dict: Minimum, median and mean wall time in seconds, and the number of repeats.
+    """
+    seconds = []
+    for _ in range(repeats):
+        setup()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return {'min': min(seconds), 'median': float(np.median(seconds)), 'mean': float(np.mean(seconds)), 'repeats': repeats}
+
+
+def benchmark_indicators(df, repeats):
+    results = {}
+    for func_name, (stage, func, params) in indicator_functions().items():
+        results[f'indicator.{stage}.{func_name}'] = time_repeats(lambda: func.signals(df, **params), repeats)
+    return results
+
+
+def benchmark_combined_strategy(df, repeats):
+    kwargs = benchmark_strategy_kwargs()
+    return {'combined_strategy': time_repeats(lambda: combined_strategy(df, **kwargs), repeats)}
+
+
+def benchmark_backtest_strategy(df, repeats):
+    strategy_df = combined_strategy(df, **benchmark_strategy_kwargs())
+    return {'backtest_strategy': time_repeats(lambda: backtest_strategy(False, False, strategy_df), repeats)}
+
+
+def benchmark_optuna_study(df, n_trials, repeats):
+    """
+    Times an n_trials study run as ML_optimise_v3 runs it, precomputing the sweep features then calling its objective.
+    """
+    import ML_optimise_v3
+
+    ML_optimise_v3.df = df
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+    def run_study():
+        sampler = optuna.samplers.TPESampler(seed=OPTIMISATION_SEED)
+        if MULTI_OBJECTIVE:
+            study = optuna.create_study(directions=['maximize', 'maximize'], sampler=sampler)
+        else:
+            study = optuna.create_study(direction='maximize', sampler=sampler)
+        feature_store.precompute_sweep_features(df, ML_optimise_v3.get_functions_info())
+        study.optimize(ML_optimise_v3.objective, n_trials=n_trials)
+
+    return {f'optuna_study.{n_trials}_trials': time_repeats(run_study, repeats)}
+
+
+def to_alpaca_bars(df):
+    # Objects with the attributes of the alpaca Bar model quote_data_handler receives
+    return [SimpleNamespace(symbol=row['Symbol'], timestamp=row['Datetime'], open=row['Open'], high=row['High'],
+                            low=row['Low'], close=row['Close'], volume=row['Volume'], trade_count=row['Trade_Count'],
+                            vwap=row['VWAP'])
+            for row in df.to_dict('records')]
+
+
+async def analyse_without_orders(trading_session, trade, latest_bar, symbol):
+    # Stands in for the order router's analyse_latest_alpaca_bar, so no orders are sent
+    return analyse_row(trading_session, trade, latest_bar)
+
+
+def benchmark_live_bar_path(df, repeats):
+    """
+    Times Live_engine.on_bar, the per-bar path of alpaca_trade_executor.quote_data_handler, over every bar after
+    the warm up, with an Order_router trading each bar with analyse_row. Reported per bar.
+    """
+    streaming_kwargs = benchmark_strategy_kwargs()
+    warm_up_bars = max(Streaming_strategy(**streaming_kwargs).lookback, LIVE_BAR_STORE_MIN_CAPACITY)
+    bars = to_alpaca_bars(df.iloc[warm_up_bars:])
+    state = {}
+
+    def setup():
+        tasks = set()
+
+        def run_in_background(coroutine):
+            task = asyncio.create_task(coroutine)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            return task
+
+        live_engine = Live_engine([TICKER], streaming_kwargs, STARTING_BALANCE, Order_router(analyse_without_orders, run_in_background))
+        live_engine.warm_up(df.iloc[:warm_up_bars])
+        state.update(live_engine=live_engine, tasks=tasks)
+
+    async def feed_bars():
+        for bar in bars:
+            await state['live_engine'].on_bar(bar)
+            # Let the routed bar trade, as it does while the websocket waits for the next message
+            await asyncio.sleep(0)
+        await asyncio.gather(*state['tasks'])
+
+    def run():
+        asyncio.run(feed_bars())
+
+    timing = time_repeats(run, repeats, setup)
+    timing.update({f'{statistic}_per_bar': timing[statistic] / len(bars) for statistic in ('min', 'median', 'mean')})
+    return {'live_bar_path': timing}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n_bars=BENCHMARK_BARS, n_trials=BENCHMARK_TRIALS, repeats=BENCHMARK_REPEATS, seed=0):
+    """
+    Times the optimiser and live hot paths on n_bars of synthetic 5 minute bars.
+
+    Returns:
+        dict: The run's configuration and environment, and the wall time statistics of each benchmark in seconds.
+    """
+    df = generate_synthetic_bars(n_bars, seed=seed)
+    if COMPACT_BARS:
+        df = compact_bars(df)
+
+    benchmarks = {}
+    benchmarks.update(benchmark_indicators(df, repeats))
+    benchmarks.update(benchmark_combined_strategy(df, repeats))
+    benchmarks.update(benchmark_backtest_strategy(df, repeats))
+    benchmarks.update(benchmark_optuna_study(df, n_trials, repeats))
+    benchmarks.update(benchmark_live_bar_path(df, repeats))
+
+    return {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'config': {'bars': n_bars, 'trials': n_trials, 'repeats': repeats, 'seed': seed},
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'optuna': optuna.__version__, 'machine': platform.machine()},
+        'benchmarks': benchmarks,
+    }
+
+
+def write_benchmark_results(results, directory=BENCHMARK_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{results['commit'] or 'unknown'}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare_benchmark_results(baseline_path, results_path):
+    """
+    Prints the median time of each benchmark in two result files and the speed up between them.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(results_path) as f:
+        results = json.load(f)
+
+    table = []
+    for name, timing in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            table.append([name, "N/A", f"{timing['median'] * 1000:.2f}", "N/A"])
+        else:
+            table.append([name, f"{before['median'] * 1000:.2f}", f"{timing['median'] * 1000:.2f}",
+                          f"{before['median'] / timing['median']:.2f}x"])
+
+    print(f"\nMedian ms, {baseline['commit']} -> {results['commit']}")
+    print(tabulate(table, headers=["Benchmark", "Before", "After", "Speed up"], tablefmt="grid"))
+
+
+def print_benchmark_results(results):
+    table = [[name, f"{timing['min'] * 1000:.2f}", f"{timing['median'] * 1000:.2f}", f"{timing['mean'] * 1000:.2f}"]
+             for name, timing in results['benchmarks'].items()]
+    print(f"\n{results['config']['bars']} bars, {results['config']['repeats']} repeats, commit {results['commit']}")
+    print(tabulate(table, headers=["Benchmark", "Min ms", "Median ms", "Mean ms"], tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    previous_results = sorted(os.listdir(BENCHMARK_DIRECTORY)) if os.path.isdir(BENCHMARK_DIRECTORY) else []
+
+    results = run_benchmarks()
+    print_benchmark_results(results)
+    path = write_benchmark_results(results)
+    print(f"Results written to {path}")
+
+    # Compare against the previous run, e.g. on the commit before
+    if previous_results:
+        compare_benchmark_results(os.path.join(BENCHMARK_DIRECTORY, previous_results[-1]), path)
@@ -1,29 +1,131 @@
 import os
+import numpy as np
 from globals import *
 from data_fetch import *
 from indicator_filter import *
 from indicator_setup import *
 from indicator_trigger import *
+from indicator_cache import apply_indicator, indicator_signals
+from feature_store import get_feature_store
+from compact_bars import SIGNAL_DTYPE
+from stage_profiler import profile_stage
 
 
-def combined_strategy(df, filter_func, setup_func, trigger_func, filter_params={}, setup_params={}, trigger_params={}):
+def combined_strategy(df, filter_func, setup_func, trigger_func, filter_params={}, setup_params={}, trigger_params={},
+                      combination_rule=SIGNAL_COMBINATION_RULE, materialise_columns=MATERIALISE_INDICATOR_COLUMNS):
+    """
+    Runs the filter, setup and trigger functions over the bars and combines their signals.
+
+    df is never modified, so callers don't need to copy it. The returned DataFrame shares the bar columns
+    with df and adds the 'ATR', signal and 'Combined_Signal' columns, plus every indicator helper column
+    (e.g. 'MA', 'rsi', 'SAR') when materialise_columns is set, for plotting and debugging.
+
+    Returns:
+        pd.DataFrame: The strategy DataFrame the back testers and plot_strategy take.
+    """
+    with profile_stage('combined_strategy'):
+        if not materialise_columns:
+            return df.assign(**combined_signals(df, filter_func, setup_func, trigger_func,
+                                                filter_params, setup_params, trigger_params, combination_rule))
 
-    df = calculate_atr(df)
+        # A shallow copy takes the indicator columns without copying or touching the bar columns of df
+        with profile_stage('indicator:calculate_atr'):
+            df = apply_indicator(calculate_atr, df.copy(deep=False))
 
-    # Apply filter, setup, and trigger functions to the DataFrame
-    df = filter_func(df, **filter_params)
-    df = setup_func(df, **setup_params)
-    df = trigger_func(df, **trigger_params)
+        # Apply filter, setup, and trigger functions to the DataFrame, reusing results already calculated on the same data
+        for func, params in [(filter_func, filter_params), (setup_func, setup_params), (trigger_func, trigger_params)]:
+            with profile_stage(f'indicator:{func.__name__}'):
+                df = apply_indicator(func, df, params)
+
+        # Combine the signals into a final trading signal
+        with profile_stage('combine_signals'):
+            df['Combined_Signal'] = combine_signals(df['Filter_Signal'].to_numpy(),
+                                                    df['Setup_Signal'].to_numpy(),
+                                                    df['Trigger_Signal'].to_numpy(),
+                                                    combination_rule)
+
+        return df
+
+
+def combined_signals(df, filter_func, setup_func, trigger_func, filter_params={}, setup_params={}, trigger_params={},
+                     combination_rule=SIGNAL_COMBINATION_RULE):
+    """
+    Calculates the strategy's signals straight from the bar columns of df, without writing to it.
+
+    Returns:
+        dict: 'ATR', 'Filter_Signal', 'Setup_Signal', 'Trigger_Signal' and 'Combined_Signal' arrays. 'ATR' is the
+            one an indicator exports in its place (ADX) if any, as combined_strategy trades with that one.
+    """
+    with profile_stage('indicator:calculate_atr'):
+        signals = {'ATR': get_feature_store().rolling_mean(df, 'TR', ATR_PERIOD, min_periods=1)}
+    for func, params in [(filter_func, filter_params), (setup_func, setup_params), (trigger_func, trigger_params)]:
+        with profile_stage(f'indicator:{func.__name__}'):
+            signals.update(indicator_signals(func, df, params))
 
     # Combine the signals into a final trading signal
-    df['Combined_Signal'] = df[['Filter_Signal', 'Setup_Signal', 'Trigger_Signal']].apply(
-        lambda row: 1 if all(val == 1 for val in row if val != 9) else 
-                    (-1 if all(val == -1 for val in row if val != 9) else 0),
-        axis=1
-    )
+    with profile_stage('combine_signals'):
+        signals['Combined_Signal'] = combine_signals(signals['Filter_Signal'], signals['Setup_Signal'], signals['Trigger_Signal'],
+                                                     combination_rule)
+    return signals
+
+
+def combine_signals(filter_signal, setup_signal, trigger_signal, combination_rule=SIGNAL_COMBINATION_RULE):
+    """
+    Combines the filter, setup and trigger signals into the Combined_Signal with one of the COMBINATION_RULES.
+    Signals set to the 9 "noop" sentinel take no part in the vote.
+
+    Args:
+        filter_signal, setup_signal, trigger_signal (np.ndarray): Signal arrays of the same shape, either
+            one column of bars or a 2-D matrix with one row per candidate strategy.
+        combination_rule (str): Key of COMBINATION_RULES.
+
+    Returns:
+        np.ndarray: The combined signal (1 buy, -1 sell, 0 neither) as SIGNAL_DTYPE, with the same shape as the inputs.
+    """
+    signals = np.stack([filter_signal, setup_signal, trigger_signal])
+    active = signals != 9
+    return COMBINATION_RULES[combination_rule](signals, active).astype(SIGNAL_DTYPE)
+
+
+def unanimous_vote(signals, active):
+    """
+    1 when every active signal is 1, otherwise -1 when every active signal is -1, otherwise 0.
+    When all three are noop the vote is vacuously unanimous and gives 1.
+    """
+    buy = np.all((signals == 1) | ~active, axis=0)
+    sell = np.all((signals == -1) | ~active, axis=0)
+    return np.where(buy, 1, np.where(sell, -1, 0))
+
+
+def majority_vote(signals, active):
+    """
+    1 when more than half of the active signals are 1, -1 when more than half are -1, otherwise 0.
+    """
+    active_count = active.sum(axis=0)
+    buy_count = ((signals == 1) & active).sum(axis=0)
+    sell_count = ((signals == -1) & active).sum(axis=0)
+    return np.where(2 * buy_count > active_count, 1, np.where(2 * sell_count > active_count, -1, 0))
+
+
+def weighted_vote(signals, active):
+    """
+    Weights the active signals by SIGNAL_COMBINATION_WEIGHTS (filter, setup, trigger) and gives 1 when their weighted
+    mean is at least SIGNAL_COMBINATION_THRESHOLD, -1 when it is at most minus the threshold, otherwise 0.
+    """
+    weights = np.asarray(SIGNAL_COMBINATION_WEIGHTS, dtype=np.float64).reshape((3,) + (1,) * (signals.ndim - 1))
+    active_weight = np.where(active, weights, 0.0)
+    total_weight = active_weight.sum(axis=0)
+    score = np.divide((active_weight * np.where(active, signals, 0)).sum(axis=0), total_weight,
+                      out=np.zeros(total_weight.shape), where=total_weight > 0)
+    return np.where(score >= SIGNAL_COMBINATION_THRESHOLD, 1, np.where(score <= -SIGNAL_COMBINATION_THRESHOLD, -1, 0))
 
-    return df
 
+# Ways of combining the filter, setup and trigger signals, selected with SIGNAL_COMBINATION_RULE
+COMBINATION_RULES = {
+    'unanimous': unanimous_vote,
+    'majority': majority_vote,
+    'weighted': weighted_vote,
+}
 
 
 def calculate_atr(df):
@@ -36,19 +138,8 @@ def calculate_atr(df):
     Returns:
         pd.DataFrame: The input DataFrame with an additional 'ATR' column.
     """
-    # Calculate True Range (TR)
-    high_low = df['High'] - df['Low']
-    high_close = abs(df['High'] - df['Close'].shift(1))
-    low_close = abs(df['Low'] - df['Close'].shift(1))
-    
-    # Combine to get the True Range - take the maximum of the three possible values
-    df['TR'] = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    
-    # Calculate the ATR
-    df['ATR'] = df['TR'].rolling(window=ATR_PERIOD, min_periods=1).mean()
-    
-    # Drop the intermediate 'TR' column
-    df.drop(columns=['TR'], inplace=True)
+    # Calculate the ATR over the True Range, both shared with the indicators through the feature store
+    df['ATR'] = get_feature_store().rolling_mean(df, 'TR', ATR_PERIOD, min_periods=1)
 
     return df
 
@@ -0,0 +1,88 @@
+from globals import *
+import numpy as np
+import pandas as pd
+
+
+# Signals only ever take the values -1, 0, 1 and the 9 "noop" sentinel
+SIGNAL_DTYPE = np.int8
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'VWAP']
+
+# float32 holds 24 significant bits, so every price quoted in cents below 2**17 dollars rounds back to itself
+FLOAT32_EXACT_PRICE_LIMIT = 131_072.0
+
+
+def compact_bars(df, float32_prices=FLOAT32_PRICES):
+    """
+    Returns the bars in a compact layout: 'Symbol' as a categorical, so each row holds a 1 byte code rather than
+    a string, and optionally the prices as float32. 'Datetime' stays datetime64[ns], which is already stored as
+    int64 nanoseconds since the epoch, and 'Volume' / 'Trade_Count' stay float64 as volumes can pass 2**24.
+
+    Precision guarantee for float32 prices: every stored price is within a relative 2**-24 (6e-8) of the
+    original, and prices quoted in cents below FLOAT32_EXACT_PRICE_LIMIT come back exactly through
+    restore_prices. The indicators (through Feature_store.price) and the array back testers read prices that
+    way, so their signals and trades are identical to those on the float64 bars. Larger prices are refused.
+
+    Args:
+        df (pd.DataFrame): Bars as returned by the fetch_historic_* functions.
+        float32_prices (bool): Store the price columns as float32, halving their memory.
+
+    Returns:
+        pd.DataFrame: The compact bars, df itself is not modified.
+    """
+    columns = {}
+    if 'Symbol' in df.columns and not isinstance(df['Symbol'].dtype, pd.CategoricalDtype):
+        columns['Symbol'] = df['Symbol'].astype('category')
+
+    if float32_prices:
+        for column in PRICE_COLUMNS:
+            if column in df.columns and df[column].dtype != np.float32:
+                if df[column].max() >= FLOAT32_EXACT_PRICE_LIMIT:
+                    raise ValueError(f"{column} reaches {df[column].max()}, beyond the {FLOAT32_EXACT_PRICE_LIMIT} float32 can hold to the cent")
+                columns[column] = df[column].astype(np.float32)
+
+    return df.assign(**columns) if columns else df
+
+
+def restore_prices(values, decimals=PRICE_DECIMALS):
+    """
+    Returns prices as float64, rounding float32 prices back to the quoted decimals they were stored from.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return np.round(values.astype(np.float64), decimals)
+    return values.astype(np.float64, copy=False)
+
+
+def benchmark_bar_memory(years=3, candidates=50):
+    """
+    Compares the memory of a multi-year minute dataset, and of a batch of candidate signal matrices,
+    in the default and compact representations.
+    """
+    from replay_data_source import generate_synthetic_bars
+
+    n_bars = years * 252 * 390  # Regular US stock sessions of minute bars
+    df = generate_synthetic_bars(n_bars, bar_interval='1min', start_price=150.0)
+
+    layouts = {
+        'Default': df,
+        'Categorical symbol': compact_bars(df, float32_prices=False),
+        'Categorical symbol, float32 prices': compact_bars(df, float32_prices=True),
+    }
+    print(f"{years} years of minute bars ({n_bars} bars)")
+    default_bytes = df.memory_usage(deep=True).sum()
+    for name, layout in layouts.items():
+        layout_bytes = layout.memory_usage(deep=True).sum()
+        print(f"{name:<36} {layout_bytes / 1024**2:8.1f} MB ({layout_bytes / default_bytes:.0%})")
+
+    for name, dtype in [('int64', np.int64), ('int8', SIGNAL_DTYPE)]:
+        matrix_bytes = 4 * candidates * n_bars * np.dtype(dtype).itemsize  # Filter, setup, trigger and combined
+        print(f"{candidates} candidate signal matrices as {name:<5} {matrix_bytes / 1024**2:8.1f} MB")
+
+    close = df['Close'].to_numpy()
+    assert np.array_equal(restore_prices(layouts['Categorical symbol, float32 prices']['Close'].to_numpy()), close)
+    print("float32 prices restore to the exact cent")
+
+
+if __name__ == "__main__":
+    benchmark_bar_memory()
@@ -6,10 +6,14 @@ from alpaca.data.requests import StockBarsRequest, CryptoBarsRequest
 from alpaca.trading.requests import AssetStatus, AssetClass
 import pandas as pd
 import yfinance as yf
+from bar_cache import get_bar_cache
+from replay_data_source import fetch_historic_replay_data
+from compact_bars import compact_bars
+from stage_profiler import profile_stage
 
 
 
-def fetch_historic_yfinance_data(start_date, end_date, interval):
+def fetch_historic_yfinance_data(start_date, end_date, interval, use_cache=USE_BAR_CACHE):
     """
     Fetches historical stock data for a given ticker between two dates.
     
@@ -18,11 +22,33 @@ def fetch_historic_yfinance_data(start_date, end_date, interval):
         start_date (str): The start date for data retrieval (format 'YYYY-MM-DD').
         end_date (str): The end date for data retrieval (format 'YYYY-MM-DD').
         interval (str): The data interval (e.g., '1d', '1m', '5m').
+        use_cache (bool): Serve whatever is already in the on-disk bar cache and only download the gaps.
         
     Returns:
         pd.DataFrame: DataFrame with historical stock data.
     """
-    
+    if not use_cache:
+        return download_historic_yfinance_data(start_date, end_date, interval)
+
+    # yfinance reads dates as exchange wall time with an exclusive end, so key the cache on naive wall time
+    start_key = to_wall_time(pd.Timestamp(start_date)).value
+    end_key = to_wall_time(pd.Timestamp(end_date)).value - 1
+
+    def fetch_gap(gap_start, gap_end):
+        return download_historic_yfinance_data(pd.Timestamp(gap_start), pd.Timestamp(gap_end + 1), interval)
+
+    def row_key(df):
+        return to_wall_time(pd.DatetimeIndex(df['Datetime'])).as_unit('ns').asi8
+
+    return get_bar_cache().get_bars('yfinance', TICKER, interval, start_key, end_key, fetch_gap, row_key)
+
+
+def to_wall_time(datetimes):
+    return datetimes.tz_localize(None) if datetimes.tz is not None else datetimes
+
+
+def download_historic_yfinance_data(start_date, end_date, interval):
+
     # Fetch data between start_date and end_date
     df = yf.download(TICKER, start=start_date, end=end_date, interval=interval)
 
@@ -40,7 +66,42 @@ def fetch_historic_yfinance_data(start_date, end_date, interval):
     return df
 
 
-def fetch_historic_alpaca_data(period_start, period_end, interval):
+def fetch_historic_alpaca_data(period_start, period_end, interval, use_cache=USE_BAR_CACHE):
+    """
+    Fetches historical bars for TICKER / CRYPTO_TICKER from Alpaca between two times (both inclusive).
+
+    Args:
+        period_start, period_end: Start and end of the period, naive times are taken as UTC.
+        interval (TimeFrame): The bar interval.
+        use_cache (bool): Serve whatever is already in the on-disk bar cache and only download the gaps.
+
+    Returns:
+        pd.DataFrame: DataFrame with the bars.
+    """
+    if not use_cache:
+        return download_historic_alpaca_data(period_start, period_end, interval)
+
+    start_key = to_utc(pd.Timestamp(period_start)).value
+    end_key = to_utc(pd.Timestamp(period_end)).value
+
+    def fetch_gap(gap_start, gap_end):
+        return download_historic_alpaca_data(pd.Timestamp(gap_start, tz='UTC'), pd.Timestamp(gap_end, tz='UTC'), interval)
+
+    def row_key(df):
+        return to_utc(pd.DatetimeIndex(df['Datetime'])).as_unit('ns').asi8
+
+    symbol = CRYPTO_TICKER if CRYPTO else TICKER
+    return get_bar_cache().get_bars('alpaca', symbol, interval.value, start_key, end_key, fetch_gap, row_key)
+
+
+def to_utc(datetimes):
+    return datetimes.tz_localize('UTC') if datetimes.tz is None else datetimes.tz_convert('UTC')
+
+
+def download_historic_alpaca_data(period_start, period_end, interval, symbols=None):
+    """
+    Downloads bars from Alpaca, for TICKER / CRYPTO_TICKER unless symbols lists the symbols to fetch in one request.
+    """
 
     # Load environment variables from .env file
     load_dotenv(override=True)
@@ -54,7 +115,7 @@ def fetch_historic_alpaca_data(period_start, period_end, interval):
     if STOCK:
         data_client = StockHistoricalDataClient(ALPACA_PERSONAL_API_KEY_ID, ALPACA_PERSONAL_API_SECRET_KEY)
         request_params = StockBarsRequest(
-            symbol_or_symbols=TICKER,
+            symbol_or_symbols=symbols or TICKER,
             timeframe=interval,
             start=period_start,
             end=period_end
@@ -62,7 +123,7 @@ def fetch_historic_alpaca_data(period_start, period_end, interval):
     elif CRYPTO:
         data_client = CryptoHistoricalDataClient(ALPACA_PERSONAL_API_KEY_ID, ALPACA_PERSONAL_API_SECRET_KEY)
         request_params = CryptoBarsRequest(
-            symbol_or_symbols=CRYPTO_TICKER,
+            symbol_or_symbols=symbols or CRYPTO_TICKER,
             timeframe=interval,
             start=period_start,
             end=period_end
@@ -80,38 +141,35 @@ def fetch_historic_alpaca_data(period_start, period_end, interval):
     return df
 
 
-def fetch_data(data_window_type):
-
-    if ALPACA_DATA_SOURCE:
-
-        if data_window_type == 'Training':
-            df = fetch_historic_alpaca_data(TRAINING_PERIOD_START, TRAINING_PERIOD_END, ALPACA_INTERVAL)
-
-        elif data_window_type == 'Unseen':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START, UNSEEN_PERIOD_END, ALPACA_INTERVAL)
-        
-        elif data_window_type == 'Unseen 1':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START_1, UNSEEN_PERIOD_END_1, ALPACA_INTERVAL)
+# Start and end of each named data window
+DATA_WINDOWS = {
+    'Training': (TRAINING_PERIOD_START, TRAINING_PERIOD_END),
+    'Unseen': (UNSEEN_PERIOD_START, UNSEEN_PERIOD_END),
+    'Unseen 1': (UNSEEN_PERIOD_START_1, UNSEEN_PERIOD_END_1),
+    'Unseen 2': (UNSEEN_PERIOD_START_2, UNSEEN_PERIOD_END_2),
+    'Unseen 3': (UNSEEN_PERIOD_START_3, UNSEEN_PERIOD_END_3),
+    'Unseen 4': (UNSEEN_PERIOD_START_4, UNSEEN_PERIOD_END_4),
+    'Unseen 5': (UNSEEN_PERIOD_START_5, UNSEEN_PERIOD_END_5),
+}
 
-        elif data_window_type == 'Unseen 2':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START_2, UNSEEN_PERIOD_END_2, ALPACA_INTERVAL)
 
-        elif data_window_type == 'Unseen 3':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START_3, UNSEEN_PERIOD_END_3, ALPACA_INTERVAL)
+def fetch_data(data_window_type):
 
-        elif data_window_type == 'Unseen 4':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START_4, UNSEEN_PERIOD_END_4, ALPACA_INTERVAL)
+    period_start, period_end = DATA_WINDOWS[data_window_type]
 
-        elif data_window_type == 'Unseen 5':
-            df = fetch_historic_alpaca_data(UNSEEN_PERIOD_START_5, UNSEEN_PERIOD_END_5, ALPACA_INTERVAL)
+    with profile_stage('fetch_data'):
+        # The replay source takes precedence so offline runs only need the one flag turning on
+        if REPLAY_DATA_SOURCE:
+            df = fetch_historic_replay_data(period_start, period_end, ALPACA_INTERVAL)
 
-    elif YFINANCE_DATA_SOURCE:
+        elif ALPACA_DATA_SOURCE:
+            df = fetch_historic_alpaca_data(period_start, period_end, ALPACA_INTERVAL)
 
-        if data_window_type == 'Training': 
-            df = fetch_historic_yfinance_data(TRAINING_PERIOD_START, TRAINING_PERIOD_END, YFINANCE_INTERVAL)
+        elif YFINANCE_DATA_SOURCE:
+            df = fetch_historic_yfinance_data(period_start, period_end, YFINANCE_INTERVAL)
 
-        elif data_window_type == 'Unseen':
-            df = fetch_historic_yfinance_data(UNSEEN_PERIOD_START, UNSEEN_PERIOD_END, YFINANCE_INTERVAL)
+        if COMPACT_BARS:
+            df = compact_bars(df)
 
     return df
 
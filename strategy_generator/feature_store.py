@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from globals import *
+import numpy as np
+import pandas as pd
+from indicator_cache import get_indicator_cache
+from compact_bars import restore_prices
+
+
+# Windowed features as the pandas calls the indicators made, each taking (series, window, min_periods)
+FEATURE_CALCULATIONS = {
+    'rolling_mean': lambda series, window, min_periods: series.rolling(window=window, min_periods=min_periods).mean(),
+    'rolling_std': lambda series, window, min_periods: series.rolling(window=window).std(),
+    'rolling_min': lambda series, window, min_periods: series.rolling(window=window).min(),
+    'rolling_max': lambda series, window, min_periods: series.rolling(window=window).max(),
+    'ema': lambda series, window, min_periods: series.ewm(span=window, min_periods=min_periods, adjust=False).mean(),
+}
+
+# Indicator function name to the windowed features it reads that can be built for every window as one array,
+# as (feature, source column, window parameter, min_periods). Rolling means / stds and EMAs are left to be
+# calculated on demand: a cumulative sum would not round as pandas' compensated running sum does, and filling
+# them a window at a time with the pandas calls costs as much as calculating them when a trial asks
+SWEEP_FEATURES = {
+    'generate_Stochastic_setup_signal': [('rolling_min', 'Low', 'k_period', None),
+                                         ('rolling_max', 'High', 'k_period', None)],
+}
+
+
+class Feature_store:
+    """
+    Per-frame store of the building blocks the indicators share: True Range, rolling mean / std / min / max
+    by window, EMA by span and diff, each calculated once per frame and reused by every indicator.
+
+    Results are keyed by the frame's data fingerprint (see Indicator_cache.get_fingerprint), so copies of the
+    same bars share them. Every value is calculated with the same pandas call the indicators used to make,
+    and returned as a read-only NumPy array. Least recently used results are evicted beyond max_bytes.
+    """
+
+    def __init__(self, max_bytes=FEATURE_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.features = OrderedDict()
+        self.bytes = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+
+    def get(self, df, key, calculate):
+        """
+        Returns the feature named by key for df, calling calculate() only if it is not stored yet.
+        """
+        if not USE_FEATURE_STORE:
+            return calculate()
+
+        store_key = (get_indicator_cache().get_fingerprint(df),) + key
+        values = self.features.get(store_key)
+        if values is not None:
+            self.stats['hits'] += 1
+            self.features.move_to_end(store_key)
+            return values
+
+        self.stats['misses'] += 1
+        values = calculate()
+        self.put(store_key, values)
+        return values
+
+
+    def put(self, store_key, values):
+        values.flags.writeable = False
+        if store_key in self.features:
+            self.bytes -= self.features[store_key].nbytes
+        self.features[store_key] = values
+        self.bytes += values.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self.features.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.stats['evictions'] += 1
+
+
+    def precompute_sweep(self, df, functions_info):
+        """
+        Fills the store, before a study starts, with every windowed feature the indicators in functions_info
+        can ask for over their declared integer ranges, so each trial's feature lookup is a row of a
+        precomputed (windows x bars) array.
+
+        Only the rolling min / max of SWEEP_FEATURES are precomputed, built with one np.minimum / np.maximum
+        per window, each window extending the previous one by a bar.
+
+        Args:
+            df (pd.DataFrame): The bars the study runs on.
+            functions_info (dict): One of the parameter dictionaries from indicator_param_dict_intra / _swing.
+
+        Returns:
+            int: The number of features precomputed.
+        """
+        if not USE_FEATURE_STORE:
+            return 0
+
+        # Group the windows by feature so each tensor is built once however many indicators share it
+        sweeps = {}
+        for stage_functions in functions_info.values():
+            for func_name, func_info in stage_functions.items():
+                for feature, column, window_param, min_periods in SWEEP_FEATURES.get(func_name, []):
+                    param_type, start, end = func_info['params'][window_param]
+                    if param_type == 'int':
+                        sweeps.setdefault((feature, column, min_periods), set()).update(range(start, end + 1))
+
+        fingerprint = get_indicator_cache().get_fingerprint(df)
+        precomputed = 0
+        for (feature, column, min_periods), windows in sweeps.items():
+            windows = sorted(windows)
+            # Leave windows to be calculated on demand rather than evict features already stored
+            if self.bytes + len(windows) * len(df) * 8 > self.max_bytes:
+                continue
+
+            tensor = self.build_sweep_tensor(df, feature, column, windows)
+            tensor.flags.writeable = False
+            for window, values in zip(windows, tensor):
+                self.put((fingerprint, feature, column, window, min_periods), values)
+            precomputed += len(windows)
+
+        return precomputed
+
+
+    def build_sweep_tensor(self, df, feature, column, windows):
+        series = self.source(df, column)
+        source = series.to_numpy(dtype=np.float64)
+        tensor = np.empty((len(windows), len(source)), dtype=np.float64)
+
+        extend = np.minimum if feature == 'rolling_min' else np.maximum
+        running = source.copy()  # Window of one bar
+        row = 0
+        for window in range(1, windows[-1] + 1):
+            if window > len(source):
+                running[:] = np.nan
+            elif window > 1:
+                # Extend every window back by one bar, the first full window is now one bar later
+                running[window - 1:] = extend(running[window - 1:], source[:len(source) - window + 1])
+                running[window - 2] = np.nan
+            if window == windows[row]:
+                tensor[row] = running
+                row += 1
+        return tensor
+
+
+    def source(self, df, column):
+        # Only the fingerprinted price columns and the True Range can be sources, anything else would not be part of the key
+        if column == 'TR':
+            return pd.Series(self.true_range(df))
+        return pd.Series(self.price(df, column), index=df.index)
+
+
+    def price(self, df, column):
+        """
+        Returns a price column as float64. float32 prices (see compact_bars) are restored to the prices they were
+        stored from once per frame, so indicators calculate exactly what they would on the float64 bars.
+        """
+        if df[column].dtype != np.float32:
+            return df[column].to_numpy(dtype=np.float64)
+        return self.get(df, ('price', column), lambda: restore_prices(df[column]))
+
+
+    def true_range(self, df):
+        def calculate():
+            high = self.source(df, 'High')
+            low = self.source(df, 'Low')
+            close = self.source(df, 'Close')
+            high_low = high - low
+            high_close = abs(high - close.shift(1))
+            low_close = abs(low - close.shift(1))
+            return pd.concat([high_low, high_close, low_close], axis=1).max(axis=1).to_numpy()
+        return self.get(df, ('TR',), calculate)
+
+
+    def windowed(self, df, feature, column, window, min_periods=None):
+        return self.get(df, (feature, column, window, min_periods),
+                        lambda: FEATURE_CALCULATIONS[feature](self.source(df, column), window, min_periods).to_numpy())
+
+
+    def rolling_mean(self, df, column, window, min_periods=None):
+        return self.windowed(df, 'rolling_mean', column, window, min_periods)
+
+
+    def rolling_std(self, df, column, window):
+        return self.windowed(df, 'rolling_std', column, window)
+
+
+    def rolling_min(self, df, column, window):
+        return self.windowed(df, 'rolling_min', column, window)
+
+
+    def rolling_max(self, df, column, window):
+        return self.windowed(df, 'rolling_max', column, window)
+
+
+    def ema(self, df, column, span, min_periods=0):
+        return self.windowed(df, 'ema', column, span, min_periods)
+
+
+    def diff(self, df, column):
+        return self.get(df, ('diff', column), lambda: self.source(df, column).diff().to_numpy())
+
+
+    def __str__(self) -> str:
+        requests = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / requests * 100 if requests else 0.0
+        return (f"\nFeature store\n"
+                f"Requests: {requests} (hits: {self.stats['hits']}, misses: {self.stats['misses']})\n"
+                f"Hit rate: {hit_rate:.2f}%\n"
+                f"Features: {len(self.features)}, evictions: {self.stats['evictions']}\n"
+                f"Size: {self.bytes / 1024**2:.2f} MB of {self.max_bytes / 1024**2:.2f} MB\n")
+
+
+feature_store = None
+
+
+def get_feature_store():
+    global feature_store
+    if feature_store is None:
+        feature_store = Feature_store()
+    return feature_store
+
+
+def precompute_sweep_features(df, functions_info):
+    """
+    Precomputes the windowed features of every trial a study can run when PRECOMPUTE_SWEEP_FEATURES is set.
+    """
+    if PRECOMPUTE_SWEEP_FEATURES:
+        return get_feature_store().precompute_sweep(df, functions_info)
+    return 0
+
+
+def print_feature_store_stats():
+    if USE_FEATURE_STORE:
+        print(get_feature_store())
+
+
+def test_precompute_sweep():
+    from replay_data_source import generate_synthetic_bars
+    from indicator_param_dict_intra import intra_functions_info
+    from indicator_param_dict_swing import swing_functions_info
+
+    df = generate_synthetic_bars(3000, seed=1)
+    df.loc[100:130, ['High', 'Low', 'Close']] = 100.0  # Flat bars, where rolling sums are hardest to reproduce
+
+    for functions_info in [intra_functions_info, swing_functions_info]:
+        precomputed_store = Feature_store()
+        precomputed = precomputed_store.precompute_sweep(df, functions_info)
+        on_demand_store = Feature_store()
+        for key, values in list(precomputed_store.features.items()):
+            if key[1] in ('TR', 'price'):
+                continue
+            feature, column, window, min_periods = key[1:]
+            expected = on_demand_store.windowed(df, feature, column, window, min_periods)
+            assert np.array_equal(values, expected, equal_nan=True), key
+        assert precomputed_store.stats['misses'] == 0
+        print(f"{precomputed} precomputed features match their on demand values")
+
+
+if __name__ == "__main__":
+    test_precompute_sweep()
@@ -18,6 +18,37 @@ STARTING_BALANCE = 1000
 # Choose a data source
 YFINANCE_DATA_SOURCE = False
 ALPACA_DATA_SOURCE = True
+REPLAY_DATA_SOURCE = False # Reads bars from local replay files (see replay_data_source.py) so no network or credentials are needed
+REPLAY_DATA_DIRECTORY = 'replay_data'
+
+# On-disk cache of fetched bars, only the missing parts of a requested period are downloaded
+USE_BAR_CACHE = True
+BAR_CACHE_DIRECTORY = 'bar_cache'
+BAR_CACHE_MAX_BYTES = 2 * 1024**3
+BAR_CACHE_SETTLE_DELAY = '1D' # Bars newer than this may still change or be missing, so their range is not cached as complete
+
+# Live sessions keep their latest bars in a fixed size ring buffer, sized from the strategy lookback
+LIVE_BAR_STORE_MIN_CAPACITY = 100
+SPILL_LIVE_BARS = True # Append bars evicted from the ring buffer to disk so the whole session can be plotted
+LIVE_BAR_SPILL_DIRECTORY = 'live_bars'
+
+# Live trading - every symbol is traded with the one strategy from one process, sharing one websocket and one trading client
+LIVE_SYMBOLS = [] # e.g. ["MA", "V", "AXP"], empty trades TICKER / CRYPTO_TICKER
+ORDER_ROUTER_MAX_IN_FLIGHT = 8 # Symbols whose orders can be submitted at once
+
+# Live order fills are polled in the background with a delay doubling from the initial to the max delay, giving up after the timeout (seconds)
+ORDER_POLL_INITIAL_DELAY = 0.25
+ORDER_POLL_MAX_DELAY = 4
+ORDER_FILL_TIMEOUT = 60
+
+# Live order and position state is kept from the trade updates stream, so closes don't need a REST round trip
+USE_TRADE_UPDATES_STREAM = True
+TRADE_UPDATES_URL = None # None uses Alpaca's stream, or e.g. the url of a local trade_updates.Mock_trade_updates_server
+
+# Live latency - histograms of the time from a bar's receipt to the strategy update, trade decision and order acknowledgement
+MEASURE_LIVE_LATENCY = True
+LATENCY_LOG_INTERVAL = 100 # Log the p50 / p99 latencies every this many bars, 0 only reports them on shutdown
+LATENCY_REPORT_DIRECTORY = 'latency_reports'
 
 # Choose dates
 TRAINING_PERIOD_START = '2024-05-01'
@@ -31,6 +62,30 @@ ALPACA_INTERVAL = TimeFrame.Day
 
 # ML parameter optimisation parameters
 NUMBER_OF_TRIALS = 300
+OPTIMISATION_BATCH_SIZE = 0 # Trials scored per batch_backtest call using ask-and-tell, 0 runs each trial through objective()
+
+# Memoise indicator results across trials, keyed by the data, the indicator function and its parameters
+USE_INDICATOR_CACHE = True
+INDICATOR_CACHE_MAX_BYTES = 512 * 1024**2
+
+# Feature store - building blocks shared by the indicators (True Range, rolling windows, EMAs) are calculated once per data set
+USE_FEATURE_STORE = True
+FEATURE_STORE_MAX_BYTES = 256 * 1024**2
+PRECOMPUTE_SWEEP_FEATURES = True # Build every rolling min / max window in the parameter ranges up front as one array, so trials only look them up
+
+# Write every indicator's helper columns (e.g. 'MA', 'rsi', 'SAR') into the strategy DataFrame, only needed for plotting or debugging
+MATERIALISE_INDICATOR_COLUMNS = False
+
+# Compact bars - categorical Symbol and int8 signals, optionally float32 prices (exact to the cent below $131,072)
+COMPACT_BARS = True
+FLOAT32_PRICES = False
+PRICE_DECIMALS = 2 # Decimals prices are quoted in, float32 prices are rounded back to these
+
+# Parallel optimisation - trials are spread across worker processes sharing a journal file storage
+PARALLEL_OPTIMISATION = False
+NUMBER_OF_WORKERS = 0 # 0 uses every core
+OPTIMISATION_SEED = 42
+OPTUNA_JOURNAL_DIRECTORY = 'optuna_journal'
 
 # Objectives - Only two can be chosen at the moment
 MULTI_OBJECTIVE = True
@@ -51,9 +106,28 @@ CLOSE_POSITION_WITH_SLTP = True # Boolean to set whether trades can be closed wi
 RISK_REWARD_RATIO = 4 # sets the take profit / stop loss ratio
 ATR_MULTIPLIER = 1.5 # sets the multiple of the average true range to calculate the stop loss
 
+# How the filter, setup and trigger signals are combined - 'unanimous', 'majority' or 'weighted' (see combined_strategy.COMBINATION_RULES)
+SIGNAL_COMBINATION_RULE = 'unanimous'
+SIGNAL_COMBINATION_WEIGHTS = (1.0, 1.0, 1.0) # Filter, setup and trigger weights for the weighted rule
+SIGNAL_COMBINATION_THRESHOLD = 0.5 # Weighted mean signal needed to buy (or minus it to sell) with the weighted rule
+
 # Choose period for ATR
 ATR_PERIOD = 10
 
+# Backtest engine - the array engine runs the trading rules over NumPy columns instead of df.iterrows(), producing the same trades
+ARRAY_BACKTEST_ENGINE = True
+USE_NUMBA = True # JIT-compile the backtest kernels when numba is installed, falls back to pure Python otherwise
+
+# Stage profiling - record the wall time and allocations of each optimisation stage per trial, reported and exported at study end
+PROFILE_STAGES = False
+PROFILE_DIRECTORY = 'profiles'
+
+# Benchmark suite (benchmark_suite.py) - run on synthetic bars, results are written as JSON to compare across commits
+BENCHMARK_BARS = 20_000
+BENCHMARK_TRIALS = 50
+BENCHMARK_REPEATS = 5
+BENCHMARK_DIRECTORY = 'benchmarks'
+
 # Parameter optimisation float precision
 FLOAT_PRECISION = 0.01
 
@@ -0,0 +1,52 @@
+import inspect
+import functools
+import numpy as np
+from compact_bars import SIGNAL_DTYPE
+
+
+def indicator(signal_column, exports=()):
+    """
+    Decorator for the filter, setup and trigger functions.
+
+    The decorated function reads the bars from df without writing to it and returns a dict of the columns it
+    calculates, helper columns first and signal_column last. The result is the usual func(df, *args, **params)
+    indicator that writes every column into df and returns it, which plotting and debugging rely on, plus a
+    func.signals(df, *args, **params) which leaves df untouched and returns only the signal and exported columns.
+    Parameters can be passed positionally or by name, as to the decorated function. Either way the signal is
+    stored as SIGNAL_DTYPE.
+
+    An indicator whose helper columns take work the signal doesn't need, e.g. ADX's True Range parts, declares a
+    keyword-only materialise parameter. It is set by func(df, ...) and left unset by func.signals(df, ...),
+    so the optimiser's hot path never calculates those columns.
+
+    Args:
+        signal_column (str): 'Filter_Signal', 'Setup_Signal' or 'Trigger_Signal'.
+        exports (tuple): Further columns the backtest reads, e.g. the 'ATR' that ADX replaces.
+    """
+    def decorate(calculate):
+        signature = inspect.signature(calculate)
+        takes_materialise = 'materialise' in signature.parameters
+
+        def calculate_columns(df, args, params, materialise):
+            if takes_materialise:
+                params = dict(params, materialise=materialise)
+            bound = signature.bind(df, *args, **params)
+            columns = calculate(*bound.args, **bound.kwargs)
+            columns[signal_column] = np.asarray(columns[signal_column]).astype(SIGNAL_DTYPE)
+            return columns
+
+        @functools.wraps(calculate)
+        def apply(df, *args, **params):
+            for column, values in calculate_columns(df, args, params, materialise=True).items():
+                df[column] = values
+            return df
+
+        def signals(df, *args, **params):
+            columns = calculate_columns(df, args, params, materialise=False)
+            return {column: np.asarray(columns[column]) for column in (signal_column,) + tuple(exports)}
+
+        apply.signals = signals
+        apply.signal_column = signal_column
+        return apply
+
+    return decorate
@@ -0,0 +1,266 @@
+import weakref
+import hashlib
+from collections import OrderedDict
+from globals import *
+import numpy as np
+
+
+# The indicators only read these columns, so frames with equal values give equal indicator results
+FINGERPRINT_COLUMNS = ['High', 'Low', 'Close']
+MAX_FINGERPRINTED_FRAMES = 8
+
+
+class Indicator_cache:
+    """
+    In-memory LRU cache of indicator results, keyed by (data fingerprint, indicator function, params).
+
+    An entry holds the columns the indicator added or changed, and any it dropped, so a hit rebuilds
+    exactly the DataFrame the indicator would have returned. Entries are evicted least recently used
+    first once their arrays, and the copies of the fingerprinted frames, exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=INDICATOR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.fingerprinted_frames = OrderedDict()  # Fingerprint to copies of the fingerprinted columns
+        self.frame_fingerprints = OrderedDict()    # id(df) to (weak reference to df, fingerprint)
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+
+    def apply(self, func, df, params):
+        """
+        Returns func(df, **params), reusing the stored result when the same indicator has already run on equal data.
+        """
+        if not all(column in df.columns for column in FINGERPRINT_COLUMNS):
+            return func(df, **params)
+
+        key = (self.get_fingerprint(df), func, tuple(sorted(params.items())))
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            self.stats['hits'] += 1
+            self.entries.move_to_end(key)
+            added, dropped = entry
+            df = df.drop(columns=[column for column in dropped if column in df.columns])
+            for column, values in added.items():
+                df[column] = values
+            return df
+
+        self.stats['misses'] += 1
+        before_columns = list(df.columns)
+        # Indicators only write numeric columns, so Symbol / Datetime never need converting and comparing
+        before = {column: df[column].to_numpy() for column in before_columns if df[column].dtype.kind in 'biuf'}
+        df = func(df, **params)
+        self.store(key, df, before_columns, before)
+        return df
+
+
+    def signals(self, func, df, params):
+        """
+        Returns func.signals(df, **params), the signal and exported arrays of an indicator, reusing the stored
+        arrays when the same indicator has already run on equal data. df is never written to.
+        """
+        if not all(column in df.columns for column in FINGERPRINT_COLUMNS):
+            return func.signals(df, **params)
+
+        key = (self.get_fingerprint(df), func, tuple(sorted(params.items())), 'signals')
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            self.stats['hits'] += 1
+            self.entries.move_to_end(key)
+            return dict(entry[0])
+
+        self.stats['misses'] += 1
+        outputs = {column: np.asarray(values) for column, values in func.signals(df, **params).items()}
+        for values in outputs.values():
+            values.flags.writeable = False
+        self.insert(key, outputs, [])
+        return dict(outputs)
+
+
+    def store(self, key, df, before_columns, before):
+        added = {}
+        for column in df.columns:
+            if column in before_columns and column not in before:
+                continue
+            values = df[column].to_numpy()
+            if column in before and (np.shares_memory(values, before[column]) or array_equal(values, before[column])):
+                continue
+            added[column] = values.copy()
+            added[column].flags.writeable = False
+        dropped = [column for column in before_columns if column not in df.columns]
+        self.insert(key, added, dropped)
+
+
+    def insert(self, key, added, dropped):
+        entry_bytes = sum(values.nbytes for values in added.values())
+        if entry_bytes > self.max_bytes:
+            return
+
+        self.entries[key] = (added, dropped)
+        self.bytes += entry_bytes
+        self.evict()
+
+
+    def evict(self):
+        while self.bytes > self.max_bytes and self.entries:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= sum(values.nbytes for values in evicted.values())
+            self.stats['evictions'] += 1
+
+
+    def get_fingerprint(self, df):
+        """
+        Returns the fingerprint of the data in df, hashing it only the first time equal data is seen.
+
+        Fingerprints are remembered by id(df) in the cache, never in df, along with a weak reference so a
+        recycled id is not matched. Every lookup compares the fingerprinted columns in full with the copy kept
+        of them, so an edit in place is always seen, and a new frame, e.g. a copy, is compared with the frames
+        already fingerprinted before it is hashed. The copies count towards max_bytes.
+        """
+        columns = [df[column].to_numpy() for column in FINGERPRINT_COLUMNS]
+
+        remembered = self.frame_fingerprints.get(id(df))
+        if remembered is not None:
+            frame_reference, fingerprint = remembered
+            stored = self.fingerprinted_frames.get(fingerprint)
+            if frame_reference() is df and stored is not None and columns_equal(columns, stored):
+                self.frame_fingerprints.move_to_end(id(df))
+                self.fingerprinted_frames.move_to_end(fingerprint)
+                return fingerprint
+
+        fingerprint = None
+        for candidate in reversed(self.fingerprinted_frames):
+            if columns_equal(columns, self.fingerprinted_frames[candidate]):
+                fingerprint = candidate
+                self.fingerprinted_frames.move_to_end(fingerprint)
+                break
+
+        if fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for values in columns:
+                digest.update(values.dtype.str.encode())
+                digest.update(np.ascontiguousarray(values).view(np.uint8))
+            fingerprint = digest.hexdigest()
+
+            self.fingerprinted_frames[fingerprint] = [values.copy() for values in columns]
+            self.bytes += sum(values.nbytes for values in columns)
+            if len(self.fingerprinted_frames) > MAX_FINGERPRINTED_FRAMES:
+                _, evicted = self.fingerprinted_frames.popitem(last=False)
+                self.bytes -= sum(values.nbytes for values in evicted)
+            self.evict()
+
+        self.frame_fingerprints[id(df)] = (weakref.ref(df), fingerprint)
+        if len(self.frame_fingerprints) > MAX_FINGERPRINTED_FRAMES:
+            self.frame_fingerprints.popitem(last=False)
+        return fingerprint
+
+
+    def __str__(self) -> str:
+        requests = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / requests * 100 if requests else 0.0
+        return (f"\nIndicator cache\n"
+                f"Requests: {requests} (hits: {self.stats['hits']}, misses: {self.stats['misses']})\n"
+                f"Hit rate: {hit_rate:.2f}%\n"
+                f"Entries: {len(self.entries)}, evictions: {self.stats['evictions']}\n"
+                f"Size: {self.bytes / 1024**2:.2f} MB of {self.max_bytes / 1024**2:.2f} MB\n")
+
+
+def columns_equal(columns, stored):
+    return all(array_equal(values, stored_values) for values, stored_values in zip(columns, stored))
+
+
+def array_equal(a, b):
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    if a.dtype.kind == 'f':
+        # Equal bits are the common case and much cheaper to check than NaN-aware equality
+        if a.flags.c_contiguous and b.flags.c_contiguous and np.array_equal(a.view(np.uint8), b.view(np.uint8)):
+            return True
+        return np.array_equal(a, b, equal_nan=True)
+    return np.array_equal(a, b)
+
+
+indicator_cache = None
+
+
+def get_indicator_cache():
+    global indicator_cache
+    if indicator_cache is None:
+        indicator_cache = Indicator_cache()
+    return indicator_cache
+
+
+def apply_indicator(func, df, params={}):
+    """
+    Runs an indicator function on df, through the indicator cache when USE_INDICATOR_CACHE is set.
+    """
+    if USE_INDICATOR_CACHE:
+        return get_indicator_cache().apply(func, df, params)
+    return func(df, **params)
+
+
+def indicator_signals(func, df, params={}):
+    """
+    Returns the signal and exported arrays of an indicator function without writing to df, through the
+    indicator cache when USE_INDICATOR_CACHE is set.
+    """
+    if USE_INDICATOR_CACHE:
+        return get_indicator_cache().signals(func, df, params)
+    return func.signals(df, **params)
+
+
+def print_indicator_cache_stats():
+    if USE_INDICATOR_CACHE:
+        print(get_indicator_cache())
+
+
+def test_fingerprint():
+    import time
+    from replay_data_source import generate_synthetic_bars
+
+    cache = Indicator_cache()
+    df = generate_synthetic_bars(20_000)
+    fingerprint = cache.get_fingerprint(df)
+    assert not df.attrs
+
+    # Copies share the fingerprint, an edit or a replaced column gets a new one
+    assert cache.get_fingerprint(df.copy()) == fingerprint
+    edited = df.copy()
+    edited.loc[0, 'Close'] += 1.0
+    assert cache.get_fingerprint(edited) != fingerprint
+    replaced = df.copy()
+    replaced['High'] = replaced['High'] + 1.0
+    assert cache.get_fingerprint(replaced) != fingerprint
+    assert cache.get_fingerprint(df) == fingerprint
+
+    # An edit in place gets a new fingerprint, so no stale indicator or feature is returned
+    from indicator_setup import generate_RSI_setup_signal
+    from feature_store import Feature_store
+    params = {'period': 14, 'overbought_condition': 70, 'oversold_condition': 30}
+    features = Feature_store()
+    cache.signals(generate_RSI_setup_signal, df, params)
+    features.rolling_mean(df, 'Close', 20)
+    df.loc[1001:1030, 'Close'] *= 1.5
+    assert cache.get_fingerprint(df) != fingerprint
+    edited_signal = cache.signals(generate_RSI_setup_signal, df, params)['Setup_Signal']
+    assert np.array_equal(edited_signal, generate_RSI_setup_signal.signals(df, **params)['Setup_Signal'])
+    assert np.array_equal(features.rolling_mean(df, 'Close', 20), df['Close'].rolling(20).mean().to_numpy(), equal_nan=True)
+
+    # The copies of the fingerprinted frames count towards the cache size
+    assert cache.bytes >= sum(sum(values.nbytes for values in stored) for stored in cache.fingerprinted_frames.values())
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        cache.get_fingerprint(df)
+    print(f"Fingerprint lookups of a known frame take {(time.perf_counter() - start) * 1000:.1f}us")
+
+
+if __name__ == "__main__":
+    test_fingerprint()
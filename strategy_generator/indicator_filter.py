@@ -1,21 +1,52 @@
 from globals import *
+import numpy as np
 import pandas as pd
 from data_fetch import *
+from feature_store import get_feature_store
+from indicator_base import indicator
 
 
+@indicator('Filter_Signal')
 def noop_filter(df):
     """
     No-operation filter that assigns a constant value of 9 to the 'Filter_Signal' column.
     """
     # Initialize the 'Filter_Signal' column with the value 9
-    df['Filter_Signal'] = 9
-    return df
+    return {'Filter_Signal': np.full(len(df), 9, dtype=np.int64)}
 
 
+@indicator('Filter_Signal')
 def generate_SMA_filter_signal(df, sma_window, look_back_period):
     """
     Filter signal which checks that the previous 3 closing prices have been above the SMA with period defined as sma_window
     """
+    features = get_feature_store()
+    sma = features.rolling_mean(df, 'Close', sma_window)
+
+    close = features.price(df, 'Close')
+
+    # Running counts of closes above / below the SMA, so any window of previous bars is counted with one subtraction
+    above_count = np.concatenate([[0], np.cumsum(close > sma)])
+    below_count = np.concatenate([[0], np.cumsum(close < sma)])
+
+    # Bar i looks at the previous look_back_period bars, clipped at the first bar
+    index = np.arange(len(df))
+    window_start = np.maximum(index - look_back_period, 0)
+    window_length = index - window_start
+
+    all_above = above_count[index] - above_count[window_start] == window_length
+    all_below = below_count[index] - below_count[window_start] == window_length
+
+    signal = np.where(all_above, 1, np.where(all_below, -1, 0))
+    signal[:3] = 0  # The first 3 rows are never checked
+
+    return {f'SMA_{sma_window}': sma, 'Filter_Signal': signal.astype(np.int64)}
+
+
+def generate_SMA_filter_signal_loop(df, sma_window, look_back_period):
+    """
+    Original row by row SMA filter, kept as the reference the vectorised version is tested against.
+    """
     sma_window_name = f'SMA_{sma_window}'
     df[sma_window_name] = df['Close'].rolling(window=sma_window).mean()
 
@@ -33,6 +64,7 @@ def generate_SMA_filter_signal(df, sma_window, look_back_period):
     return df
 
 
+@indicator('Filter_Signal')
 def generate_BollingerBands_filter_signal(df, bollinger_window, num_std_dev):
     """
     Bollinger Bands filter that identifies potential buy/sell zones.
@@ -43,41 +75,50 @@ def generate_BollingerBands_filter_signal(df, bollinger_window, num_std_dev):
     
     Returns: DataFrame with the 'Filter_Signal' column added.
     """
-    df['MA'] = df['Close'].rolling(window=bollinger_window).mean()
-    df['BB_Upper'] = df['MA'] + num_std_dev * df['Close'].rolling(window=bollinger_window).std()
-    df['BB_Lower'] = df['MA'] - num_std_dev * df['Close'].rolling(window=bollinger_window).std()
+    features = get_feature_store()
+    ma = features.rolling_mean(df, 'Close', bollinger_window)
+    std = features.rolling_std(df, 'Close', bollinger_window)
 
-    df['Filter_Signal'] = 0  # Initialize with neutral
+    bb_upper = ma + num_std_dev * std
+    bb_lower = ma - num_std_dev * std
 
-    df.loc[df['Close'] > df['BB_Upper'], 'Filter_Signal'] = -1  # Sell signal when price is above upper band
-    df.loc[df['Close'] < df['BB_Lower'], 'Filter_Signal'] = 1   # Buy signal when price is below lower band
-    
-    return df
+    close = features.price(df, 'Close')
+    signal = np.zeros(len(df), dtype=np.int64)  # Initialize with neutral
+
+    signal[close > bb_upper] = -1  # Sell signal when price is above upper band
+    signal[close < bb_lower] = 1   # Buy signal when price is below lower band
+
+    return {'MA': ma, 'BB_Upper': bb_upper, 'BB_Lower': bb_lower, 'Filter_Signal': signal}
 
+
+@indicator('Filter_Signal')
 def generate_ATR_filter_signal(df, filter_atr_window, atr_upper_threshold, atr_lower_threshold):
-    # Calculate True Range (TR)
-    high_low = df['High'] - df['Low']
-    high_close = abs(df['High'] - df['Close'].shift(1))
-    low_close = abs(df['Low'] - df['Close'].shift(1))
-    
-    # Combine to get the True Range - take the maximum of the three possible values
-    df['Filter_TR'] = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    
-    # Calculate the ATR
-    df['Filter_ATR'] = df['Filter_TR'].rolling(window=filter_atr_window, min_periods=1).mean()
-    
-    # Initialize 'Filter_Signal' with neutral (0)
-    df['Filter_Signal'] = 0
+    # ATR over the True Range, taken from the feature store rather than written to intermediate columns
+    filter_atr = get_feature_store().rolling_mean(df, 'TR', filter_atr_window, min_periods=1)
+
+    # Initialize the signal with neutral (0)
+    signal = np.zeros(len(df), dtype=np.int64)
 
     # Generate a buy signal if ATR is above the threshold (high volatility) and sell if it's below (low volatility)
-    df.loc[df['Filter_ATR'] > atr_upper_threshold, 'Filter_Signal'] = 1  # Buy signal for high volatility
-    df.loc[df['Filter_ATR'] < atr_lower_threshold, 'Filter_Signal'] = -1  # Sell signal for low volatility
+    signal[filter_atr > atr_upper_threshold] = 1  # Buy signal for high volatility
+    signal[filter_atr < atr_lower_threshold] = -1  # Sell signal for low volatility
 
-    # Drop the intermediate 'TR' column
-    df.drop(columns=['Filter_TR'], inplace = True)
-    df.drop(columns=['Filter_ATR'], inplace = True)
+    return {'Filter_Signal': signal}
 
-    return df
+
+def test_sma_filter_equivalence():
+    from compact_bars import compact_bars
+    from replay_data_source import generate_synthetic_bars
+
+    # Both the bars as fetched and the compact bars the optimiser runs on
+    for df in (generate_synthetic_bars(2000), compact_bars(generate_synthetic_bars(2000))):
+        for sma_window in range(1, 16, 2):
+            for look_back_period in range(0, 6):
+                loop_df = generate_SMA_filter_signal_loop(df.copy(), sma_window, look_back_period)
+                array_df = generate_SMA_filter_signal(df.copy(), sma_window, look_back_period)
+                # The loop leaves its signal as int64, the values are compared exactly
+                pd.testing.assert_frame_equal(loop_df, array_df, check_dtype=False, check_exact=True, obj=f"SMA filter {sma_window}, {look_back_period}")
+    print("Vectorised SMA filter matches the loop version")
 
 
 def test_indicator():
@@ -86,4 +127,5 @@ def test_indicator():
 
 
 if __name__ == "__main__":
+    test_sma_filter_equivalence()
     test_indicator()
\ No newline at end of file
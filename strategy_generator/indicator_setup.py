@@ -1,51 +1,54 @@
 import numpy as np
+import pandas as pd
 from data_fetch import *
+from feature_store import get_feature_store
+from indicator_base import indicator
 
 
+@indicator('Setup_Signal')
 def noop_setup(df):
     """
     No-operation setup that assigns a constant value of 9 to the 'Setup_Signal' column.
     """
-    # Initialize the 'Filter_Signal' column with the value 9
-    df['Setup_Signal'] = 9
-    return df
+    # Initialize the 'Setup_Signal' column with the value 9
+    return {'Setup_Signal': np.full(len(df), 9, dtype=np.int64)}
 
 
+@indicator('Setup_Signal')
 def generate_RSI_setup_signal(df, period, overbought_condition, oversold_condition):
     
     # Step 1: Calculate Price Changes
-    df['Delta'] = df['Close'].diff()
+    delta = pd.Series(get_feature_store().diff(df, 'Close'), index=df.index)
 
     # Step 2: Calculate Gains and Losses
-    df['Gain'] = df['Delta'].where(df['Delta'] > 0, 0)
-    df['Loss'] = -df['Delta'].where(df['Delta'] < 0, 0)
+    gain = delta.where(delta > 0, 0)
+    loss = -delta.where(delta < 0, 0)
 
     # Step 3: Calculate the Average Gain and Loss
-    df['avg_gain'] = df['Gain'].rolling(window=period).mean()
-    df['avg_loss'] = df['Loss'].rolling(window=period).mean()
+    avg_gain = gain.rolling(window=period).mean()
+    avg_loss = loss.rolling(window=period).mean()
 
     # Step 4: Calculate the Relative Strength (RS)
-    df['rs'] = df['avg_gain'] / df['avg_loss']
+    rs = avg_gain / avg_loss
 
     # Step 5: Calculate the RSI
-    df['rsi'] = 100 - (100 / (1 + df['rs']))
+    rsi = 100 - (100 / (1 + rs))
 
     # Define the conditions for buy, sell, and hold signals
     conditions = [
-        (df['rsi'] > overbought_condition),   # Overbought - Sell Signal
-        (df['rsi'] < oversold_condition),   # Oversold - Buy Signal
-        ((df['rsi'] <= overbought_condition) & (df['rsi'] >= oversold_condition))  # Neutral - Hold Signal
+        (rsi > overbought_condition),   # Overbought - Sell Signal
+        (rsi < oversold_condition),   # Oversold - Buy Signal
+        ((rsi <= overbought_condition) & (rsi >= oversold_condition))  # Neutral - Hold Signal
     ]
 
     # Define corresponding signal values
     signals = [1, -1, 0]
 
-    # Create a new column 'signal' in the DataFrame
-    df['Setup_Signal'] = np.select(conditions, signals)
-
-    return df
+    return {'Delta': delta, 'Gain': gain, 'Loss': loss, 'avg_gain': avg_gain, 'avg_loss': avg_loss, 'rs': rs, 'rsi': rsi,
+            'Setup_Signal': np.select(conditions, signals)}
 
 
+@indicator('Setup_Signal')
 def generate_Stochastic_setup_signal(df, k_period, d_period, stochastic_overbought, stochastic_oversold):
     """
     Stochastic Oscillator setup that identifies overbought/oversold conditions.
@@ -58,20 +61,22 @@ def generate_Stochastic_setup_signal(df, k_period, d_period, stochastic_overboug
     
     Returns: DataFrame with the 'Setup_Signal' column added.
     """
-    df['L14'] = df['Low'].rolling(window=k_period).min()
-    df['H14'] = df['High'].rolling(window=k_period).max()
-    df['%K'] = 100 * ((df['Close'] - df['L14']) / (df['H14'] - df['L14']))
-    df['%D'] = df['%K'].rolling(window=d_period).mean()
+    features = get_feature_store()
+    l14 = features.rolling_min(df, 'Low', k_period)
+    h14 = features.rolling_max(df, 'High', k_period)
+    k = 100 * ((features.source(df, 'Close') - l14) / (h14 - l14))
+    d = k.rolling(window=d_period).mean()
 
-    df['Setup_Signal'] = 0  # Initialize with neutral
+    signal = np.zeros(len(df), dtype=np.int64)  # Initialize with neutral
 
-    df.loc[df['%D'] > stochastic_overbought, 'Setup_Signal'] = -1  # Sell signal
-    df.loc[df['%D'] < stochastic_oversold, 'Setup_Signal'] = 1    # Buy signal
-    
-    return df
+    signal[(d > stochastic_overbought).to_numpy()] = -1  # Sell signal
+    signal[(d < stochastic_oversold).to_numpy()] = 1    # Buy signal
+
+    return {'L14': l14, 'H14': h14, '%K': k, '%D': d, 'Setup_Signal': signal}
 
 
-def generate_ADX_setup_signal(df, adx_window, strong_trend_threshold):
+@indicator('Setup_Signal', exports=('ATR',))
+def generate_ADX_setup_signal(df, adx_window, strong_trend_threshold, *, materialise=False):
     """
     ADX (Average Directional Index) Setup Signal to identify strong uptrends.
     
@@ -79,35 +84,56 @@ def generate_ADX_setup_signal(df, adx_window, strong_trend_threshold):
     adx_window: Number of periods to calculate the ADX.
     strong_trend_threshold: The ADX value above which the trend is considered strong.
     
-    Returns: DataFrame with the original columns, 'Setup_Signal', and 'ADX'.
-    """
-    # Step 1: Calculate True Range (TR)
-    df['High-Low'] = df['High'] - df['Low']
-    df['High-Close'] = abs(df['High'] - df['Close'].shift(1))
-    df['Low-Close'] = abs(df['Low'] - df['Close'].shift(1))
+    materialise: Also calculate the True Range parts, which are only written out for plotting and debugging.
     
-    # True Range is the maximum of these
-    df['TR'] = df[['High-Low', 'High-Close', 'Low-Close']].max(axis=1)
+    Returns: DataFrame with the original columns, 'Setup_Signal', and 'ADX'. The 'ATR' column is replaced
+    by the ADX window's ATR, which the trades then use.
+    """
+    features = get_feature_store()
+    high = features.source(df, 'High')
+    low = features.source(df, 'Low')
+    close = features.source(df, 'Close')
+
+    # Step 1: Calculate True Range (TR), the maximum of High-Low, High-Close and Low-Close
+    tr = features.true_range(df)
     
     # Step 2: Calculate Directional Movement (+DM and -DM)
-    df['+DM'] = np.where((df['High'] - df['High'].shift(1)) > (df['Low'].shift(1) - df['Low']), 
-                         np.maximum((df['High'] - df['High'].shift(1)), 0), 0)
-    df['-DM'] = np.where((df['Low'].shift(1) - df['Low']) > (df['High'] - df['High'].shift(1)), 
-                         np.maximum((df['Low'].shift(1) - df['Low']), 0), 0)
+    up_move = high - high.shift(1)
+    down_move = low.shift(1) - low
+    plus_dm = pd.Series(np.where(up_move > down_move, np.maximum(up_move, 0), 0), index=df.index)
+    minus_dm = pd.Series(np.where(down_move > up_move, np.maximum(down_move, 0), 0), index=df.index)
     
     # Step 3: Smooth the True Range and Directional Movements
-    df['ATR'] = df['TR'].rolling(window=adx_window).mean()
-    df['+DI'] = (df['+DM'].rolling(window=adx_window).mean() / df['ATR']) * 100
-    df['-DI'] = (df['-DM'].rolling(window=adx_window).mean() / df['ATR']) * 100
+    atr = features.rolling_mean(df, 'TR', adx_window)
+    plus_di = (plus_dm.rolling(window=adx_window).mean() / atr) * 100
+    minus_di = (minus_dm.rolling(window=adx_window).mean() / atr) * 100
     
     # Step 4: Calculate the Directional Index (DX) and ADX
-    df['DX'] = (abs(df['+DI'] - df['-DI']) / (df['+DI'] + df['-DI'])) * 100
-    df['ADX'] = df['DX'].rolling(window=adx_window).mean()
+    dx = (abs(plus_di - minus_di) / (plus_di + minus_di)) * 100
+    adx = dx.rolling(window=adx_window).mean()
     
     # Step 5: Setup signal based on ADX and +DI > -DI (indicating a strong uptrend)
-    df['Setup_Signal'] = np.where((df['ADX'] > strong_trend_threshold) & (df['+DI'] > df['-DI']), 1, 0)  # Buy signal for strong uptrend
+    signal = np.where((adx > strong_trend_threshold) & (plus_di > minus_di), 1, 0)  # Buy signal for strong uptrend
     
-    return df
+    columns = {'TR': tr, '+DM': plus_dm, '-DM': minus_dm, 'ATR': atr, '+DI': plus_di, '-DI': minus_di, 'DX': dx, 'ADX': adx,
+               'Setup_Signal': signal}
+    if not materialise:
+        return columns
+
+    return {'High-Low': high - low, 'High-Close': abs(high - close.shift(1)), 'Low-Close': abs(low - close.shift(1)), **columns}
+
+
+def test_adx_signals():
+    from replay_data_source import generate_synthetic_bars
+
+    df = generate_synthetic_bars(2000)
+    signals = generate_ADX_setup_signal.signals(df, 14, 30)
+    adx_df = generate_ADX_setup_signal(df.copy(), 14, 30)
+    # The True Range parts are only calculated for the columns written into the frame
+    assert 'High-Low' in adx_df and 'High-Low' not in generate_ADX_setup_signal.__wrapped__(df, 14, 30)
+    for column in ('Setup_Signal', 'ATR'):
+        assert np.array_equal(signals[column], adx_df[column].to_numpy(), equal_nan=True), column
+    print("ADX signals match the materialised columns")
 
 
 def test_indicator():
@@ -121,4 +147,5 @@ def test_indicator():
 
 
 if __name__ == "__main__":
+    test_adx_signals()
     test_indicator()
\ No newline at end of file
@@ -1,45 +1,53 @@
+import time
 from globals import *
 import numpy as np
+import pandas as pd
 from data_fetch import *
+from feature_store import get_feature_store
+from indicator_base import indicator
+from numba_compat import njit, NUMBA_AVAILABLE
 
 
+@indicator('Trigger_Signal')
 def noop_trigger(df):
     """
     No-operation trigger that assigns a constant value of 9 to the 'Trigger_Signal' column.
     """
-    # Initialize the 'Filter_Signal' column with the value 9
-    df['Trigger_Signal'] = 9
-    return df
+    # Initialize the 'Trigger_Signal' column with the value 9
+    return {'Trigger_Signal': np.full(len(df), 9, dtype=np.int64)}
 
 
+@indicator('Trigger_Signal')
 def generate_MACD_trigger_signal(df, fast_period, slow_period, signal_period):
 
     # Step 1: Calculate the fast and slow EMAs
-    df['EMA_fast'] = df['Close'].ewm(span=fast_period, min_periods=fast_period, adjust=False).mean()
-    df['EMA_slow'] = df['Close'].ewm(span=slow_period, min_periods=slow_period, adjust=False).mean()
+    features = get_feature_store()
+    ema_fast = features.ema(df, 'Close', fast_period, min_periods=fast_period)
+    ema_slow = features.ema(df, 'Close', slow_period, min_periods=slow_period)
 
     # Step 2: Calculate the MACD line
-    df['MACD_line'] = df['EMA_fast'] - df['EMA_slow']
+    macd_line = pd.Series(ema_fast - ema_slow, index=df.index)
 
     # Step 3: Calculate the Signal line
-    df['Signal_line'] = df['MACD_line'].ewm(span=signal_period, adjust=False).mean()
+    signal_line = macd_line.ewm(span=signal_period, adjust=False).mean()
 
     # Step 4: Generate MACD signals
     # Positive MACD cross occurs when the MACD line crosses above the Signal line (buy signal)
     # Negative MACD cross occurs when the MACD line crosses below the Signal line (sell signal)
-    df['Trigger_Signal'] = np.where(df['MACD_line'] > df['Signal_line'], 1, 0)  # 1 for a positive cross, 0 otherwise
+    above = np.where(macd_line > signal_line, 1, 0)  # 1 for a positive cross, 0 otherwise
 
-    # Step 5: Detect actual cross
-    df['Trigger_Signal'] = df['Trigger_Signal'].diff()  # Difference to detect the crossing
+    # Step 5: Detect actual cross, the first bar has nothing to cross from
+    cross = np.diff(above, prepend=above[:1])
 
     # Step 6: Set the signal values
     # 1 for a positive cross (buy signal)
     # -1 for a negative cross (sell signal)
-    df['Trigger_Signal'] = df['Trigger_Signal'].apply(lambda x: 1 if x > 0 else (-1 if x < 0 else 0))
+    signal = np.sign(cross).astype(np.int64)
 
-    return df
+    return {'EMA_fast': ema_fast, 'EMA_slow': ema_slow, 'MACD_line': macd_line, 'Signal_line': signal_line, 'Trigger_Signal': signal}
 
 
+@indicator('Trigger_Signal')
 def generate_MA_crossover_trigger_signal(df, short_window, long_window):
     """
     Moving Average Crossover trigger that identifies potential buy/sell signals.
@@ -50,20 +58,26 @@ def generate_MA_crossover_trigger_signal(df, short_window, long_window):
     
     Returns: DataFrame with the 'Trigger_Signal' column added.
     """
-    df['MA_Short'] = df['Close'].rolling(window=short_window).mean()
-    df['MA_Long'] = df['Close'].rolling(window=long_window).mean()
+    features = get_feature_store()
+    ma_short = features.rolling_mean(df, 'Close', short_window)
+    ma_long = features.rolling_mean(df, 'Close', long_window)
+
+    signal = np.zeros(len(df), dtype=np.int64)  # Initialize with neutral
 
-    df['Trigger_Signal'] = 0  # Initialize with neutral
+    # Each bar compared with the bar before it, the first bar has no previous bar and never crosses
+    previous_short = ma_short[:-1]
+    previous_long = ma_long[:-1]
 
     # Buy signal when short-term MA crosses above long-term MA
-    df.loc[(df['MA_Short'] > df['MA_Long']) & (df['MA_Short'].shift(1) <= df['MA_Long'].shift(1)), 'Trigger_Signal'] = 1
+    signal[1:][(ma_short[1:] > ma_long[1:]) & (previous_short <= previous_long)] = 1
     
     # Sell signal when short-term MA crosses below long-term MA
-    df.loc[(df['MA_Short'] < df['MA_Long']) & (df['MA_Short'].shift(1) >= df['MA_Long'].shift(1)), 'Trigger_Signal'] = -1
+    signal[1:][(ma_short[1:] < ma_long[1:]) & (previous_short >= previous_long)] = -1
     
-    return df
+    return {'MA_Short': ma_short, 'MA_Long': ma_long, 'Trigger_Signal': signal}
 
 
+@indicator('Trigger_Signal')
 def generate_parabolic_sar_trigger_signal(df, initial_af=0.02, max_af=0.2, step_af=0.02):
     """
     Parabolic SAR trigger that identifies potential buy/sell signals.
@@ -73,6 +87,101 @@ def generate_parabolic_sar_trigger_signal(df, initial_af=0.02, max_af=0.2, step_
     max_af: The maximum acceleration factor (default: 0.2).
     step_af: The step increment for the acceleration factor (default: 0.02).
     
+    Returns: DataFrame with the 'SAR', 'EP', 'AF', 'Trend' and 'Trigger_Signal' columns added.
+    """
+    features = get_feature_store()
+    high = features.price(df, 'High')
+    low = features.price(df, 'Low')
+    close = features.price(df, 'Close')
+
+    if NUMBA_AVAILABLE and USE_NUMBA:
+        sar, ep, af, trend = parabolic_sar_kernel(high, low, close, float(initial_af), float(max_af), float(step_af))
+    else:
+        sar, ep, af, trend = parabolic_sar_recursion(high.tolist(), low.tolist(), close.tolist(), initial_af, max_af, step_af)
+
+    # Generate Parabolic SAR trigger signals
+    signal = np.where((close > sar) & (trend == 1), 1, 0)  # Buy signal when price crosses above SAR
+    signal = np.where((close < sar) & (trend == -1), -1, signal)  # Sell signal when price crosses below SAR
+
+    return {'SAR': sar, 'EP': ep, 'AF': af.astype(np.result_type(initial_af, max_af, step_af), copy=False), 'Trend': trend,
+            'Trigger_Signal': signal}
+
+
+def parabolic_sar_recursion(high, low, close, initial_af, max_af, step_af):
+    """
+    The Parabolic SAR recursion over bar arrays, written so the same source runs as a numba kernel over
+    arrays or as plain Python over lists. The first two bars keep the starting values.
+
+    Returns:
+        tuple: SAR, EP, AF and Trend arrays.
+    """
+    n = len(close)
+    sar = np.empty(n, dtype=np.float64)
+    ep = np.empty(n, dtype=np.float64)
+    af = np.empty(n, dtype=np.float64)
+    trend = np.empty(n, dtype=np.int64)
+
+    sar[:2] = close[0]  # Starting SAR
+    ep[:2] = high[0] if close[0] < close[1] else low[0]  # Extreme Price (EP)
+    af[:2] = initial_af  # Start with the initial acceleration factor (AF)
+    trend[:2] = 1 if close[1] > close[0] else -1  # Initial trend direction
+
+    prior_sar = sar[1]
+    prior_ep = ep[1]
+    prior_af = af[1]
+    prior_trend = trend[1]
+    for i in range(2, n):
+        new_sar = prior_sar + prior_af * (prior_ep - prior_sar)
+
+        # Comparisons written out to behave exactly like the built-in min() / max() the loop version used
+        if prior_trend == 1:  # Uptrend
+            if low[i - 1] < new_sar:
+                new_sar = low[i - 1]
+            if low[i] < new_sar:
+                new_sar = low[i]  # Ensure SAR stays below current lows
+            new_ep = high[i] if high[i] > prior_ep else prior_ep  # Update EP (highest high)
+            reversal = close[i] < new_sar
+            reversal_ep = low[i]
+        else:  # Downtrend
+            if high[i - 1] > new_sar:
+                new_sar = high[i - 1]
+            if high[i] > new_sar:
+                new_sar = high[i]  # Ensure SAR stays above current highs
+            new_ep = low[i] if low[i] < prior_ep else prior_ep  # Update EP (lowest low)
+            reversal = close[i] > new_sar
+            reversal_ep = high[i]
+
+        if reversal:  # Trend reversal
+            prior_sar = prior_ep  # Reset SAR to prior EP
+            prior_trend = -prior_trend  # Switch trend
+            prior_af = initial_af  # Reset AF
+            prior_ep = reversal_ep  # Set new EP
+        else:
+            prior_sar = new_sar
+            increased_af = prior_af + step_af
+            prior_af = max_af if max_af < increased_af else increased_af  # Increase AF up to max
+            prior_ep = new_ep
+
+        sar[i] = prior_sar
+        ep[i] = prior_ep
+        af[i] = prior_af
+        trend[i] = prior_trend
+
+    return sar, ep, af, trend
+
+
+parabolic_sar_kernel = njit(cache=True)(parabolic_sar_recursion)
+
+
+def generate_parabolic_sar_trigger_signal_loop(df, initial_af=0.02, max_af=0.2, step_af=0.02):
+    """
+    Original row by row Parabolic SAR, kept as the reference the array version is tested and benchmarked against.
+    
+    df: DataFrame containing the trading data.
+    initial_af: The initial acceleration factor (default: 0.02).
+    max_af: The maximum acceleration factor (default: 0.2).
+    step_af: The step increment for the acceleration factor (default: 0.02).
+    
     Returns: DataFrame with the 'Trigger_Signal' column added.
     """
     
@@ -131,7 +240,36 @@ def generate_parabolic_sar_trigger_signal(df, initial_af=0.02, max_af=0.2, step_
 def test_indicator():
     df = fetch_data("Training")
     print(generate_parabolic_sar_trigger_signal(df))
+
+
+def benchmark_parabolic_sar(n_bars=100_000):
+    from compact_bars import compact_bars
+    from replay_data_source import generate_synthetic_bars
+
+    df = generate_synthetic_bars(n_bars)
+    params = {'initial_af': 0.02, 'max_af': 0.2, 'step_af': 0.02}
+
+    start = time.perf_counter()
+    loop_df = generate_parabolic_sar_trigger_signal_loop(df.copy(), **params)
+    loop_seconds = time.perf_counter() - start
+
+    generate_parabolic_sar_trigger_signal(df.head(10).copy(), **params)  # Compile the kernel outside the timing
+    start = time.perf_counter()
+    array_df = generate_parabolic_sar_trigger_signal(df.copy(), **params)
+    array_seconds = time.perf_counter() - start
+
+    columns = ['SAR', 'EP', 'AF', 'Trend', 'Trigger_Signal']
+    # The loop leaves its signals as int64, the values are compared exactly
+    pd.testing.assert_frame_equal(loop_df[columns], array_df[columns], check_dtype=False, check_exact=True)
+
+    # The compact bars the optimiser runs on give the same output too
+    compact_df = compact_bars(df.head(2000))
+    pd.testing.assert_frame_equal(generate_parabolic_sar_trigger_signal_loop(compact_df.copy(), **params)[columns],
+                                  generate_parabolic_sar_trigger_signal(compact_df.copy(), **params)[columns],
+                                  check_dtype=False, check_exact=True)
+    print(f"Parabolic SAR on {n_bars} bars: loop {loop_seconds:.2f}s, array {array_seconds * 1000:.2f}ms, "
+          f"{loop_seconds / array_seconds:.0f}x faster, identical output")
     
 
 if __name__ == "__main__":
-    test_indicator()
\ No newline at end of file
+    benchmark_parabolic_sar()
\ No newline at end of file
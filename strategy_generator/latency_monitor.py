@@ -0,0 +1,173 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from globals import *
+import numpy as np
+from tabulate import tabulate
+
+
+# Latencies are measured from a bar's receipt in quote_data_handler to each of these points, in order
+LATENCY_STAGES = ['strategy_computed', 'decision', 'order_acked', 'bar_processed']
+
+# Histogram buckets grow by 2**(1/BUCKETS_PER_OCTAVE) from 1 microsecond, up to roughly 2**32 microseconds
+BUCKETS_PER_OCTAVE = 4
+NUMBER_OF_BUCKETS = 32 * BUCKETS_PER_OCTAVE
+SMALLEST_BUCKET_NS = 1_000
+
+
+class Latency_histogram:
+    """
+    Counts latencies in logarithmic buckets, so recording one costs the same however many have been recorded.
+    Percentiles are read back as the upper edge of their bucket, at most 19% above the exact latency.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(NUMBER_OF_BUCKETS + 1, dtype=np.int64)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, latency_ns):
+        if latency_ns < SMALLEST_BUCKET_NS:
+            bucket = 0
+        else:
+            bucket = min(int(math.log2(latency_ns / SMALLEST_BUCKET_NS) * BUCKETS_PER_OCTAVE) + 1, NUMBER_OF_BUCKETS)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_ns += latency_ns
+        self.max_ns = max(self.max_ns, latency_ns)
+
+    def percentile(self, q):
+        """
+        Upper edge of the bucket holding the q-th percentile latency in nanoseconds, capped at the largest latency.
+        """
+        if not self.count:
+            return 0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), math.ceil(q / 100 * self.count)))
+        upper_edge = SMALLEST_BUCKET_NS * 2 ** (bucket / BUCKETS_PER_OCTAVE)
+        return min(upper_edge, self.max_ns)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ns / self.count / 1e6 if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': self.max_ns / 1e6,
+            'bucket_counts': self.counts.tolist(),
+        }
+
+
+class Latency_monitor:
+    """
+    Latency of the live bot's per-bar path: from the websocket bar's receipt to the strategy being updated,
+    to the decision to trade, to the order being acknowledged by Alpaca and to the bar being fully processed.
+
+    Bars of different symbols can be processed at the same time, so each bar's receipt time is held in a
+    context variable, which the tasks and threads processing the bar inherit.
+    """
+
+    def __init__(self, log_interval=LATENCY_LOG_INTERVAL):
+        self.histograms = {stage: Latency_histogram() for stage in LATENCY_STAGES}
+        self.log_interval = log_interval
+        self.receipt_ns = contextvars.ContextVar('receipt_ns', default=None)
+        self.lock = threading.Lock()
+        self.bars = 0
+
+    def bar_received(self):
+        self.receipt_ns.set(time.perf_counter_ns())
+
+    def mark(self, stage):
+        # Only stages reached while a bar is being processed are measured
+        receipt_ns = self.receipt_ns.get()
+        if receipt_ns is not None:
+            with self.lock:
+                self.histograms[stage].add(time.perf_counter_ns() - receipt_ns)
+
+    def bar_processed(self):
+        self.mark('bar_processed')
+        self.receipt_ns.set(None)
+        self.bars += 1
+        if self.log_interval and self.bars % self.log_interval == 0:
+            logging.info(f"Latency after {self.bars} bars:\n{self.report()}")
+
+    def report(self):
+        table = []
+        for stage, histogram in self.histograms.items():
+            summary = histogram.to_dict()
+            table.append([stage, summary['count'], f"{summary['p50_ms']:.3f}", f"{summary['p99_ms']:.3f}", f"{summary['max_ms']:.3f}"])
+        return tabulate(table, headers=["Since bar receipt", "Count", "p50 ms", "p99 ms", "Max ms"], tablefmt="grid")
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'bars': self.bars, 'smallest_bucket_ns': SMALLEST_BUCKET_NS, 'buckets_per_octave': BUCKETS_PER_OCTAVE,
+                       'stages': {stage: histogram.to_dict() for stage, histogram in self.histograms.items()}}, f, indent=2)
+
+    def __str__(self) -> str:
+        return f"\nLatency over {self.bars} bars\n{self.report()}\n"
+
+
+latency_monitor = None
+
+
+def get_latency_monitor():
+    global latency_monitor
+    if latency_monitor is None:
+        latency_monitor = Latency_monitor()
+    return latency_monitor
+
+
+def start_bar_latency():
+    if MEASURE_LIVE_LATENCY:
+        get_latency_monitor().bar_received()
+
+
+def end_bar_latency():
+    if MEASURE_LIVE_LATENCY:
+        get_latency_monitor().bar_processed()
+
+
+def mark_latency(stage):
+    """
+    Records the time since the current bar was received at stage, when MEASURE_LIVE_LATENCY is set.
+    """
+    if MEASURE_LIVE_LATENCY:
+        get_latency_monitor().mark(stage)
+
+
+def dump_latency_report(name, directory=LATENCY_REPORT_DIRECTORY):
+    """
+    Prints the latency table and writes the histograms to directory as name_<time>.json.
+    """
+    if not MEASURE_LIVE_LATENCY:
+        return None
+
+    print(get_latency_monitor())
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    get_latency_monitor().export_json(path)
+    print(f"Latency histograms written to {path}")
+    return path
+
+
+def test_latency_histogram():
+    histogram = Latency_histogram()
+    latencies = np.random.default_rng(0).lognormal(np.log(2e6), 0.5, 10_000).astype(np.int64)
+    for latency in latencies.tolist():
+        histogram.add(latency)
+
+    for q in (50, 99):
+        exact = np.percentile(latencies, q)
+        assert exact <= histogram.percentile(q) <= exact * 2 ** (1 / BUCKETS_PER_OCTAVE) * 1.01, (q, exact, histogram.percentile(q))
+    assert histogram.max_ns == latencies.max()
+    print(f"p50 {histogram.percentile(50) / 1e6:.3f} ms (exact {np.percentile(latencies, 50) / 1e6:.3f}), "
+          f"p99 {histogram.percentile(99) / 1e6:.3f} ms (exact {np.percentile(latencies, 99) / 1e6:.3f})")
+
+
+if __name__ == "__main__":
+    test_latency_histogram()
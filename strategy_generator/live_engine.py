@@ -0,0 +1,215 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+from globals import *
+import pandas as pd
+from bar_store import Bar_store
+from streaming_indicators import Streaming_strategy
+from trading_session import Trading_session
+from latency_monitor import start_bar_latency, end_bar_latency, mark_latency
+
+
+class Symbol_state:
+    """
+    Everything the live bot keeps for one symbol: its incremental strategy, its latest bars, its open trade
+    and its trading session.
+    """
+
+    def __init__(self, symbol, strategy, starting_balance, spill_directory=None):
+        self.symbol = symbol
+        self.streaming_strategy = Streaming_strategy(**strategy)
+
+        # Only the latest bars are kept in memory, older ones are spilled to disk for the end of session plot
+        spill_path = None
+        if spill_directory is not None:
+            spill_path = os.path.join(spill_directory, f"{symbol.replace('/', '-')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.bin")
+        self.bar_store = Bar_store(max(self.streaming_strategy.lookback, LIVE_BAR_STORE_MIN_CAPACITY), symbol, spill_path)
+
+        self.trading_session = Trading_session(starting_balance)
+        self.trade = None
+        self.lock = asyncio.Lock()  # Keeps the symbol's bars trading in the order they arrived
+        self.bars = 0
+
+    def warm_up(self, df):
+        for row in self.streaming_strategy.warm_up(df):
+            self.bar_store.append(row)
+
+    def update(self, bar_data):
+        latest_row = self.streaming_strategy.update(bar_data)
+        self.bar_store.append(latest_row)
+        self.bars += 1
+        return latest_row
+
+    def __str__(self) -> str:
+        return f"{self.symbol}: {self.bars} bars, {len(self.trading_session.ledger)} trades, {'in a trade' if self.trade else 'no open trade'}"
+
+
+class Order_router:
+    """
+    Trades every symbol's latest bar through the one trading client. Each bar is traded in its own task, so
+    a symbol waiting on an order acknowledgement doesn't hold up the bars of the other symbols, with at
+    most max_in_flight symbols trading at once and each symbol's bars traded in order.
+
+    Args:
+        analyse (coroutine function): Called as analyse(trading_session, trade, latest_bar, symbol), returning
+            the new (trade, trading_session), e.g. alpaca_functions.analyse_latest_alpaca_bar.
+        run_in_background (function): Schedules the coroutine as a task, keeping a reference to it until done.
+    """
+
+    def __init__(self, analyse, run_in_background, max_in_flight=ORDER_ROUTER_MAX_IN_FLIGHT):
+        self.analyse = analyse
+        self.run_in_background = run_in_background
+        self.max_in_flight = max_in_flight
+        self.semaphore = None
+
+    def route(self, symbol_state, latest_row):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self.run_in_background(self.trade_bar(symbol_state, latest_row))
+
+    async def trade_bar(self, symbol_state, latest_row):
+        async with symbol_state.lock:
+            async with self.semaphore:
+                symbol_state.trade, symbol_state.trading_session = await self.analyse(
+                    symbol_state.trading_session, symbol_state.trade, latest_row, symbol_state.symbol)
+        end_bar_latency()
+
+
+class Live_engine:
+    """
+    Runs the one strategy over every symbol from one websocket subscription, keeping a Symbol_state per symbol
+    and sending every order through a shared Order_router.
+    """
+
+    def __init__(self, symbols, strategy, buying_power, order_router, spill_directory=None):
+        self.symbols = list(symbols)
+        self.order_router = order_router
+        # The buying power is shared equally between the symbols' trading sessions
+        self.states = {symbol: Symbol_state(symbol, strategy, buying_power / len(self.symbols), spill_directory)
+                       for symbol in self.symbols}
+
+    def lookback(self):
+        return max(max(state.streaming_strategy.lookback, LIVE_BAR_STORE_MIN_CAPACITY) for state in self.states.values())
+
+    def warm_up(self, df):
+        """
+        Feeds each symbol its historic bars from df, which holds the bars of every symbol as fetched in one request.
+        """
+        for symbol, symbol_df in df.groupby('Symbol', sort=False, observed=True):
+            if symbol in self.states:
+                self.states[symbol].warm_up(symbol_df.sort_values('Datetime'))
+
+    async def on_bar(self, bar):
+        """
+        Handler for the websocket's bars of every symbol.
+
+        Returns:
+            dict: The bar's strategy row, the bar is traded in the background by the order router.
+        """
+        start_bar_latency()
+        symbol_state = self.states.get(bar.symbol)
+        if symbol_state is None:
+            return None
+
+        bar_data = {
+            'Symbol': bar.symbol,
+            'Datetime': bar.timestamp,
+            'Open': bar.open,
+            'High': bar.high,
+            'Low': bar.low,
+            'Close': bar.close,
+            'Volume': bar.volume,
+            'Trade_Count': bar.trade_count,
+            'VWAP': bar.vwap
+        }
+
+        latest_row = symbol_state.update(bar_data)
+        mark_latency('strategy_computed')
+        self.order_router.route(symbol_state, latest_row)
+        return latest_row
+
+    def __str__(self) -> str:
+        return "\n".join(str(state) for state in self.states.values())
+
+
+def prepopulate_bars(fetch, symbols, count_back, interval=ALPACA_INTERVAL):
+    """
+    Fetches the latest count_back bars of every symbol in one request, stopping 15 bars short of now.
+
+    Args:
+        fetch (function): Called as fetch(period_start, period_end, interval, symbols), e.g. data_fetch.download_historic_alpaca_data.
+    """
+    period_end = datetime.now(timezone.utc) - (15 * pd.Timedelta(interval.value))
+    period_start = period_end - (count_back * pd.Timedelta(interval.value))
+    return fetch(period_start, period_end, interval, symbols)
+
+
+def test_live_engine(n_bars=600, symbols=('AAA', 'BBB', 'CCC')):
+    """
+    Interleaves the synthetic bars of several symbols through one engine, checking each symbol trades exactly
+    as a single symbol backtest with analyse_row does, while another symbol's orders are slow to acknowledge.
+    """
+    from types import SimpleNamespace
+    from back_tester import analyse_row
+    from combined_strategy import combined_strategy
+    from indicator_filter import noop_filter
+    from indicator_setup import generate_Stochastic_setup_signal
+    from indicator_trigger import noop_trigger
+    from replay_data_source import generate_synthetic_bars
+
+    strategy = {
+        'filter_func': noop_filter,
+        'setup_func': generate_Stochastic_setup_signal,
+        'trigger_func': noop_trigger,
+        'filter_params': {},
+        'setup_params': {'k_period': 6, 'd_period': 3, 'stochastic_overbought': 67, 'stochastic_oversold': 30},
+        'trigger_params': {},
+    }
+    bars = {symbol: generate_synthetic_bars(n_bars, symbol=symbol, seed=seed) for seed, symbol in enumerate(symbols)}
+
+    async def analyse(trading_session, trade, latest_bar, symbol):
+        # The first symbol's order acknowledgements are slow
+        if symbol == symbols[0]:
+            await asyncio.sleep(0.001)
+        return analyse_row(trading_session, trade, latest_bar)
+
+    async def run_test():
+        tasks = set()
+
+        def run_in_background(coroutine):
+            task = asyncio.create_task(coroutine)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            return task
+
+        engine = Live_engine(symbols, strategy, STARTING_BALANCE * len(symbols), Order_router(analyse, run_in_background, max_in_flight=2))
+        warm_up_bars = engine.lookback()
+        engine.warm_up(pd.concat([df.iloc[:warm_up_bars] for df in bars.values()]))
+
+        for index in range(warm_up_bars, n_bars):
+            for symbol, df in bars.items():
+                row = df.iloc[index]
+                await engine.on_bar(SimpleNamespace(symbol=symbol, timestamp=row['Datetime'], open=row['Open'], high=row['High'],
+                                                    low=row['Low'], close=row['Close'], volume=row['Volume'],
+                                                    trade_count=row['Trade_Count'], vwap=row['VWAP']))
+        await asyncio.gather(*tasks)
+        return engine
+
+    engine = asyncio.run(run_test())
+
+    for symbol, df in bars.items():
+        strategy_df = combined_strategy(df, **strategy)
+        trading_session, trade = Trading_session(STARTING_BALANCE), None
+        for row in strategy_df.iloc[engine.lookback():].to_dict('records'):
+            trade, trading_session = analyse_row(trading_session, trade, row)
+
+        expected = [(t.open_time, t.close_time, t.close_price_of_trade) for t in trading_session.trades]
+        traded = [(t.open_time, t.close_time, t.close_price_of_trade) for t in engine.states[symbol].trading_session.trades]
+        assert expected and traded == expected, (symbol, len(traded), len(expected))
+
+    print(engine)
+    print("Live engine test passed")
+
+
+if __name__ == "__main__":
+    test_live_engine()
@@ -0,0 +1,23 @@
+"""
+Optional numba support. Kernels decorated with njit are JIT-compiled when numba is installed
+and run as plain Python otherwise, so numba never becomes a hard dependency.
+"""
+from globals import *
+
+try:
+    from numba import njit as _numba_njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def njit(*args, **kwargs):
+    """
+    Drop-in for numba.njit which leaves the function as plain Python when numba is missing or USE_NUMBA is off.
+    """
+    if NUMBA_AVAILABLE and USE_NUMBA:
+        return _numba_njit(*args, **kwargs)
+
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda func: func
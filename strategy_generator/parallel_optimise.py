@@ -0,0 +1,254 @@
+import os
+import importlib
+import multiprocessing
+from datetime import datetime
+from multiprocessing import shared_memory
+from globals import *
+import numpy as np
+import pandas as pd
+import optuna
+from indicator_cache import print_indicator_cache_stats
+from feature_store import precompute_sweep_features, print_feature_store_stats
+from stage_profiler import print_stage_profile, export_stage_profile
+
+try:
+    from optuna.storages.journal import JournalFileBackend
+except ImportError:
+    from optuna.storages import JournalFileStorage as JournalFileBackend
+
+
+def create_shared_frame(df):
+    """
+    Copies the columns of an OHLCV DataFrame into one shared memory block so worker processes can read the
+    bars without the frame being pickled to them.
+
+    Every column keeps its dtype, e.g. the float32 prices of compact_bars, so the workers calculate exactly
+    what the serial study would. 'Symbol' is stored as its category codes.
+
+    Returns:
+        tuple: The SharedMemory block (close and unlink it once workers are done) and a small picklable
+            spec describing its layout, for attach_shared_frame.
+    """
+    datetimes = pd.DatetimeIndex(df['Datetime']).as_unit('ns')
+    arrays = {'Datetime': datetimes.asi8}
+    symbol_dtype = symbol_categories = None
+    if 'Symbol' in df.columns:
+        symbols = df['Symbol'].astype('category')
+        arrays['Symbol'] = symbols.cat.codes.to_numpy()
+        symbol_dtype, symbol_categories = df['Symbol'].dtype, symbols.dtype
+    for column in df.columns:
+        if column not in arrays:
+            arrays[column] = df[column].to_numpy()
+
+    # Each column starts on an 8 byte boundary, as (offset, dtype)
+    layout = {}
+    size = 0
+    for column, array in arrays.items():
+        layout[column] = (size, array.dtype.str)
+        size += -(-array.nbytes // 8) * 8
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for column, array in arrays.items():
+        offset, dtype = layout[column]
+        np.ndarray(array.shape, dtype=dtype, buffer=shm.buf, offset=offset)[:] = array
+
+    spec = {
+        'name': shm.name,
+        'length': len(df),
+        'columns': list(df.columns),
+        'layout': layout,
+        'tz': str(datetimes.tz) if datetimes.tz is not None else None,
+        'symbol_dtype': symbol_dtype,
+        'symbol_categories': symbol_categories,
+    }
+    return shm, spec
+
+
+def attach_shared_frame(spec):
+    """
+    Rebuilds the DataFrame written by create_shared_frame inside a worker process.
+
+    Returns:
+        tuple: The attached SharedMemory block (close it when done) and the DataFrame.
+    """
+    shm = shared_memory.SharedMemory(name=spec['name'])
+
+    n = spec['length']
+    columns = {}
+    for column, (offset, dtype) in spec['layout'].items():
+        columns[column] = np.ndarray((n,), dtype=dtype, buffer=shm.buf, offset=offset)
+
+    columns['Datetime'] = pd.to_datetime(columns['Datetime'], utc=spec['tz'] is not None)
+    if spec['tz'] is not None:
+        columns['Datetime'] = columns['Datetime'].tz_convert(spec['tz'])
+    if 'Symbol' in columns:
+        symbols = pd.Categorical.from_codes(columns['Symbol'], dtype=spec['symbol_categories'])
+        columns['Symbol'] = pd.Series(symbols).astype(spec['symbol_dtype'])
+
+    df = pd.DataFrame(columns)[spec['columns']]
+    return shm, df
+
+
+def get_journal_storage(journal_path):
+    return optuna.storages.JournalStorage(JournalFileBackend(journal_path))
+
+
+def create_sampler(seed):
+    # The same samplers optuna.create_study defaults to, seeded
+    if MULTI_OBJECTIVE:
+        return optuna.samplers.NSGAIISampler(seed=seed)
+    return optuna.samplers.TPESampler(seed=seed)
+
+
+def run_study_worker(objective_module_name, study_name, journal_path, frame_spec, n_trials, seed):
+    """
+    Worker process entry point: loads the shared study and runs n_trials of the objective module's objective().
+    """
+    objective_module = importlib.import_module(objective_module_name)
+    shm, df = attach_shared_frame(frame_spec)
+
+    # The objective functions read the training data from their module global
+    objective_module.df = df
+    if hasattr(objective_module, 'get_functions_info'):
+        precompute_sweep_features(df, objective_module.get_functions_info())
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=study_name,
+                              storage=get_journal_storage(journal_path),
+                              sampler=create_sampler(seed))
+    study.optimize(objective_module.objective, n_trials=n_trials)
+    print_indicator_cache_stats()
+    print_feature_store_stats()
+    print_stage_profile()
+    export_stage_profile(f"{study_name}_worker_{os.getpid()}")
+
+    del df, objective_module.df
+    shm.close()
+
+
+def run_parallel_study(objective_module_name, df, n_trials, number_of_workers=NUMBER_OF_WORKERS, seed=OPTIMISATION_SEED):
+    """
+    Spreads the trials of a study across worker processes sharing one journal file storage.
+
+    The training bars are put in shared memory once rather than pickled to each worker. Each worker's
+    sampler is seeded from seed and its worker number, so runs are repeatable up to the order in which
+    workers finish trials.
+
+    Args:
+        objective_module_name (str): Module holding objective() and its module-global df, e.g. 'ML_optimise_v3'.
+        df (pd.DataFrame): The training data.
+        n_trials (int): Total number of trials across all workers.
+        number_of_workers (int): Worker processes to start, 0 uses every core.
+        seed (int): Base seed for the worker samplers.
+
+    Returns:
+        optuna.Study: The completed study, backed by the journal file.
+
+    Raises:
+        RuntimeError: If any worker exited with an error, as the study would only hold part of the trials.
+            The trials that did finish are kept in the journal file.
+    """
+    number_of_workers = number_of_workers or os.cpu_count()
+
+    os.makedirs(OPTUNA_JOURNAL_DIRECTORY, exist_ok=True)
+    study_name = f"{objective_module_name}_{TICKER}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    journal_path = os.path.join(OPTUNA_JOURNAL_DIRECTORY, f"{study_name}.log")
+    storage = get_journal_storage(journal_path)
+
+    if MULTI_OBJECTIVE:
+        optuna.create_study(study_name=study_name, storage=storage, directions=['maximize', 'maximize'],
+                            pruner=optuna.pruners.MedianPruner())
+    else:
+        optuna.create_study(study_name=study_name, storage=storage, direction='maximize')
+
+    shm, frame_spec = create_shared_frame(df)
+    try:
+        workers = []
+        for worker_number in range(number_of_workers):
+            worker_trials = n_trials // number_of_workers + (1 if worker_number < n_trials % number_of_workers else 0)
+            if worker_trials == 0:
+                continue
+            worker = multiprocessing.Process(
+                target=run_study_worker,
+                args=(objective_module_name, study_name, journal_path, frame_spec, worker_trials, seed + worker_number))
+            worker.start()
+            workers.append(worker)
+
+        print(f"Running {n_trials} trials across {len(workers)} worker processes, journal: {journal_path}")
+        for worker in workers:
+            worker.join()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    study = optuna.load_study(study_name=study_name, storage=storage)
+    finished_trials = len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)))
+    print(f"{finished_trials} of {n_trials} trials finished")
+
+    failed_workers = [worker for worker in workers if worker.exitcode != 0]
+    if failed_workers:
+        exit_codes = ', '.join(f"{worker.pid}: {worker.exitcode}" for worker in failed_workers)
+        raise RuntimeError(f"{len(failed_workers)} of {len(workers)} workers failed (pid: exit code {exit_codes}), "
+                           f"only {finished_trials} of {n_trials} trials finished, journal: {journal_path}")
+
+    return study
+
+
+def score_shared_frame(frame_spec, candidates):
+    # Scores the candidates on the shared bars inside a worker process, for test_shared_frame
+    from batch_back_tester import batch_backtest
+
+    shm, df = attach_shared_frame(frame_spec)
+    try:
+        return batch_backtest(df, candidates)
+    finally:
+        del df
+        shm.close()
+
+
+def test_shared_frame(n_bars=3000):
+    """
+    Checks a worker process reads the compact float32 bars exactly as they were shared, and scores strategies
+    exactly as the serial study does on them.
+    """
+    from compact_bars import compact_bars
+    from feature_store import Feature_store
+    from replay_data_source import generate_synthetic_bars
+    from indicator_filter import noop_filter, generate_SMA_filter_signal, generate_BollingerBands_filter_signal
+    from indicator_setup import generate_RSI_setup_signal, generate_Stochastic_setup_signal
+    from indicator_trigger import noop_trigger, generate_MACD_trigger_signal, generate_parabolic_sar_trigger_signal
+    from batch_back_tester import batch_backtest
+
+    df = compact_bars(generate_synthetic_bars(n_bars), float32_prices=True)
+    candidates = [
+        {'filter_func': generate_SMA_filter_signal, 'filter_params': {'sma_window': 20, 'look_back_period': 3},
+         'setup_func': generate_RSI_setup_signal, 'setup_params': {'period': 14, 'overbought_condition': 60, 'oversold_condition': 40},
+         'trigger_func': generate_MACD_trigger_signal, 'trigger_params': {'fast_period': 12, 'slow_period': 26, 'signal_period': 9}},
+        {'filter_func': generate_BollingerBands_filter_signal, 'filter_params': {'bollinger_window': 20, 'num_std_dev': 1.5},
+         'setup_func': generate_Stochastic_setup_signal, 'setup_params': {'k_period': 14, 'd_period': 3, 'stochastic_overbought': 70, 'stochastic_oversold': 30},
+         'trigger_func': generate_parabolic_sar_trigger_signal, 'trigger_params': {}},
+        {'filter_func': noop_filter, 'setup_func': generate_Stochastic_setup_signal, 'trigger_func': noop_trigger,
+         'setup_params': {'k_period': 6, 'd_period': 3, 'stochastic_overbought': 67, 'stochastic_oversold': 30}},
+    ]
+
+    shm, frame_spec = create_shared_frame(df)
+    try:
+        attached_shm, shared_df = attach_shared_frame(frame_spec)
+        pd.testing.assert_frame_equal(shared_df, df, check_exact=True)
+        assert np.array_equal(Feature_store().price(shared_df, 'Close'), Feature_store().price(df, 'Close'))
+        del shared_df
+        attached_shm.close()
+
+        with multiprocessing.Pool(1) as pool:
+            parallel_objectives = pool.apply(score_shared_frame, (frame_spec, candidates))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    serial_objectives = batch_backtest(df, candidates)
+    assert np.array_equal(parallel_objectives, serial_objectives, equal_nan=True), (parallel_objectives, serial_objectives)
+    print(f"Worker objectives match the serial study on compact float32 bars: {serial_objectives.tolist()}")
+
+
+if __name__ == "__main__":
+    test_shared_frame()
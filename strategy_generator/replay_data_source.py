@@ -0,0 +1,175 @@
+import os
+import json
+from globals import *
+import numpy as np
+import pandas as pd
+
+
+BAR_COLUMNS = ['Symbol', 'Datetime', 'Open', 'High', 'Low', 'Close', 'Volume', 'Trade_Count', 'VWAP']
+NUMERIC_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Trade_Count', 'VWAP']
+
+
+def get_replay_directory(symbol, interval, directory=REPLAY_DATA_DIRECTORY):
+    return os.path.join(directory, symbol.replace('/', '-'), interval)
+
+
+def write_replay_bars(df, symbol, interval, directory=REPLAY_DATA_DIRECTORY):
+    """
+    Writes bars with the Alpaca column schema as one .npy file per column, replacing any existing dataset.
+    The Datetime column is stored as int64 nanoseconds since the epoch in UTC.
+    """
+    path = get_replay_directory(symbol, interval, directory)
+    os.makedirs(path, exist_ok=True)
+
+    df = df.sort_values('Datetime')
+    datetimes = pd.DatetimeIndex(df['Datetime'])
+    datetimes = datetimes.tz_localize('UTC') if datetimes.tz is None else datetimes.tz_convert('UTC')
+    np.save(os.path.join(path, 'Datetime.npy'), datetimes.as_unit('ns').asi8)
+    for column in NUMERIC_COLUMNS:
+        np.save(os.path.join(path, f'{column}.npy'), df[column].to_numpy(dtype=np.float64))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'symbol': symbol, 'interval': interval, 'length': len(df)}, f)
+
+
+def read_replay_bars(symbol, interval, period_start=None, period_end=None, directory=REPLAY_DATA_DIRECTORY):
+    """
+    Reads the bars between two times (both inclusive, naive times taken as UTC) from a replay dataset.
+
+    The column files are memory-mapped and the period is found with a binary search on Datetime,
+    so only the pages holding the requested bars are read from disk.
+
+    Returns:
+        pd.DataFrame: Bars with the same columns and types as fetch_historic_alpaca_data.
+    """
+    path = get_replay_directory(symbol, interval, directory)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        raise FileNotFoundError(f"No replay data for {symbol} {interval} in {directory}, "
+                                f"create it with record_replay_bars or write_synthetic_replay_bars")
+
+    datetimes = np.load(os.path.join(path, 'Datetime.npy'), mmap_mode='r')
+    start = 0 if period_start is None else np.searchsorted(datetimes, to_utc_nanoseconds(period_start), side='left')
+    end = len(datetimes) if period_end is None else np.searchsorted(datetimes, to_utc_nanoseconds(period_end), side='right')
+
+    columns = {
+        'Symbol': symbol,
+        'Datetime': pd.to_datetime(np.array(datetimes[start:end]), utc=True),
+    }
+    for column in NUMERIC_COLUMNS:
+        columns[column] = np.array(np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')[start:end])
+
+    return pd.DataFrame(columns, columns=BAR_COLUMNS)
+
+
+def to_utc_nanoseconds(time):
+    time = pd.Timestamp(time)
+    time = time.tz_localize('UTC') if time.tz is None else time.tz_convert('UTC')
+    return time.value
+
+
+def fetch_historic_replay_data(period_start, period_end, interval):
+    """
+    Drop-in for fetch_historic_alpaca_data which reads the bars from the local replay dataset instead.
+    """
+    symbol = CRYPTO_TICKER if CRYPTO else TICKER
+    return read_replay_bars(symbol, interval.value, period_start, period_end)
+
+
+def record_replay_bars(period_start, period_end, interval=ALPACA_INTERVAL):
+    """
+    Downloads real bars from Alpaca and stores them as the replay dataset for the configured ticker.
+    """
+    from data_fetch import fetch_historic_alpaca_data
+
+    symbol = CRYPTO_TICKER if CRYPTO else TICKER
+    df = fetch_historic_alpaca_data(period_start, period_end, interval)
+    write_replay_bars(df, symbol, interval.value)
+    return df
+
+
+def generate_synthetic_bar_chunks(n_bars, start, bar_interval, start_price=100.0, volatility=0.002, seed=0, chunk_size=1_000_000):
+    """
+    Yields random-walk bars in chunks, as dicts of column arrays with Datetime as int64 UTC nanoseconds.
+
+    Closes follow a geometric random walk rounded to cents, each bar opens at the previous close,
+    and highs / lows extend a random amount beyond the open and close.
+    """
+    rng = np.random.default_rng(seed)
+    start_ns = to_utc_nanoseconds(start)
+    step_ns = pd.Timedelta(bar_interval).value
+    previous_close = start_price
+
+    for chunk_start in range(0, n_bars, chunk_size):
+        n = min(chunk_size, n_bars - chunk_start)
+
+        log_returns = rng.normal(0.0, volatility, n)
+        close = np.round(previous_close * np.exp(np.cumsum(log_returns)), 2)
+        open_price = np.round(np.concatenate([[previous_close], close[:-1]]), 2)
+        wick = np.abs(rng.normal(0.0, volatility, (2, n))) * close
+        high = np.round(np.maximum(open_price, close) + wick[0], 2)
+        low = np.round(np.maximum(np.minimum(open_price, close) - wick[1], 0.01), 2)
+        volume = rng.integers(100, 10_000, n).astype(np.float64)
+        previous_close = close[-1]
+
+        yield {
+            'Datetime': start_ns + step_ns * np.arange(chunk_start, chunk_start + n, dtype=np.int64),
+            'Open': open_price,
+            'High': high,
+            'Low': low,
+            'Close': close,
+            'Volume': volume,
+            'Trade_Count': np.maximum(volume // 50, 1),
+            'VWAP': np.round((high + low + close) / 3, 2),
+        }
+
+
+def generate_synthetic_bars(n_bars, symbol=TICKER, start=TRAINING_PERIOD_START, bar_interval='5min', start_price=100.0, volatility=0.002, seed=0):
+    """
+    Generates n_bars of synthetic bars in memory with the same column schema as fetch_historic_alpaca_data.
+    """
+    chunks = list(generate_synthetic_bar_chunks(n_bars, start, bar_interval, start_price, volatility, seed))
+    columns = {'Symbol': symbol}
+    for column in ['Datetime'] + NUMERIC_COLUMNS:
+        columns[column] = np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.array([])
+    columns['Datetime'] = pd.to_datetime(columns['Datetime'].astype(np.int64), utc=True)
+    return pd.DataFrame(columns, columns=BAR_COLUMNS)
+
+
+def write_synthetic_replay_bars(n_bars, symbol, interval, start=TRAINING_PERIOD_START, start_price=100.0, volatility=0.002, seed=0, directory=REPLAY_DATA_DIRECTORY):
+    """
+    Writes a synthetic replay dataset chunk by chunk straight into memory-mapped column files,
+    so datasets far larger than memory can be produced for benchmarks.
+    """
+    path = get_replay_directory(symbol, interval, directory)
+    os.makedirs(path, exist_ok=True)
+
+    files = {
+        column: np.lib.format.open_memmap(os.path.join(path, f'{column}.npy'), mode='w+',
+                                          dtype=np.int64 if column == 'Datetime' else np.float64, shape=(n_bars,))
+        for column in ['Datetime'] + NUMERIC_COLUMNS
+    }
+
+    position = 0
+    for chunk in generate_synthetic_bar_chunks(n_bars, start, interval, start_price, volatility, seed):
+        n = len(chunk['Datetime'])
+        for column, values in chunk.items():
+            files[column][position:position + n] = values
+        position += n
+
+    for memmap in files.values():
+        memmap.flush()
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'symbol': symbol, 'interval': interval, 'length': n_bars, 'synthetic': True}, f)
+
+
+if __name__ == "__main__":
+    from data_fetch import DATA_WINDOWS
+
+    # Create a synthetic dataset covering every data window for the configured ticker and interval
+    symbol = CRYPTO_TICKER if CRYPTO else TICKER
+    period_start = min(pd.Timestamp(start) for start, _ in DATA_WINDOWS.values())
+    period_end = max(pd.Timestamp(end) for _, end in DATA_WINDOWS.values()) + pd.Timedelta(days=1)
+    bar_interval = pd.Timedelta(ALPACA_INTERVAL.value)
+    write_synthetic_replay_bars(int((period_end - period_start) / bar_interval), symbol, ALPACA_INTERVAL.value, start=period_start)
+    print(read_replay_bars(symbol, ALPACA_INTERVAL.value, TRAINING_PERIOD_START, TRAINING_PERIOD_END))
@@ -0,0 +1,162 @@
+import os
+import sys
+import csv
+import json
+import time
+import functools
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from globals import *
+from tabulate import tabulate
+
+
+class Stage_profiler:
+    """
+    Records the wall time and allocations of each stage of an optimisation run, per trial.
+
+    Stages nest, so a stage is recorded under the path of the stages it runs inside, e.g.
+    'trial/combined_strategy/indicator:generate_MACD_trigger_signal'. Allocations are the change in
+    sys.getallocatedblocks() over the stage, i.e. the blocks it allocated and has not yet freed.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.trial = None
+        self.records = []  # One (trial, stage path, seconds, allocated blocks) per stage run, a batch's trial is its range of trial numbers
+
+    @contextmanager
+    def stage(self, name):
+        self.stack.append(name)
+        path = '/'.join(self.stack)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.records.append((self.trial, path, seconds, sys.getallocatedblocks() - blocks))
+            self.stack.pop()
+
+    @contextmanager
+    def trial_stage(self, trial_number):
+        self.trial = trial_number
+        try:
+            with self.stage('trial'):
+                yield
+        finally:
+            self.trial = None
+
+    def summary(self):
+        """
+        Aggregates the records by stage path.
+
+        Returns:
+            list: Dicts of stage, calls, total_seconds, mean_seconds and mean_allocated_blocks, in stage path order.
+        """
+        stages = {}
+        for _, path, seconds, blocks in self.records:
+            calls, total_seconds, total_blocks = stages.get(path, (0, 0.0, 0))
+            stages[path] = (calls + 1, total_seconds + seconds, total_blocks + blocks)
+
+        return [{'stage': path, 'calls': calls, 'total_seconds': total_seconds, 'mean_seconds': total_seconds / calls,
+                 'mean_allocated_blocks': total_blocks / calls}
+                for path, (calls, total_seconds, total_blocks) in sorted(stages.items())]
+
+    def report(self):
+        """
+        Table of every stage's calls, total and mean time, share of the trials' time and mean allocations,
+        sorted by stage path so each stage follows the stage it runs in.
+        """
+        summary = self.summary()
+        trial_seconds = sum(row['total_seconds'] for row in summary if row['stage'] == 'trial')
+        table = []
+        for row in summary:
+            share = f"{row['total_seconds'] * 100 / trial_seconds:.1f}%" if trial_seconds and row['stage'].startswith('trial') else "N/A"
+            table.append([row['stage'], row['calls'], f"{row['total_seconds']:.3f}",
+                          f"{row['mean_seconds'] * 1000:.3f}", share, f"{row['mean_allocated_blocks']:.0f}"])
+
+        return tabulate(table, headers=["Stage", "Calls", "Total s", "Mean ms", "% of trials", "Mean blocks"], tablefmt="grid")
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'stages': self.summary(),
+                'trials': [{'trial': trial, 'stage': stage, 'seconds': seconds, 'allocated_blocks': blocks}
+                           for trial, stage, seconds, blocks in self.records],
+            }, f, indent=2)
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['trial', 'stage', 'seconds', 'allocated_blocks'])
+            writer.writerows(self.records)
+
+    def __str__(self) -> str:
+        return f"\nStage profile ({len(self.records)} stage runs)\n{self.report()}\n"
+
+
+stage_profiler = None
+
+
+def get_stage_profiler():
+    global stage_profiler
+    if stage_profiler is None:
+        stage_profiler = Stage_profiler()
+    return stage_profiler
+
+
+def profile_stage(name):
+    """
+    Context manager recording the stage when PROFILE_STAGES is set, otherwise doing nothing.
+    """
+    if PROFILE_STAGES:
+        return get_stage_profiler().stage(name)
+    return nullcontext()
+
+
+def profile_trials(trial_numbers):
+    """
+    Context manager recording a batch of trials scored together, e.g. by batch_backtest, as one trial labelled
+    with the range of its trial numbers, when PROFILE_STAGES is set.
+    """
+    if not PROFILE_STAGES:
+        return nullcontext()
+    label = trial_numbers[0] if len(trial_numbers) == 1 else f"{trial_numbers[0]}-{trial_numbers[-1]}"
+    return get_stage_profiler().trial_stage(label)
+
+
+def profiled_objective(objective):
+    """
+    Decorator for Optuna objective functions, recording each call as a trial when PROFILE_STAGES is set.
+    """
+    @functools.wraps(objective)
+    def wrapper(trial):
+        if not PROFILE_STAGES:
+            return objective(trial)
+        with get_stage_profiler().trial_stage(trial.number):
+            return objective(trial)
+
+    return wrapper
+
+
+def print_stage_profile():
+    if PROFILE_STAGES:
+        print(get_stage_profiler())
+
+
+def export_stage_profile(name, directory=PROFILE_DIRECTORY):
+    """
+    Writes the stage profile as name_<time>.json, with the per-stage summary and every record, and as a CSV of the records.
+
+    Returns:
+        list: Paths of the files written, none when PROFILE_STAGES is not set.
+    """
+    if not PROFILE_STAGES:
+        return []
+
+    os.makedirs(directory, exist_ok=True)
+    base_path = os.path.join(directory, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    get_stage_profiler().export_json(f"{base_path}.json")
+    get_stage_profiler().export_csv(f"{base_path}.csv")
+    print(f"Stage profile written to {base_path}.json / .csv")
+    return [f"{base_path}.json", f"{base_path}.csv"]
@@ -0,0 +1,247 @@
+import json
+import asyncio
+import threading
+import uuid
+from datetime import datetime, timezone
+from globals import *
+from alpaca.trading.enums import OrderStatus
+from alpaca.trading.stream import TradingStream
+
+
+# Orders that will not fill any further
+FINAL_ORDER_STATUSES = {OrderStatus.FILLED, OrderStatus.CANCELED, OrderStatus.EXPIRED, OrderStatus.REJECTED,
+                        OrderStatus.DONE_FOR_DAY, OrderStatus.STOPPED, OrderStatus.SUSPENDED}
+
+
+def order_is_final(order):
+    return bool(order.filled_avg_price and order.status == OrderStatus.FILLED) or order.status in FINAL_ORDER_STATUSES
+
+
+def symbol_key(symbol):
+    # Positions name crypto pairs without the slash orders use, e.g. ETHUSD for ETH/USD
+    return symbol.replace('/', '')
+
+
+class Order_state_cache:
+    """
+    The account's orders and positions as reported by the Alpaca trade updates stream, so the live bot can
+    answer questions like "is the position still open?" without a REST round trip.
+
+    The stream runs on its own thread, so the state is guarded by a lock, and coroutines waiting on an order
+    are woken on their own event loop.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = {}      # Order id to latest Order
+        self.positions = {}   # Symbol to (quantity, asset id)
+        self.last_fills = {}  # (symbol, side) to the latest filled Order
+        self.waiters = {}     # Order id to [(event loop, future)]
+        self.seeded = False
+        self.updates = 0
+
+    def seed_positions(self, positions):
+        """
+        Sets the positions open before the stream started, e.g. from TradingClient.get_all_positions().
+        """
+        with self.lock:
+            for position in positions:
+                self.positions[symbol_key(position.symbol)] = (float(position.qty), position.asset_id)
+            self.seeded = True
+
+    async def on_trade_update(self, update):
+        """
+        Handler for TradingStream.subscribe_trade_updates.
+        """
+        order = update.order
+        order_id = str(order.id)
+        with self.lock:
+            self.updates += 1
+            self.orders[order_id] = order
+            if update.position_qty is not None:
+                self.positions[symbol_key(order.symbol)] = (float(update.position_qty), order.asset_id)
+            if order.filled_avg_price and order.status == OrderStatus.FILLED:
+                self.last_fills[(symbol_key(order.symbol), order.side)] = order
+
+            waiters = self.waiters.pop(order_id, []) if order_is_final(order) else []
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(resolve_future, future, order)
+
+    def order(self, order_id):
+        with self.lock:
+            return self.orders.get(str(order_id))
+
+    def position(self, symbol):
+        """
+        Returns:
+            tuple: The (quantity, asset id) of the position in symbol, (0.0, None) when there is none, or None
+                if the positions have not been seeded yet.
+        """
+        with self.lock:
+            if not self.seeded:
+                return None
+            return self.positions.get(symbol_key(symbol), (0.0, None))
+
+    def last_fill(self, symbol, side):
+        with self.lock:
+            return self.last_fills.get((symbol_key(symbol), side))
+
+    async def wait_for_order(self, order_id, timeout):
+        """
+        Waits for the order to fill or reach another final status.
+
+        Returns:
+            Order: The order once final, otherwise its latest state after timeout seconds, or None if the
+                stream has not reported it.
+        """
+        order_id = str(order_id)
+        future = asyncio.get_running_loop().create_future()
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is not None and order_is_final(order):
+                return order
+            self.waiters.setdefault(order_id, []).append((asyncio.get_running_loop(), future))
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                waiters = self.waiters.get(order_id, [])
+                if (asyncio.get_running_loop(), future) in waiters:
+                    waiters.remove((asyncio.get_running_loop(), future))
+                return self.orders.get(order_id)
+
+    def __str__(self) -> str:
+        return f"Order state cache: {self.updates} trade updates, {len(self.orders)} orders, {len(self.positions)} positions"
+
+
+def resolve_future(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+order_state = None
+
+
+def get_order_state():
+    global order_state
+    if order_state is None:
+        order_state = Order_state_cache()
+    return order_state
+
+
+def start_trade_updates_stream(api_key, secret_key, cache, url=TRADE_UPDATES_URL, paper=True):
+    """
+    Subscribes cache to the trade updates stream, run on a daemon thread with its own event loop.
+
+    Args:
+        url (str): Overrides Alpaca's stream endpoint, e.g. with a Mock_trade_updates_server's url.
+
+    Returns:
+        TradingStream: The running stream, stop it with stream.stop().
+    """
+    stream = TradingStream(api_key, secret_key, paper=paper, url_override=url)
+    stream.subscribe_trade_updates(cache.on_trade_update)
+    threading.Thread(target=stream.run, name='trade-updates', daemon=True).start()
+    return stream
+
+
+class Mock_trade_updates_server:
+    """
+    Local stand-in for Alpaca's trade updates websocket: accepts any credentials, then sends whatever trade
+    updates are published to every listening client.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.clients = set()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        import websockets
+
+        self.server = await websockets.serve(self.handle, self.host, self.port)
+        self.port = next(iter(self.server.sockets)).getsockname()[1]
+        return self
+
+    async def handle(self, websocket):
+        await websocket.recv()  # Authenticate
+        await websocket.send(json.dumps({'stream': 'authorization', 'data': {'action': 'authenticate', 'status': 'authorized'}}))
+        await websocket.recv()  # Listen
+        await websocket.send(json.dumps({'stream': 'listening', 'data': {'streams': ['trade_updates']}}))
+        self.clients.add(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            self.clients.discard(websocket)
+
+    async def publish(self, event, order, position_qty=None):
+        message = json.dumps({'stream': 'trade_updates', 'data': {
+            'event': event, 'order': order, 'timestamp': order['updated_at'], 'position_qty': position_qty,
+            'price': order.get('filled_avg_price'), 'qty': order.get('filled_qty')}})
+        for websocket in list(self.clients):
+            await websocket.send(message)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def mock_order(symbol, side, status, filled_avg_price=None, order_id=None, order_type='market', qty=QUANTITY):
+    """
+    An order as the trade updates stream sends it, with the fields alpaca-py requires.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        'id': order_id or str(uuid.uuid4()), 'client_order_id': str(uuid.uuid4()), 'created_at': now, 'updated_at': now,
+        'submitted_at': now, 'filled_at': now if filled_avg_price else None, 'asset_id': str(uuid.uuid5(uuid.NAMESPACE_DNS, symbol)),
+        'symbol': symbol, 'qty': str(qty), 'filled_qty': str(qty) if filled_avg_price else '0', 'side': side,
+        'type': order_type, 'order_class': 'simple', 'time_in_force': 'day', 'status': status,
+        'filled_avg_price': str(filled_avg_price) if filled_avg_price else None, 'extended_hours': False,
+    }
+
+
+def test_trade_updates_stream():
+
+    async def run_test():
+        server = await Mock_trade_updates_server().start()
+        cache = Order_state_cache()
+        cache.seed_positions([])
+        stream = start_trade_updates_stream('key', 'secret', cache, url=server.url)
+
+        while not server.clients:
+            await asyncio.sleep(0.05)
+
+        buy = mock_order('MA', 'buy', 'new')
+        await server.publish('new', buy)
+        waiter = asyncio.create_task(cache.wait_for_order(buy['id'], timeout=5))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+
+        await server.publish('fill', {**mock_order('MA', 'buy', 'filled', 450.12, order_id=buy['id'])}, position_qty='1')
+        filled = await waiter
+        assert float(filled.filled_avg_price) == 450.12
+        assert cache.position('MA')[0] == 1.0
+
+        # A bracket leg firing closes the position without the bot sending an order
+        await server.publish('fill', mock_order('MA', 'sell', 'filled', 455.5, order_type='limit'), position_qty='0')
+        while cache.position('MA')[0] != 0.0:
+            await asyncio.sleep(0.05)
+        assert float(cache.last_fill('MA', 'sell').filled_avg_price) == 455.5
+
+        stream.stop()
+        await server.stop()
+        print(cache)
+
+    asyncio.run(run_test())
+    print("Trade updates stream test passed")
+
+
+if __name__ == "__main__":
+    test_trade_updates_stream()
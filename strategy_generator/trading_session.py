@@ -2,9 +2,15 @@ from globals import *
 from datetime import datetime
 from tabulate import tabulate
 import numpy as np
+import pandas as pd
+
+
+NANOSECONDS_PER_SECOND = 10**9
+NANOSECONDS_PER_DAY = 86_400 * NANOSECONDS_PER_SECOND
+
 
 class Trading_session:
-    def __init__(self, 
+    def __init__(self,
                  starting_balance: float,
                  session_open_datetime: datetime = None,
                  session_close_datetime: datetime = None,
@@ -12,130 +18,174 @@ class Trading_session:
         self.starting_balance = starting_balance
         self.current_balance = starting_balance
         self.session_open_datetime = session_open_datetime
-        self.trades= []
+        self.ledger = Trade_ledger()
         self.average_duration_of_trade = ""
         self.session_closing_datetime = session_close_datetime
         self.percentage_change_of_strategy = 0.0
         self.number_of_winning_trades = 0
         self.normalized_profit = 0.0
         self.sharpe_ratio = 0.0
+        self.sortino_ratio = 0.0
+        self.max_drawdown = 0.0
+        self.profit_factor = 0.0
+        self.exposure = 0.0
+
+
+    @property
+    def trades(self):
+        # Trade objects are only built when something wants to display or plot them
+        return self.ledger.to_trades()
 
 
     def add_trade(self, trade):
-        self.trades.append(trade)
+        self.ledger.append(trade)
         self.update_balance(trade)
 
 
+    def add_trades(self, open_times, close_times, open_prices, close_prices, open_ATRs, stop_loss_prices, take_profit_prices,
+                   close_reason_codes, close_reason_names, quantity=QUANTITY, tz=None):
+        """
+        Adds many completed trades at once straight into the ledger, without creating Trade objects.
+
+        Args:
+            open_times, close_times (np.ndarray): int64 nanoseconds since the epoch in UTC.
+            open_prices, close_prices, open_ATRs, stop_loss_prices, take_profit_prices (np.ndarray): One value per trade,
+                with the open, stop loss and take profit prices already rounded to the cent as Trade rounds them.
+            close_reason_codes (np.ndarray): Index into close_reason_names of each trade's close reason.
+            close_reason_names (list): The close reason strings.
+            quantity (float): Quantity of every trade.
+            tz: Time zone the trade times are displayed in.
+        """
+        profit, profit_pct = calculate_profit(open_prices, close_prices, quantity)
+        self.ledger.extend(open_times, close_times, open_prices, close_prices, open_ATRs, quantity, stop_loss_prices,
+                           take_profit_prices, profit, profit_pct, close_reason_codes, close_reason_names, tz)
+
+        # Accumulated in trade order, exactly as adding the trades one by one would
+        self.current_balance = float(np.add.accumulate(np.concatenate([[self.current_balance], profit]))[-1])
+
+
     def update_balance(self, trade):
         self.current_balance += trade.profit
 
 
     def display_trades(self):
-        total_profit = 0
         for tr in self.trades:
-            total_profit = tr.profit + total_profit
             print(tr)
 
 
+    def session_length(self):
+        """
+        Length of the session in nanoseconds, from the first trade's open to the last trade's close
+        when the session times aren't known.
+        """
+        if self.session_open_datetime is not None and self.session_closing_datetime is not None:
+            return (pd.Timestamp(self.session_closing_datetime) - pd.Timestamp(self.session_open_datetime)).value
+        if not len(self.ledger):
+            return 0
+        return int(self.ledger.column('close_time')[-1] - self.ledger.column('open_time')[0])
+
+
+    def calculate_metrics(self, metrics=None):
+        """
+        Calculates session metrics from the ledger's columns, giving the same values as calling the
+        calculate_* methods one by one. Only the requested metrics and the values they depend on are worked
+        out, each once, so e.g. the trade durations are shared by every metric that needs them.
+
+        Args:
+            metrics (iterable): Names of the METRICS to calculate, all of them by default.
+
+        Returns:
+            Trading_session: The session, with the requested metrics set.
+        """
+        metrics = METRICS if metrics is None else metrics
+        values = {}
+
+        def resolve(name):
+            if name not in values:
+                dependencies, calculate = METRICS.get(name) or SESSION_VALUES[name]
+                values[name] = calculate(self, *[resolve(dependency) for dependency in dependencies])
+            return values[name]
+
+        for name in metrics:
+            # Metrics other than the percentage change keep their defaults until there are trades
+            if not len(self.ledger) and name != 'percentage_change_of_strategy':
+                continue
+            value = resolve(name)
+            if value is not None:
+                setattr(self, name, value)
+        return self
+
+
     def calculate_percentage_change_of_strategy(self):
         self.percentage_change_of_strategy = (self.current_balance - self.starting_balance) * 100 / self.starting_balance
 
 
     def calculate_average_duration(self):
         # Check if the trades list is empty
-        if not self.trades:
+        if not len(self.ledger):
             return "00:00:00"  # or return None, or raise an exception as per your needs
 
-        # Calculate total duration in seconds
-        total_seconds = sum(trade.calculate_duration_in_seconds() for trade in self.trades)
-        
-        # Calculate average duration in seconds
-        average_seconds = total_seconds / len(self.trades)
-        
-        # Convert average duration to HH:MM:SS format
-        hours = int(average_seconds // 3600)
-        minutes = int((average_seconds % 3600) // 60)
-        seconds = int(average_seconds % 60)
-        
-        self.average_duration_of_trade = f"{hours:02}:{minutes:02}:{seconds:02}"
+        self.average_duration_of_trade = calculate_average_duration(trade_durations(self.ledger))
 
 
     def calculate_number_of_winning_trades(self):
-        count = 0
-        for tr in self.trades:
-            if tr.profit > WINNING_TRADES_PARAM:
-                count += 1
-        self.number_of_winning_trades = count
+        self.number_of_winning_trades = calculate_number_of_winning_trades(self.ledger.column('profit'))
 
 
     def calculate_normalized_profit(self):
         """
-        Calculate the total percentage profit over the trading session by compounding 
+        Calculate the total percentage profit over the trading session by compounding
         the percentage profit of each trade.
-        
+
         This method considers the position size and compounding effect across multiple trades.
         """
-        compounded_return = 1.0  # Start with a base of 1.0 (equivalent to 100%)
+        self.normalized_profit = calculate_compounded_return(self.ledger.column('profit_pct'))
 
-        for trade in self.trades:
-            trade_return = 1 + (trade.profit_pct / 100)
-            compounded_return *= trade_return  # Compound the return
-        
-        # Subtract 1 to convert from a multiplier back to a percentage
-        self.normalized_profit = (compounded_return - 1) * 100
-    
 
     # Function to calculate Sharpe Ratio
     def calculate_sharpe_ratio_v2(self):
-        excess_returns = []
-        sharpe_cap = 3.0
-        
-        if len(self.trades) == 0:
+        if len(self.ledger) == 0:
             return 0
-        # Calculate excess returns for each trade
-        for trade in self.trades:
-            # Adjusted risk-free return for the time window of the trade
-            delta_days = (trade.close_time - trade.open_time).days
-            annual_rate_decimal = ANNUAL_RISK_FREE_RATE / 100
-            risk_free_return = (1 + annual_rate_decimal) ** (delta_days / 365) - 1
-            
-            # Excess return is the trade profit minus the risk-free return
-            excess_return = trade.profit - risk_free_return
-            excess_returns.append(excess_return)
-        
-        if len(excess_returns) == 0:
-            return 0.0
-        
-        mean_excess_return = np.mean(excess_returns)
-        std_excess_return = np.std(excess_returns)
-        
-        # Handle zero standard deviation case
-        if std_excess_return == 0:
-            if mean_excess_return == 0:
-                return np.nan  # No return, no risk
-            else:
-                return sharpe_cap  
-        
-        sharpe_ratio = mean_excess_return / std_excess_return
-
-        self.sharpe_ratio = min(sharpe_ratio, sharpe_cap)
+
+        excess_returns = calculate_excess_returns(self.ledger.column('profit'), trade_durations(self.ledger))
+        sharpe_ratio = calculate_capped_sharpe_ratio(excess_returns)
+        if sharpe_ratio is not None:
+            self.sharpe_ratio = sharpe_ratio
+
+
+    def calculate_sortino_ratio(self):
+        if len(self.ledger):
+            excess_returns = calculate_excess_returns(self.ledger.column('profit'), trade_durations(self.ledger))
+            self.sortino_ratio = calculate_sortino_ratio(excess_returns)
+
+
+    def calculate_max_drawdown(self):
+        self.max_drawdown = calculate_max_drawdown(self.starting_balance, self.ledger.column('profit'))
+
+
+    def calculate_profit_factor(self):
+        self.profit_factor = calculate_profit_factor(self.ledger.column('profit'))
+
+
+    def calculate_exposure(self):
+        self.exposure = calculate_exposure(trade_durations(self.ledger), self.session_length())
 
 
     def calculate_sharpe_ratio(self):
         """
         Calculate the Sharpe Ratio for the trading session.
-        
+
         The Sharpe Ratio is calculated as the ratio of the excess return (returns over the risk-free rate)
         to the standard deviation of the returns. A higher Sharpe Ratio indicates a better risk-adjusted return.
-        
+
         Args:
             risk_free_rate (float): The risk-free rate to compare against. Defaults to 0.01 (1%).
-        
+
         Returns:
             float: The Sharpe Ratio, or 0 if it cannot be calculated.
 
         Calculation Method:
-        
+
         Scale the risk free rate to be the risk free rate for the time between session_open_datetime and session_close_datetime
         Extract the profit percentages from the trades
         Calculate the mean returns from trades
@@ -143,14 +193,14 @@ class Trading_session:
         excess return = Mean return - scaled risk free rate (scaled from annual rate)
         Handle cases where std dev = 0
         excess return / std dev
-        
+
         """
         delta_days = (self.session_closing_datetime - self.session_open_datetime).days
         annual_rate_decimal = ANNUAL_RISK_FREE_RATE / 100
         adjusted_return_value = (1 + annual_rate_decimal) ** (delta_days / 365) - 1
 
         # Extract the profit percentages from the trades
-        returns = np.array([trade.profit_pct for trade in self.trades])
+        returns = self.ledger.column('profit_pct')
 
         # Check if returns array is empty or contains only zeros
         if returns.size == 0 or np.all(returns == 0):
@@ -173,35 +223,319 @@ class Trading_session:
         sharpe_ratio = excess_return / std_dev
         self.sharpe_ratio = sharpe_ratio
 
-    
-    def get_objectives(self):
-        results = []  
-        
-        if NORMALISED_PROFIT:
-            results.append(self.normalized_profit)
-
-        if SHARPE_RATIO_OBJECTIVE:
-            results.append(self.sharpe_ratio) 
 
-        if NUM_WINNING_TRADES_OBJECTIVE:
-            results.append(self.number_of_winning_trades)
-
-        return tuple(results)
+    def get_objectives(self):
+        return tuple(getattr(self, metric) for metric in objective_metrics())
 
 
     def __str__(self) -> str:
         return (f"\nStarting Balance: ${self.starting_balance:.2f}\n"
                 f"Current Balance: ${self.current_balance:.2f}\n"
-                f"Number of Trades: {len(self.trades)}\n"
+                f"Number of Trades: {len(self.ledger)}\n"
                 f"Number of Winning Trades: {self.number_of_winning_trades}\n"
                 f"Average Trade Duration: {self.average_duration_of_trade}\n"
                 f"Strategy percentage change: {self.percentage_change_of_strategy:.2f}%\n"
                 f"Normalized Profit: {self.normalized_profit:.2f}%\n"
-                f"Sharpe Ratio: {self.sharpe_ratio:.2f}\n")
+                f"Sharpe Ratio: {self.sharpe_ratio:.2f}\n"
+                f"Sortino Ratio: {self.sortino_ratio:.2f}\n"
+                f"Max Drawdown: {self.max_drawdown:.2f}%\n"
+                f"Profit Factor: {self.profit_factor:.2f}\n"
+                f"Exposure: {self.exposure:.2f}%\n")
+
+
+class Trade_ledger:
+    """
+    Columnar record of a session's completed trades, one preallocated NumPy array per field which doubles
+    in size when full, so recording a trade allocates nothing per trade and the session metrics read whole
+    columns at once. Times are int64 nanoseconds since the epoch in UTC and close reasons are codes into
+    close_reasons. Trade objects are only rebuilt from the columns for display.
+    """
+
+    FIELDS = {
+        'open_time': np.int64,
+        'close_time': np.int64,
+        'open_price_of_trade': np.float64,
+        'close_price_of_trade': np.float64,
+        'open_ATR': np.float64,
+        'quantity': np.float64,
+        'value_of_trade': np.float64,
+        'stop_loss_price': np.float64,
+        'take_profit_price': np.float64,
+        'profit': np.float64,
+        'profit_pct': np.float64,
+        'close_reason': np.int16,
+    }
+
+    def __init__(self, capacity=64):
+        self.columns = {field: np.empty(capacity, dtype=dtype) for field, dtype in self.FIELDS.items()}
+        self.length = 0
+        self.tz = None
+        self.close_reasons = []
+        self.close_reason_codes = {}
+        self.alpaca_order_ids = {}  # Ledger index to order id, only live trades have one
+
+    def reserve(self, n):
+        capacity = len(self.columns['profit'])
+        if self.length + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.length + n)
+        for field, values in self.columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.length] = values[:self.length]
+            self.columns[field] = grown
+
+    def close_reason_code(self, close_reason):
+        if close_reason not in self.close_reason_codes:
+            self.close_reason_codes[close_reason] = len(self.close_reasons)
+            self.close_reasons.append(close_reason)
+        return self.close_reason_codes[close_reason]
+
+    def append(self, trade):
+        """
+        Records one closed Trade.
+        """
+        self.reserve(1)
+        open_time = pd.Timestamp(trade.open_time)
+        if self.tz is None:
+            self.tz = open_time.tz
+
+        i = self.length
+        row = self.columns
+        row['open_time'][i] = open_time.as_unit('ns').value
+        row['close_time'][i] = pd.Timestamp(trade.close_time).as_unit('ns').value
+        row['close_reason'][i] = self.close_reason_code(trade.close_reason)
+        for field in ['open_price_of_trade', 'close_price_of_trade', 'open_ATR', 'quantity', 'value_of_trade',
+                      'stop_loss_price', 'take_profit_price', 'profit', 'profit_pct']:
+            row[field][i] = getattr(trade, field)
+        if trade.alpaca_order_id is not None:
+            self.alpaca_order_ids[i] = trade.alpaca_order_id
+        self.length += 1
+
+    def extend(self, open_times, close_times, open_prices, close_prices, open_ATRs, quantity, stop_loss_prices,
+               take_profit_prices, profit, profit_pct, close_reason_codes, close_reason_names, tz=None):
+        """
+        Records many closed trades from arrays, see Trading_session.add_trades.
+        """
+        n = len(open_times)
+        self.reserve(n)
+        if self.tz is None:
+            self.tz = tz
+
+        codes = np.array([self.close_reason_code(name) for name in close_reason_names], dtype=np.int16)
+        values = {
+            'open_time': open_times,
+            'close_time': close_times,
+            'open_price_of_trade': open_prices,
+            'close_price_of_trade': close_prices,
+            'open_ATR': open_ATRs,
+            'quantity': quantity,
+            'value_of_trade': open_prices * quantity,
+            'stop_loss_price': stop_loss_prices,
+            'take_profit_price': take_profit_prices,
+            'profit': profit,
+            'profit_pct': profit_pct,
+            'close_reason': codes[np.asarray(close_reason_codes, dtype=np.int64)] if n else codes[:0],
+        }
+        for field, field_values in values.items():
+            self.columns[field][self.length:self.length + n] = field_values
+        self.length += n
+
+    def column(self, field):
+        """
+        Returns a read-only view of one field of every recorded trade.
+        """
+        view = self.columns[field][:self.length]
+        view.flags.writeable = False
+        return view
+
+    def to_timestamp(self, nanoseconds):
+        timestamp = pd.Timestamp(nanoseconds, tz='UTC')
+        return timestamp.tz_convert(self.tz) if self.tz is not None else timestamp.tz_localize(None)
 
+    def to_trades(self):
+        """
+        Rebuilds a Trade object for every recorded trade.
+        """
+        columns = {field: self.column(field).tolist() for field in self.FIELDS}
+        trades = []
+        for i in range(self.length):
+            trade = Trade.__new__(Trade)
+            for field in ['open_price_of_trade', 'close_price_of_trade', 'open_ATR', 'quantity', 'value_of_trade',
+                          'stop_loss_price', 'take_profit_price', 'profit', 'profit_pct']:
+                setattr(trade, field, columns[field][i])
+            trade.open_time = self.to_timestamp(columns['open_time'][i])
+            trade.close_time = self.to_timestamp(columns['close_time'][i])
+            trade.close_reason = self.close_reasons[columns['close_reason'][i]]
+            trade.alpaca_order_id = self.alpaca_order_ids.get(i)
+            trades.append(trade)
+        return trades
+
+    def __len__(self):
+        return self.length
+
+
+def calculate_profit(open_price, close_price, quantity):
+    """
+    Profit and profit percentage of trades, for single prices or arrays of them.
+    """
+    profit = (close_price - open_price) * quantity
+    profit_pct = ((close_price - open_price) / open_price) * 100
+    return profit, profit_pct
+
+
+def format_duration(total_seconds):
+    # Format a number of seconds as HH:MM:SS
+    hours = int(total_seconds // 3600)
+    minutes = int((total_seconds % 3600) // 60)
+    seconds = int(total_seconds % 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+
+# Ratios are capped so a handful of lucky trades can't dominate an optimisation
+RATIO_CAP = 3.0
+
+
+def trade_durations(ledger):
+    # Duration of every trade in int64 nanoseconds
+    return ledger.column('close_time') - ledger.column('open_time')
+
+
+def calculate_average_duration(durations):
+    """
+    Average of the trade durations, each truncated to whole seconds, formatted as HH:MM:SS.
+    """
+    total_seconds = int(np.sum(durations // NANOSECONDS_PER_SECOND))
+    return format_duration(total_seconds / len(durations))
+
+
+def calculate_number_of_winning_trades(profit):
+    return int(np.count_nonzero(profit > WINNING_TRADES_PARAM))
+
+
+def calculate_compounded_return(profit_pct):
+    """
+    Percentage return of reinvesting through every trade in turn.
+    """
+    if not len(profit_pct):
+        return 0.0
+
+    # Start with a base of 1.0 (equivalent to 100%), then convert from a multiplier back to a percentage
+    compounded_return = float(np.prod(1 + (profit_pct / 100)))
+    return (compounded_return - 1) * 100
+
+
+def calculate_excess_returns(profit, durations):
+    """
+    Profit of each trade minus the risk-free return over the trade, in whole days as timedelta.days counts them.
+    """
+    delta_days = durations // NANOSECONDS_PER_DAY
+    annual_rate_decimal = ANNUAL_RISK_FREE_RATE / 100
+
+    # Python's float pow, once per distinct trade length
+    unique_days, day_index = np.unique(delta_days, return_inverse=True)
+    risk_free_returns = np.array([(1 + annual_rate_decimal) ** (days / 365) - 1 for days in unique_days.tolist()])
+    return profit - risk_free_returns[day_index]
+
+
+def calculate_capped_sharpe_ratio(excess_returns):
+    """
+    Returns:
+        float: Mean over standard deviation of the excess returns capped at RATIO_CAP, or None when the
+            deviation is zero, in which case the session's Sharpe ratio is left as it was.
+    """
+    std_excess_return = np.std(excess_returns)
+    if std_excess_return == 0:
+        return None
+    return min(np.mean(excess_returns) / std_excess_return, RATIO_CAP)
+
+
+def calculate_sortino_ratio(excess_returns):
+    """
+    Mean excess return over the downside deviation, which only counts the losing excess returns, capped at RATIO_CAP.
+    """
+    mean_excess_return = np.mean(excess_returns)
+    downside_deviation = np.sqrt(np.mean(np.minimum(excess_returns, 0) ** 2))
+    if downside_deviation == 0:
+        return RATIO_CAP if mean_excess_return > 0 else 0.0
+    return float(min(mean_excess_return / downside_deviation, RATIO_CAP))
+
+
+def calculate_max_drawdown(starting_balance, profit):
+    """
+    Largest fall of the balance after a trade from its highest point so far, as a percentage of that high.
+    """
+    balance = np.add.accumulate(np.concatenate([[starting_balance], profit]))
+    peak = np.maximum.accumulate(balance)
+    return float(np.max((peak - balance) / peak) * 100)
+
+
+def calculate_profit_factor(profit):
+    """
+    Gross profit over gross loss, infinite when there are winning trades but no losing ones.
+    """
+    gross_profit = float(np.sum(profit[profit > 0]))
+    gross_loss = -float(np.sum(profit[profit < 0]))
+    if gross_loss == 0:
+        return float('inf') if gross_profit > 0 else 0.0
+    return gross_profit / gross_loss
+
+
+def calculate_exposure(durations, session_length):
+    """
+    Percentage of the session, session_length nanoseconds long, spent in a trade.
+    """
+    if not len(durations) or session_length <= 0:
+        return 0.0
+    return float(np.sum(durations)) * 100 / session_length
+
+
+# Intermediate values the metrics share, each as (dependencies, calculate(session, *dependency values))
+SESSION_VALUES = {
+    'profit': ((), lambda session: session.ledger.column('profit')),
+    'profit_pct': ((), lambda session: session.ledger.column('profit_pct')),
+    'durations': ((), lambda session: trade_durations(session.ledger)),
+    'excess_returns': (('profit', 'durations'), lambda session, profit, durations: calculate_excess_returns(profit, durations)),
+}
+
+# Trading_session attributes calculate_metrics can set, in the order they are displayed. A metric calculating
+# to None leaves its attribute as it was
+METRICS = {
+    'percentage_change_of_strategy': ((), lambda session: (session.current_balance - session.starting_balance) * 100 / session.starting_balance),
+    'average_duration_of_trade': (('durations',), lambda session, durations: calculate_average_duration(durations)),
+    'number_of_winning_trades': (('profit',), lambda session, profit: calculate_number_of_winning_trades(profit)),
+    'normalized_profit': (('profit_pct',), lambda session, profit_pct: calculate_compounded_return(profit_pct)),
+    'sharpe_ratio': (('excess_returns',), lambda session, excess_returns: calculate_capped_sharpe_ratio(excess_returns)),
+    'sortino_ratio': (('excess_returns',), lambda session, excess_returns: calculate_sortino_ratio(excess_returns)),
+    'max_drawdown': (('profit',), lambda session, profit: calculate_max_drawdown(session.starting_balance, profit)),
+    'profit_factor': (('profit',), lambda session, profit: calculate_profit_factor(profit)),
+    'exposure': (('durations',), lambda session, durations: calculate_exposure(durations, session.session_length())),
+}
+
+
+def objective_metrics():
+    """
+    Names of the metrics Trading_session.get_objectives returns, as enabled in globals.
+    """
+    objectives = []
+
+    if NORMALISED_PROFIT:
+        objectives.append('normalized_profit')
+
+    if SHARPE_RATIO_OBJECTIVE:
+        objectives.append('sharpe_ratio')
+
+    if NUM_WINNING_TRADES_OBJECTIVE:
+        objectives.append('number_of_winning_trades')
+
+    return objectives
+
+
+class Trade:
+
+    __slots__ = ('open_time', 'close_time', 'open_price_of_trade', 'close_price_of_trade', 'open_ATR', 'quantity',
+                 'value_of_trade', 'stop_loss_price', 'take_profit_price', 'profit_pct', 'profit', 'close_reason',
+                 'alpaca_order_id')
 
-class Trade(Trading_session):
-    
     def __init__(self,
                  open_price_of_trade: float,
                  open_ATR: float,
@@ -221,11 +555,10 @@ class Trade(Trading_session):
         self.stop_loss_price = self.calculate_ATR_stop_loss_price()
         self.take_profit_price = self.calculate_ATR_take_profit_price()
         self.profit_pct = 0
-        self.duration = 0
         self.profit = 0
         self.close_reason = ""
         self.alpaca_order_id = alpaca_order_id
-    
+
     def calculate_value_of_trade(self) -> float:
         """
         """
@@ -235,36 +568,34 @@ class Trade(Trading_session):
         """
         Calculate the profit of the trade and profit percentage
         """
-        profit = (self.close_price_of_trade - self.open_price_of_trade) * self.quantity
-        profit_pct = ((self.close_price_of_trade - self.open_price_of_trade) / self.open_price_of_trade) * 100
-        return profit, profit_pct
-        
-        
+        return calculate_profit(self.open_price_of_trade, self.close_price_of_trade, self.quantity)
+
+    @property
+    def duration(self):
+        # Formatted only when displayed, 0 until the trade is closed
+        if self.close_time is None:
+            return 0
+        return self.calculate_duration()
+
     def calculate_duration(self):
         # Calculate the duration as a timedelta object
         duration = self.close_time - self.open_time
-        
-        # Extract hours, minutes, and seconds from the timedelta object
-        total_seconds = int(duration.total_seconds())
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        
+
         # Format duration as HH:MM:SS
-        return f"{hours:02}:{minutes:02}:{seconds:02}"
-    
-    
+        return format_duration(int(duration.total_seconds()))
+
+
     def calculate_duration_in_seconds(self):
         duration = self.close_time - self.open_time
         return int(duration.total_seconds())
-    
+
 
     def calculate_ATR_take_profit_price(self):
         ATR_stop_loss_distance = self.open_ATR * ATR_MULTIPLIER
         ATR_take_profit_distance = ATR_stop_loss_distance * RISK_REWARD_RATIO
         ATR_take_profit_price = self.open_price_of_trade + ATR_take_profit_distance
         return round(ATR_take_profit_price, 2)
-    
+
 
     def calculate_ATR_stop_loss_price(self):
         ATR_stop_loss_distance = self.open_ATR * ATR_MULTIPLIER
@@ -277,10 +608,15 @@ class Trade(Trading_session):
         if self.close_price_of_trade == 0:
             self.close_price_of_trade = close_price
         self.profit, self.profit_pct = self.calculate_profit()
-        self.duration = self.calculate_duration()
         self.close_reason = close_reason
         return self
-    
+
+
+    def to_dict(self):
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields['duration'] = self.duration
+        return fields
+
 
     def __str__(self):
         # Prepare the data for tabulation
@@ -302,4 +638,4 @@ class Trade(Trading_session):
         ]
 
         # Create and return the formatted table
-        return tabulate(table_data, headers=["Attribute", "Value"], tablefmt="grid")
\ No newline at end of file
+        return tabulate(table_data, headers=["Attribute", "Value"], tablefmt="grid")